@@ -0,0 +1,60 @@
+"""
+Micro-benchmark of whisperx.assign_word_speakers on synthetic diarization output. That it assigns the
+same speakers as the previous implementation, which rebuilt the intersection columns for every
+segment and word, is checked in submodules/whisperX/tests/test_diarize.py.
+
+    python scripts/bench_assign_word_speakers.py --turns 10000 --segments 2000
+"""
+import argparse
+import copy
+import time
+
+import numpy as np
+import pandas as pd
+from whisperx.diarize import assign_word_speakers
+
+
+def synthetic_inputs(num_turns, num_segments, num_speakers, seed=0):
+    rng = np.random.default_rng(seed)
+    durations = rng.uniform(0.5, 10, num_turns)
+    gaps = rng.uniform(-0.5, 1.5, num_turns)
+    starts = np.cumsum(durations + gaps) - durations
+    diarize_df = pd.DataFrame({
+        'start': starts,
+        'end': starts + durations,
+        'speaker': [f'SPEAKER_{i:02d}' for i in rng.integers(num_speakers, size=num_turns)],
+    })
+    total = float(diarize_df['end'].max())
+    segments = []
+    for start in np.sort(rng.uniform(0, total, num_segments)):
+        end = start + rng.uniform(1, 15)
+        word_starts = np.sort(rng.uniform(start, end, 10))
+        words = [{'word': 'w', 'start': s, 'end': min(s + 0.4, end)} for s in word_starts]
+        segments.append({'start': start, 'end': end, 'words': words})
+    return diarize_df, {'segments': segments}
+
+
+def timed(fn):
+    begin = time.time()
+    out = fn()
+    return time.time() - begin, out
+
+
+def main():
+    parser = argparse.ArgumentParser("bench_assign_word_speakers")
+    parser.add_argument("--turns", type=int, default=10000)
+    parser.add_argument("--segments", type=int, default=2000)
+    parser.add_argument("--speakers", type=int, default=6)
+    args = parser.parse_args()
+
+    diarize_df, transcript = synthetic_inputs(args.turns, args.segments, args.speakers)
+    num_words = sum(len(seg['words']) for seg in transcript['segments'])
+    print(f"{args.turns} turns, {args.segments} segments, {num_words} words")
+    print(f"{'fill_nearest':>12} {'time':>8} {'words/s':>10}")
+    for fill_nearest in (False, True):
+        elapsed, _ = timed(lambda: assign_word_speakers(diarize_df, copy.deepcopy(transcript), fill_nearest))
+        print(f"{str(fill_nearest):>12} {elapsed:>7.2f}s {num_words / elapsed:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Throughput of tools.cn_tx.TextNorm on a synthetic corpus of TTS sentences, against the previous
+normalize_nsw that compiled its patterns on every call, rebuilt the number system for every number
+and had no memo. Outputs are compared sentence by sentence.
+
+    python -m scripts.bench_cn_tx --sentences 100000 --distinct 20000
+"""
+import argparse
+import contextlib
+import random
+import re
+import time
+
+from tools import cn_tx
+from tools.cn_tx import (COM_QUANTIFIERS, CURRENCY_UNITS, Cardinal, Date, Digit, Fraction, Money, Percentage,
+                         TelePhone, TextNorm)
+
+
+def reference_normalize_nsw(raw_text):
+    text = '^' + raw_text + '$'
+    rules = [
+        (r"\D+((([089]\d|(19|20)\d{2})年)?(\d{1,2}月(\d{1,2}[日号])?)?)", lambda m: Date(date=m).date2chntext(), 0),
+        (r"\D+((\d+(\.\d+)?)[多余几]?" + CURRENCY_UNITS + r"(\d" + CURRENCY_UNITS + r"?)?)",
+         lambda m: Money(money=m).money2chntext(), 0),
+        (r"\D((\+?86 ?)?1([38]\d|5[0-35-9]|7[678]|9[89])\d{8})\D",
+         lambda m: TelePhone(telephone=m).telephone2chntext(), 0),
+        (r"\D((0(10|2[1-3]|[3-9]\d{2})-?)?[1-9]\d{6,7})\D",
+         lambda m: TelePhone(telephone=m).telephone2chntext(fixed=True), 0),
+        (r"(\d+/\d+)", lambda m: Fraction(fraction=m).fraction2chntext(), None),
+        ('％', None, None),
+        (r"(\d+(\.\d+)?%)", lambda m: Percentage(percentage=m).percentage2chntext(), 0),
+        (r"(\d+(\.\d+)?)[多余几]?" + COM_QUANTIFIERS, lambda m: Cardinal(cardinal=m).cardinal2chntext(), 0),
+        (r"(\d{4,32})", lambda m: Digit(digit=m).digit2chntext(), None),
+        (r"(\d+(\.\d+)?)", lambda m: Cardinal(cardinal=m).cardinal2chntext(), 0),
+        (r"(([a-zA-Z]+)二([a-zA-Z]+))", lambda m: None, 'particular'),
+    ]
+    for pattern, convert, group in rules:
+        if convert is None:
+            text = text.replace('％', '%')
+            continue
+        for matcher in re.compile(pattern).findall(text):
+            if group == 'particular':
+                text = text.replace(matcher[0], matcher[1] + '2' + matcher[2], 1)
+                continue
+            if group is not None:
+                matcher = matcher[group]
+            text = text.replace(matcher, convert(matcher), 1)
+    return text.lstrip('^').rstrip('$')
+
+
+@contextlib.contextmanager
+def reference_mode():
+    """Run TextNorm the way it used to: uncompiled rules, a new number system per number, no caches."""
+    saved = cn_tx.num2chn, cn_tx._cached_system, cn_tx.cached_normalize_nsw
+    cn_tx.num2chn, cn_tx._cached_system = cn_tx.num2chn.__wrapped__, cn_tx.create_system
+    cn_tx.cached_normalize_nsw = reference_normalize_nsw
+    try:
+        yield
+    finally:
+        cn_tx.num2chn, cn_tx._cached_system, cn_tx.cached_normalize_nsw = saved
+
+
+def clear_caches():
+    cn_tx.num2chn.cache_clear()
+    cn_tx.cached_normalize_nsw.cache_clear()
+
+
+def synthetic_corpus(num_sentences, num_distinct, seed=0):
+    rng = random.Random(seed)
+    words = ['今天', '我们', '大家', '这个', '视频', '里面', '一共', '大约', '价格是', '电话', '增长了', '的', '，', '。']
+    numbers = [
+        lambda: f'{rng.randrange(1990, 2030)}年{rng.randrange(1, 13)}月{rng.randrange(1, 29)}日',
+        lambda: f'{rng.randrange(1, 10000)}{rng.choice(["元", "万元", "块", "美元"])}',
+        lambda: f'1{rng.choice("3589")}{rng.randrange(10 ** 9):09d}',
+        lambda: f'{rng.randrange(1, 10)}/{rng.randrange(2, 20)}',
+        lambda: f'{rng.randrange(100)}.{rng.randrange(10)}%',
+        lambda: f'{rng.randrange(1, 500)}{rng.choice(["个", "公里", "千克", "天", "年"])}',
+        lambda: str(rng.randrange(10 ** 6)),
+        lambda: rng.choice(['P2P', 'B2B', 'O2O']),
+    ]
+    distinct = []
+    for _ in range(num_distinct):
+        parts = [rng.choice(numbers)() if rng.random() < 0.3 else rng.choice(words) for _ in range(rng.randrange(4, 20))]
+        distinct.append(''.join(parts))
+    return [rng.choice(distinct) for _ in range(num_sentences)]
+
+
+def timed(fn):
+    begin = time.time()
+    out = fn()
+    return time.time() - begin, out
+
+
+def main():
+    parser = argparse.ArgumentParser("bench_cn_tx")
+    parser.add_argument("--sentences", type=int, default=100000)
+    parser.add_argument("--distinct", type=int, default=20000, help="distinct sentences the corpus is drawn from")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = synthetic_corpus(args.sentences, args.distinct, args.seed)
+    normalizer = TextNorm()
+    with reference_mode():
+        ref_time, reference = timed(lambda: [normalizer(text) for text in corpus])
+    clear_caches()
+    cold_time, cold = timed(lambda: [normalizer(text) for text in sorted(set(corpus))])
+    clear_caches()
+    call_time, called = timed(lambda: [normalizer(text) for text in corpus])
+    clear_caches()
+    batch_time, batched = timed(lambda: normalizer.batch(corpus))
+
+    same = reference == called == batched and dict(zip(sorted(set(corpus)), cold)) == dict(zip(corpus, reference))
+    print(f"{len(corpus)} sentences, {len(set(corpus))} distinct, outputs identical: {same}")
+    print(f"{'mode':>22} {'time':>8} {'sentences/s':>12}")
+    for name, seconds, count in [('reference', ref_time, len(corpus)),
+                                 ('new, distinct only', cold_time, len(set(corpus))),
+                                 ('new, __call__', call_time, len(corpus)),
+                                 ('new, batch', batch_time, len(corpus))]:
+        print(f"{name:>22} {seconds:>7.2f}s {count / seconds:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
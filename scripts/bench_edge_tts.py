@@ -0,0 +1,62 @@
+"""
+Wall time of synthesizing a transcript with Edge-TTS against the local fake service. The previous
+tts ran `edge-tts` through os.system once per sentence, paying an interpreter start and an import
+of edge_tts each time, strictly in series; that path is timed as one in-process synthesis per
+sentence plus a measured interpreter start. tools.step044_tts_edge_tts.tts_batch is then timed
+at several concurrency caps.
+
+    python -m scripts.bench_edge_tts --sentences 100 --latency 0.3 --concurrency 4 8 16
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from loguru import logger
+
+from scripts.fake_edge_tts_server import FakeEdgeTTSServer
+from tools.step044_tts_edge_tts import tts_batch
+
+
+def timed(fn):
+    begin = time.time()
+    out = fn()
+    return time.time() - begin, out
+
+
+def main():
+    parser = argparse.ArgumentParser("bench_edge_tts")
+    parser.add_argument("--sentences", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--failure-rate", type=float, default=0.02)
+    parser.add_argument("--concurrency", type=int, nargs='+', default=[4, 8, 16])
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level='ERROR')
+
+    texts = [f'这是第{i}句测试文本，用来比较合成的速度。' for i in range(args.sentences)]
+    startup = min(timed(lambda: subprocess.run([sys.executable, '-c', 'import edge_tts'], check=True))[0]
+                  for _ in range(3))
+    rows = []
+    with FakeEdgeTTSServer(latency=args.latency, failure_rate=args.failure_rate) as server, server.patch():
+        for concurrency in [1] + args.concurrency:
+            with tempfile.TemporaryDirectory() as folder:
+                paths = [os.path.join(folder, f'{str(i).zfill(4)}.wav') for i in range(len(texts))]
+                server.reset()
+                seconds, _ = timed(lambda: tts_batch(texts, paths, concurrency=concurrency))
+                written = sum(os.path.exists(path.replace('.wav', '.mp3')) for path in paths)
+                rows.append((f'concurrency {concurrency}', seconds, server.stats, written))
+    reference_time = rows[0][1] + startup * len(texts)
+
+    print(f"{len(texts)} sentences, {args.latency:.2f}s service latency, {args.failure_rate:.0%} dropped, "
+          f"interpreter start {startup:.2f}s")
+    print(f"{'path':>16} {'time':>8} {'connections':>12} {'in flight':>10} {'written':>8}")
+    print(f"{'os.system':>16} {reference_time:>7.2f}s {'':>12} {1:>10} {'':>8}")
+    for name, seconds, stats, written in rows:
+        print(f"{name:>16} {seconds:>7.2f}s {stats['connections']:>12} {stats['max_active']:>10} {written:>8}")
+
+
+if __name__ == "__main__":
+    main()
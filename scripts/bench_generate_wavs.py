@@ -0,0 +1,127 @@
+"""
+Wall time of generate_wavs with a simulated TTS model: the previous order, which synthesized every
+line, then laid out the timeline and stretched all sentences in one batch, against the pipeline in
+tools.step040_tts, where fitting and placing a window overlap the synthesis of the next one. The
+model is the EdgeTTS path with tts_batch replaced by one that sleeps --seconds-per-line per line,
+releasing the GIL like a GPU call, and writes a synthetic sentence. Both paths must give the same
+audio.
+
+    python -m scripts.bench_generate_wavs --lines 300 --seconds-per-line 0.05
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import tools.step040_tts as step040
+from tools.utils import save_wav
+
+SAMPLE_RATE = 24000
+
+
+def synthetic_sentence(rng, seconds):
+    # Same signal as scripts.bench_time_stretch, which needs audiostretchy to import
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    pitch = rng.uniform(100, 250) * (1 + 0.1 * np.sin(2 * np.pi * rng.uniform(0.5, 2) * t))
+    phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+    wav = sum(np.sin(h * phase) / h for h in range(1, 6))
+    envelope = (np.sin(2 * np.pi * rng.uniform(2, 4) * t) > -0.6).astype(float)
+    return (0.3 * wav * envelope + 0.005 * rng.standard_normal(len(t))).astype(np.float32)
+
+
+def make_folder(folder, lines, seed=0):
+    rng = np.random.default_rng(seed)
+    transcript, t = [], 0.
+    for i in range(lines):
+        length = rng.uniform(1., 6.)
+        transcript.append({'start': t, 'end': t + length, 'text': 'Hello there.', 'speaker': 'SPEAKER_00',
+                           'translation': f'这是第{i}句，' + '测试' * int(rng.integers(3, 20))})
+        t += length + rng.uniform(0., 1.)
+    with open(os.path.join(folder, 'translation.json'), 'w', encoding='utf-8') as f:
+        json.dump(transcript, f, ensure_ascii=False)
+    for name in ['audio_vocals.wav', 'audio_instruments.wav']:
+        save_wav((0.1 * rng.standard_normal(int(t * SAMPLE_RATE))).astype(np.float32), os.path.join(folder, name))
+
+
+def fake_tts_batch(seconds_per_line):
+    def tts_batch(texts, output_paths, target_language='中文', voice='zh-CN-XiaoxiaoNeural'):
+        for text, output_path in zip(texts, output_paths):
+            if os.path.exists(output_path):
+                continue
+            time.sleep(seconds_per_line)
+            rng = np.random.default_rng(int(os.path.basename(output_path)[:4]))
+            save_wav(synthetic_sentence(rng, 0.25 * len(text)), output_path)
+    return tts_batch
+
+
+def reference_generate_wavs(folder):
+    # Synthesis of every line, then the layout and a single stretch of all sentences
+    with open(os.path.join(folder, 'translation.json'), 'r', encoding='utf-8') as f:
+        transcript = json.load(f)
+    os.makedirs(os.path.join(folder, 'wavs'), exist_ok=True)
+    output_paths = [os.path.join(folder, 'wavs', f'{str(i).zfill(4)}.wav') for i in range(len(transcript))]
+    step040.edge_tts_batch([step040.preprocess_text(line['translation']) for line in transcript], output_paths)
+    wavs, desired_lengths, offsets = [], [], []
+    timeline_end = 0
+    for i, line in enumerate(transcript):
+        start, end = line['start'], line['end']
+        length = end - start
+        last_end = timeline_end / 24000
+        timeline_end += int((start - last_end) * 24000) if start > last_end else 0
+        offsets.append(timeline_end)
+        start = timeline_end / 24000
+        if i < len(transcript) - 1:
+            end = min(start + length, transcript[i + 1]['end'])
+        wav = step040.load_tts_wav(output_paths[i])
+        timeline_end += int(len(wav) / 24000 * step040.fit_speed_factor(len(wav) / 24000, end - start) * 24000)
+        wavs.append(wav)
+        desired_lengths.append(end - start)
+    full_wav = np.zeros(timeline_end, dtype=np.float32)
+    for offset, wav in zip(offsets, step040.adjust_audio_lengths(wavs, desired_lengths)[0]):
+        full_wav[offset:offset + len(wav)] = wav
+    return full_wav
+
+
+def timed(fn):
+    begin = time.time()
+    out = fn()
+    return time.time() - begin, out
+
+
+def main():
+    parser = argparse.ArgumentParser("bench_generate_wavs")
+    parser.add_argument("--lines", type=int, default=300)
+    parser.add_argument("--seconds-per-line", type=float, default=0.05)
+    parser.add_argument("--fit-workers", type=int, default=2)
+    args = parser.parse_args()
+    step040.edge_tts_batch = fake_tts_batch(args.seconds_per_line)
+    step040.edge_tts = lambda *_, **__: None
+
+    folder = tempfile.mkdtemp()
+    try:
+        make_folder(folder, args.lines)
+        ref_time, ref_wav = timed(lambda: reference_generate_wavs(folder))
+        shutil.rmtree(os.path.join(folder, 'wavs'))
+        new_time, _ = timed(lambda: step040.generate_wavs('EdgeTTS', folder, fit_workers=args.fit_workers))
+        new_wav = step040.load_tts_wav(os.path.join(folder, 'audio_tts.wav'))
+        # audio_tts.wav is normalized to the vocals and written as 16 bit
+        vocal_wav = step040.load_tts_wav(os.path.join(folder, 'audio_vocals.wav'))
+        ref_wav = ref_wav * step040.peak(vocal_wav) / step040.peak(ref_wav)
+        max_error = float(np.max(np.abs(new_wav - ref_wav))) if len(new_wav) == len(ref_wav) else float('inf')
+    finally:
+        shutil.rmtree(folder)
+
+    print(f"{args.lines} lines, {args.seconds_per_line:.3f}s of synthesis per line, "
+          f"{args.fit_workers} fitting workers")
+    print(f"{'path':>12} {'time':>8}")
+    print(f"{'sequential':>12} {ref_time:>7.2f}s")
+    print(f"{'pipelined':>12} {new_time:>7.2f}s")
+    print(f"speedup {ref_time / new_time:.2f}x, max difference {max_error:.1e}")
+
+
+if __name__ == "__main__":
+    main()
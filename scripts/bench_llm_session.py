@@ -0,0 +1,106 @@
+"""
+Per-line latency of translating a transcript with the local Qwen model the way _translate_line
+does: fixed system prompt and few-shot examples, the last 30 history turns and the new line. The
+previous llm_response, which re-prefilled the whole chat and allowed 512 new tokens every call, is
+compared with LLMSession reusing the KV cache of the shared prefix, and with LLMSession answering
+independent lines in batches.
+
+    python -m scripts.bench_llm_session --model models/LLM/Qwen1.5-4B-Chat --lines 40 --device cpu
+"""
+import argparse
+import time
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from tools.step032_translation_llm import LLMSession
+
+SYSTEM = ('You are an expert in the field of this video.\nThis is a video called "Benchmark". A talk about how '
+          'neural networks learn from data, with examples from vision and language.\nTranslate the sentence into '
+          '简体中文. 下面我让你来充当翻译家，你的目标是把任何语言翻译成简体中文，请翻译时不要带翻译腔，而是要翻译得自然、流畅和地道，'
+          '使用优美和高雅的表达方式。确保翻译正确和简洁。注意信达雅。')
+FIXED_MESSAGE = [
+    {'role': 'system', 'content': SYSTEM},
+    {'role': 'user', 'content': '使用地道的简体中文Translate:"Knowledge is power."'},
+    {'role': 'assistant', 'content': '翻译：“知识就是力量。”'},
+    {'role': 'user', 'content': '使用地道的简体中文Translate:"To be or not to be, that is the question."'},
+    {'role': 'assistant', 'content': '翻译：“生存还是毁灭，这是一个值得考虑的问题。”'},
+]
+
+
+def synthetic_lines(num_lines):
+    words = ['today', 'we', 'are', 'going', 'to', 'look', 'at', 'how', 'the', 'model', 'learns', 'from', 'data']
+    return [' '.join(words[(i + j) % len(words)] for j in range(6 + i % 9)).capitalize() + '.'
+            for i in range(num_lines)]
+
+
+def reference_response(model, tokenizer, messages):
+    text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
+    generated_ids = model.generate(model_inputs.input_ids, attention_mask=model_inputs.attention_mask,
+                                   max_new_tokens=512)
+    generated_ids = generated_ids[:, model_inputs.input_ids.shape[1]:]
+    return tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0], generated_ids.shape[1]
+
+
+def translate_sequentially(respond, lines):
+    history = []
+    translations = []
+    for text in lines:
+        messages = FIXED_MESSAGE + history[-30:] + [{'role': 'user', 'content': f'Translate:"{text}"'}]
+        translation = respond(messages)
+        translations.append(translation)
+        history.append({'role': 'user', 'content': f'Translate:"{text}"'})
+        history.append({'role': 'assistant', 'content': translation})
+    return translations
+
+
+def timed(fn):
+    begin = time.time()
+    out = fn()
+    return time.time() - begin, out
+
+
+def main():
+    parser = argparse.ArgumentParser("bench_llm_session")
+    parser.add_argument("--model", default='models/LLM/Qwen1.5-4B-Chat')
+    parser.add_argument("--lines", type=int, default=40)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--device", default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModelForCausalLM.from_pretrained(args.model, torch_dtype="auto").to(args.device).eval()
+    # Greedy decoding so the three paths translate the same way
+    model.generation_config.do_sample = False
+    lines = synthetic_lines(args.lines)
+
+    reference_tokens = []
+    def reference(messages):
+        response, generated = reference_response(model, tokenizer, messages)
+        reference_tokens.append(generated)
+        return response
+    with torch.no_grad():
+        ref_time, reference_translations = timed(lambda: translate_sequentially(reference, lines))
+
+    session = LLMSession(model, tokenizer)
+    session_time, session_translations = timed(lambda: translate_sequentially(session.response, lines))
+    session_stats = dict(session.stats)
+
+    batch_session = LLMSession(model, tokenizer)
+    batches = [[FIXED_MESSAGE + [{'role': 'user', 'content': f'Translate:"{text}"'}] for text in lines[i:i + args.batch_size]]
+               for i in range(0, len(lines), args.batch_size)]
+    batch_time, _ = timed(lambda: [batch_session.batch_response(batch) for batch in batches])
+
+    same = sum(a == b for a, b in zip(reference_translations, session_translations))
+    print(f"{len(lines)} lines on {args.device}, {same}/{len(lines)} translations identical to the reference")
+    print(f"prompt tokens reused {session_stats['reused_tokens']}, prefilled {session_stats['prefill_tokens']}")
+    print(f"{'path':>24} {'time':>8} {'ms/line':>8} {'tokens/s':>9}")
+    for name, seconds, tokens in [('reference', ref_time, sum(reference_tokens)),
+                                  ('session', session_time, session_stats['generated_tokens']),
+                                  (f'batches of {args.batch_size}', batch_time, batch_session.stats['generated_tokens'])]:
+        print(f"{name:>24} {seconds:>7.2f}s {1000 * seconds / len(lines):>8.0f} {tokens / seconds:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
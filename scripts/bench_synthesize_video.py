@@ -0,0 +1,112 @@
+"""
+Render time of synthesize_video on a synthetic clip made with ffmpeg's test sources: the previous
+three libx264/aac passes (speed and watermark, background music, subtitles) against the single
+filter graph. Needs ffmpeg with libx264 and libass, and ffprobe.
+
+    python -m scripts.bench_synthesize_video --seconds 60 --resolution 720p --preset medium
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from tools.step050_synthesize_video import (convert_resolution, generate_srt, get_aspect_ratio,
+                                            synthesize_video)
+
+
+def reference_synthesize_video(folder, subtitles=True, speed_up=1.00, fps=30, resolution='1080p',
+                               background_music=None, watermark_path=None, bgm_volume=0.5, video_volume=1.0):
+    input_audio = os.path.join(folder, 'audio_combined.wav')
+    input_video = os.path.join(folder, 'download.mp4')
+    with open(os.path.join(folder, 'translation.json'), 'r', encoding='utf-8') as f:
+        translation = json.load(f)
+    srt_path = os.path.join(folder, 'subtitles.srt')
+    final_video = os.path.join(folder, 'video_reference.mp4')
+    generate_srt(translation, srt_path, speed_up)
+    width, height = convert_resolution(get_aspect_ratio(input_video), resolution)
+    font_size = int(width/128)
+    outline = int(round(font_size/8))
+    subtitle_filter = f"subtitles={srt_path}:fontsdir=./font:force_style='FontName=SimHei,FontSize={font_size},PrimaryColour=&HFFFFFF,OutlineColour=&H000000,Outline={outline},WrapStyle=2'"
+    filter_complex = f"[0:v]setpts=PTS/{speed_up}[v];[1:a]atempo={speed_up}[a]"
+    inputs = ['-i', input_video, '-i', input_audio]
+    if watermark_path:
+        inputs += ['-i', watermark_path]
+        filter_complex += ";[2:v]scale=iw*0.15:ih*0.15[wm];[v][wm]overlay=W-w-10:H-h-10[v]"
+    quiet = ['-hide_banner', '-loglevel', 'error']
+    subprocess.run(['ffmpeg', *quiet, *inputs, '-filter_complex', filter_complex, '-map', '[v]', '-map', '[a]',
+                    '-r', str(fps), '-s', f'{width}x{height}', '-c:v', 'libx264', '-c:a', 'aac', final_video, '-y'],
+                   check=True)
+    time.sleep(1)
+    if background_music:
+        with_bgm = final_video.replace('.mp4', '_bgm.mp4')
+        subprocess.run(['ffmpeg', *quiet, '-i', final_video, '-i', background_music, '-filter_complex',
+                        f'[0:a]volume={video_volume}[v0];[1:a]volume={bgm_volume}[v1];[v0][v1]amix=inputs=2:duration=first[a]',
+                        '-map', '0:v', '-map', '[a]', '-c:v', 'copy', '-c:a', 'aac', with_bgm, '-y'], check=True)
+        os.replace(with_bgm, final_video)
+        time.sleep(1)
+    if subtitles:
+        with_subtitles = final_video.replace('.mp4', '_subtitles.mp4')
+        subprocess.run(['ffmpeg', *quiet, '-i', final_video, '-vf', subtitle_filter, with_subtitles, '-y'], check=True)
+        os.replace(with_subtitles, final_video)
+        time.sleep(1)
+    return final_video
+
+
+def make_inputs(folder, seconds, source_resolution):
+    lavfi = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-f', 'lavfi']
+    subprocess.run(lavfi + ['-i', f'testsrc2=size={source_resolution}:rate=30:duration={seconds}',
+                            '-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}',
+                            '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac',
+                            os.path.join(folder, 'download.mp4')], check=True)
+    subprocess.run(lavfi + ['-i', f'sine=frequency=220:sample_rate=24000:duration={seconds}',
+                            os.path.join(folder, 'audio_combined.wav')], check=True)
+    subprocess.run(lavfi + ['-i', f'anoisesrc=duration={seconds}:amplitude=0.1', os.path.join(folder, 'bgm.mp3')],
+                   check=True)
+    subprocess.run(lavfi + ['-i', 'color=c=red:size=400x200', '-frames:v', '1', os.path.join(folder, 'watermark.png')],
+                   check=True)
+    translation = [{'start': t, 'end': t + 2.5, 'text': 'Hello there.', 'speaker': 'SPEAKER_00',
+                    'translation': f'这是第{t // 3}句字幕，用来测试烧录的速度。'} for t in range(0, seconds - 3, 3)]
+    with open(os.path.join(folder, 'translation.json'), 'w', encoding='utf-8') as f:
+        json.dump(translation, f, ensure_ascii=False)
+
+
+def timed(fn):
+    begin = time.time()
+    out = fn()
+    return time.time() - begin, out
+
+
+def main():
+    parser = argparse.ArgumentParser("bench_synthesize_video")
+    parser.add_argument("--seconds", type=int, default=60)
+    parser.add_argument("--source-resolution", default='1280x720')
+    parser.add_argument("--resolution", default='720p')
+    parser.add_argument("--speed-up", type=float, default=1.05)
+    parser.add_argument("--preset", default='medium')
+    parser.add_argument("--threads", type=int, default=0)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    try:
+        make_inputs(folder, args.seconds, args.source_resolution)
+        kwargs = dict(subtitles=True, speed_up=args.speed_up, fps=30, resolution=args.resolution,
+                      background_music=os.path.join(folder, 'bgm.mp3'),
+                      watermark_path=os.path.join(folder, 'watermark.png'))
+        ref_time, _ = timed(lambda: reference_synthesize_video(folder, **kwargs))
+        new_time, _ = timed(lambda: synthesize_video(folder, preset=args.preset, threads=args.threads, **kwargs))
+    finally:
+        shutil.rmtree(folder)
+
+    print(f"{args.seconds}s of {args.source_resolution} video rendered at {args.resolution}, "
+          f"watermark, background music and subtitles")
+    print(f"{'path':>24} {'time':>8}")
+    print(f"{'three passes':>24} {ref_time:>7.2f}s")
+    print(f"{'single pass, ' + args.preset:>24} {new_time:>7.2f}s")
+    print(f"speedup {ref_time / new_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark of fitting synthesized sentences to their slots: the previous adjust_audio_length, which
+decoded every sentence, stretched it file to file with audiostretchy and decoded the result again,
+against decoding once and stretching all sentences in memory with tools.time_stretch. Needs
+audiostretchy, which the pipeline itself no longer uses.
+
+    python -m scripts.bench_time_stretch --sentences 200
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import librosa
+import numpy as np
+from audiostretchy.stretch import stretch_audio
+
+from tools.time_stretch import stretch_batch
+from tools.utils import save_wav
+
+SAMPLE_RATE = 24000
+
+
+def reference_adjust_audio_length(wav_path, speed_factor, sample_rate=SAMPLE_RATE):
+    wav, sample_rate = librosa.load(wav_path, sr=sample_rate)
+    desired_length = len(wav) / sample_rate * speed_factor
+    target_path = wav_path.replace('.wav', '_adjusted.wav')
+    stretch_audio(wav_path, target_path, ratio=speed_factor, sample_rate=sample_rate)
+    wav, sample_rate = librosa.load(target_path, sr=sample_rate)
+    return wav[:int(desired_length * sample_rate)]
+
+
+def in_memory_adjust_audio_lengths(wav_paths, speed_factors, sample_rate=SAMPLE_RATE):
+    wavs = [librosa.load(wav_path, sr=sample_rate)[0] for wav_path in wav_paths]
+    lengths = [len(wav) / sample_rate * speed_factor for wav, speed_factor in zip(wavs, speed_factors)]
+    stretched = stretch_batch(wavs, speed_factors, sample_rate)
+    return [wav[:int(length * sample_rate)] for wav, length in zip(stretched, lengths)]
+
+
+def synthetic_sentence(rng, seconds):
+    # Voiced frames with a gliding pitch and a few harmonics, separated by short pauses
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    pitch = rng.uniform(100, 250) * (1 + 0.1 * np.sin(2 * np.pi * rng.uniform(0.5, 2) * t))
+    phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+    wav = sum(np.sin(h * phase) / h for h in range(1, 6))
+    envelope = (np.sin(2 * np.pi * rng.uniform(2, 4) * t) > -0.6).astype(float)
+    return (0.3 * wav * envelope + 0.005 * rng.standard_normal(len(t))).astype(np.float32)
+
+
+def timed(fn):
+    begin = time.time()
+    out = fn()
+    return time.time() - begin, out
+
+
+def main():
+    parser = argparse.ArgumentParser("bench_time_stretch")
+    parser.add_argument("--sentences", type=int, default=200)
+    parser.add_argument("--min-seconds", type=float, default=1.)
+    parser.add_argument("--max-seconds", type=float, default=8.)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    speed_factors = list(rng.uniform(0.6, 1.1, args.sentences))
+    with tempfile.TemporaryDirectory() as folder:
+        wav_paths = []
+        for i in range(args.sentences):
+            wav_paths.append(os.path.join(folder, f'{str(i).zfill(4)}.wav'))
+            save_wav(synthetic_sentence(rng, rng.uniform(args.min_seconds, args.max_seconds)), wav_paths[-1])
+        ref_time, reference = timed(lambda: [reference_adjust_audio_length(wav_path, speed_factor)
+                                             for wav_path, speed_factor in zip(wav_paths, speed_factors)])
+        new_time, result = timed(lambda: in_memory_adjust_audio_lengths(wav_paths, speed_factors))
+
+    audio_seconds = sum(len(wav) for wav in result) / SAMPLE_RATE
+    length_diff = max(abs(len(a) - len(b)) for a, b in zip(reference, result))
+    print(f"{args.sentences} sentences, {audio_seconds:.0f}s of fitted audio")
+    print(f"{'path':>10} {'time':>8} {'x realtime':>11}")
+    print(f"{'reference':>10} {ref_time:>7.2f}s {audio_seconds / ref_time:>10.0f}x")
+    print(f"{'in-memory':>10} {new_time:>7.2f}s {audio_seconds / new_time:>10.0f}x")
+    print(f"speedup {ref_time / new_time:.1f}x, max length difference {length_diff} samples")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Wall time of translating a synthetic transcript against the local mock API, one request after the
+other as before against tools.translation_client with several requests in flight. The mock answers
+every request after a fixed latency and rejects some with 429 to exercise the retries.
+
+    python -m scripts.bench_translation_client --method Ernie --lines 200 --batch-size 10 --concurrency 8
+"""
+import argparse
+import os
+import sys
+import time
+
+from loguru import logger
+
+from scripts.mock_translation_server import MockTranslationServer, mock_translation
+
+
+def synthetic_transcript(num_lines):
+    words = ['today', 'we', 'are', 'going', 'to', 'look', 'at', 'how', 'the', 'model', 'learns', 'from', 'data']
+    return [{'text': ' '.join(words[(i + j) % len(words)] for j in range(5 + i % 7)).capitalize() + '.'}
+            for i in range(num_lines)]
+
+
+def timed(fn):
+    begin = time.time()
+    out = fn()
+    return time.time() - begin, out
+
+
+def main():
+    parser = argparse.ArgumentParser("bench_translation_client")
+    parser.add_argument("--method", default='Ernie', choices=['OpenAI', 'Ernie'])
+    parser.add_argument("--lines", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--failure-rate", type=float, default=0.05)
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    with MockTranslationServer(latency=args.latency, failure_rate=args.failure_rate) as server:
+        # The backends read their endpoints at import time
+        os.environ['OPENAI_API_BASE'] = server.url + '/v1'
+        os.environ['BAIDU_API_BASE'] = server.url
+        from tools.step030_translation import _translate
+
+        summary = {'title': 'Benchmark', 'summary': 'A synthetic transcript.'}
+        transcript = synthetic_transcript(args.lines)
+        expected = [mock_translation(line['text']) for line in transcript]
+        print(f"{args.lines} lines, {args.batch_size} lines per request, {args.latency:.2f}s latency, "
+              f"{args.failure_rate:.0%} of requests rejected")
+        print(f"{'concurrency':>11} {'time':>8} {'requests':>9} {'in flight':>10} {'correct':>8}")
+        for concurrency in [1] + args.concurrency:
+            server.reset()
+            seconds, translation = timed(lambda: _translate(summary, transcript, 'English', args.method,
+                                                            args.batch_size, concurrency))
+            stats = server.stats
+            print(f"{concurrency:>11} {seconds:>7.2f}s {stats['requests']:>9} {stats['max_active']:>10} "
+                  f"{str(translation == expected):>8}")
+
+
+if __name__ == "__main__":
+    main()
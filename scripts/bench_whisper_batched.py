@@ -0,0 +1,60 @@
+"""
+Throughput of whisper's transcribe() with condition_on_previous_text=False as the number of
+30-second windows encoded and decoded together grows, from the sequential loop (--batch-sizes 1)
+to batched fixed-stride windows. Uses a randomly initialized model with the dimensions of a
+released one, so nothing is downloaded; with --checkpoint a real model is loaded instead. The
+audio is noise, and every batch size must decode the same windows to the same tokens.
+
+    python -m scripts.bench_whisper_batched --dims base --minutes 5 --batch-sizes 1 2 4 8
+"""
+import argparse
+import time
+
+import numpy as np
+
+import whisper
+from whisper.audio import SAMPLE_RATE
+from scripts.bench_whisper_kv_cache import DIMS, random_model
+
+
+def timed(fn):
+    begin = time.time()
+    out = fn()
+    return time.time() - begin, out
+
+
+def main():
+    parser = argparse.ArgumentParser("bench_whisper_batched")
+    parser.add_argument("--dims", default='base', choices=list(DIMS))
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--device", default='cpu')
+    parser.add_argument("--minutes", type=float, default=5)
+    parser.add_argument("--batch-sizes", type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument("--beam-size", type=int, default=None)
+    parser.add_argument("--sample-len", type=int, default=64)
+    args = parser.parse_args()
+
+    model = whisper.load_model(args.checkpoint, args.device) if args.checkpoint else random_model(args.dims, args.device)
+    audio = np.random.default_rng(0).normal(0, 0.1, int(args.minutes * 60 * SAMPLE_RATE)).astype(np.float32)
+    options = dict(language='en', condition_on_previous_text=False, temperature=0., beam_size=args.beam_size,
+                   sample_len=args.sample_len, fp16=args.device != 'cpu')
+    rows = []
+    for batch_size in args.batch_sizes:
+        seconds, result = timed(lambda: whisper.transcribe(model, audio, batch_size=batch_size, **options))
+        windows = {}
+        for segment in result['segments']:
+            windows.setdefault(segment['seek'], []).extend(segment['tokens'])
+        rows.append((batch_size, seconds, windows))
+
+    print(f"{args.checkpoint or args.dims + ' (random weights)'}, {args.minutes:.0f} min of audio, "
+          f"up to {args.sample_len} tokens per window, {args.device}")
+    print(f"{'batch size':>10} {'time':>8} {'audio s/s':>10} {'speedup':>8}")
+    for batch_size, seconds, _ in rows:
+        print(f"{batch_size:>10} {seconds:>7.1f}s {args.minutes * 60 / seconds:>10.1f} {rows[0][1] / seconds:>7.2f}x")
+    # the sequential loop seeks to the last timestamp, so only the batched runs cut the same windows
+    batched = [windows for batch_size, _, windows in rows if batch_size > 1]
+    print(f"same tokens across batch sizes: {all(windows == batched[0] for windows in batched)}")
+
+
+if __name__ == "__main__":
+    main()
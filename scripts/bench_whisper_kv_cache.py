@@ -0,0 +1,80 @@
+"""
+Decoding speed of whisper with the preallocated KVCache written in place against the cache the
+forward hooks grow with torch.cat on every token and copy whole on every beam reorder. Uses a
+randomly initialized model with the dimensions of a released one, so nothing is downloaded; with
+--checkpoint a real model is loaded instead. Both caches must decode the same tokens.
+
+    python -m scripts.bench_whisper_kv_cache --dims small --beam-size 5 --sample-len 224
+"""
+import argparse
+import time
+
+import torch
+
+import whisper
+from whisper.audio import N_FRAMES
+from whisper.decoding import DecodingOptions
+from whisper.model import ModelDimensions, Whisper
+
+DIMS = {
+    'tiny': (384, 6, 4),
+    'base': (512, 8, 6),
+    'small': (768, 12, 12),
+    'medium': (1024, 16, 24),
+}
+
+
+def random_model(name, device):
+    n_state, n_head, n_layer = DIMS[name]
+    dims = ModelDimensions(n_mels=80, n_audio_ctx=N_FRAMES // 2, n_audio_state=n_state, n_audio_head=n_head,
+                           n_audio_layer=n_layer, n_vocab=51865, n_text_ctx=448, n_text_state=n_state,
+                           n_text_head=n_head, n_text_layer=n_layer)
+    torch.manual_seed(0)
+    model = Whisper(dims)
+    with torch.no_grad():
+        model.decoder.positional_embedding.normal_(0, 0.02)
+    return model.to(device).eval()
+
+
+def timed(fn):
+    begin = time.time()
+    out = fn()
+    return time.time() - begin, out
+
+
+def main():
+    parser = argparse.ArgumentParser("bench_whisper_kv_cache")
+    parser.add_argument("--dims", default='base', choices=list(DIMS))
+    parser.add_argument("--checkpoint", default=None)
+    parser.add_argument("--device", default='cpu')
+    parser.add_argument("--beam-size", type=int, default=5)
+    parser.add_argument("--sample-len", type=int, default=224)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    torch.set_grad_enabled(False)
+
+    model = whisper.load_model(args.checkpoint, args.device) if args.checkpoint else random_model(args.dims, args.device)
+    mel = torch.randn(1, 80, N_FRAMES, device=args.device)
+    audio_features = model.embed_audio(mel)
+    rows = []
+    for name, static_kv_cache in [('hooks + torch.cat', False), ('KVCache', True)]:
+        options = DecodingOptions(language='en', beam_size=args.beam_size, sample_len=args.sample_len,
+                                  suppress_tokens='', fp16=args.device != 'cpu', static_kv_cache=static_kv_cache)
+        model.decode(audio_features, options)  # warm up
+        seconds, result = min((timed(lambda: model.decode(audio_features, options)) for _ in range(args.repeats)),
+                              key=lambda row: row[0])
+        rows.append((name, seconds, result))
+
+    print(f"{args.checkpoint or args.dims + ' (random weights)'}, beam size {args.beam_size}, "
+          f"up to {args.sample_len} tokens, {args.device}")
+    print(f"{'cache':>18} {'time':>8} {'tokens':>7} {'tokens/s':>9}")
+    for name, seconds, result in rows:
+        # every step decodes one token for each of the beams
+        steps = len(result[0].tokens)
+        print(f"{name:>18} {seconds:>7.2f}s {steps:>7} {steps * args.beam_size / seconds:>9.1f}")
+    same = [r.tokens for r in rows[0][2]] == [r.tokens for r in rows[1][2]]
+    print(f"speedup {rows[0][1] / rows[1][1]:.2f}x, same tokens: {same}")
+
+
+if __name__ == "__main__":
+    main()
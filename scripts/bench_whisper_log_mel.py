@@ -0,0 +1,73 @@
+"""
+Peak memory and time of the whisper front end on a long file: log_mel_spectrogram of the whole
+padded audio, which transcribe() used to compute up front, against LogMelSpectrogramStream read
+window by window as transcribe() does now. Each path runs in its own process and reports its
+peak resident memory. The audio is pink noise rendered with ffmpeg, which must be on PATH.
+
+    python -m scripts.bench_whisper_log_mel --minutes 10 30 60
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+
+from whisper.audio import N_FRAMES, N_SAMPLES, LogMelSpectrogramStream, log_mel_spectrogram
+
+
+def read_windows(path, streaming):
+    mel = (LogMelSpectrogramStream if streaming else log_mel_spectrogram)(path, padding=N_SAMPLES)
+    checksum = 0.
+    for seek in range(0, mel.shape[-1] - N_FRAMES, N_FRAMES):
+        checksum += float(mel[:, seek:seek + N_FRAMES].sum())
+    return checksum
+
+
+def child(path, streaming):
+    torch.set_num_threads(1)
+    begin = time.time()
+    checksum = read_windows(path, streaming)
+    seconds = time.time() - begin
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+    print(json.dumps({'seconds': seconds, 'peak_mb': peak, 'checksum': checksum}))
+
+
+def run_child(path, streaming):
+    out = subprocess.run([sys.executable, '-m', 'scripts.bench_whisper_log_mel', '--child', path,
+                          '--streaming', str(int(streaming))], check=True, capture_output=True, text=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser("bench_whisper_log_mel")
+    parser.add_argument("--minutes", type=float, nargs='+', default=[10, 30, 60])
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--streaming", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.child, bool(args.streaming))
+
+    rows = []
+    with tempfile.TemporaryDirectory() as folder:
+        for minutes in args.minutes:
+            path = os.path.join(folder, f'{minutes}.flac')
+            subprocess.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i',
+                            f'anoisesrc=color=pink:amplitude=0.2:sample_rate=16000:duration={minutes * 60}',
+                            path], check=True)
+            full, streamed = run_child(path, False), run_child(path, True)
+            rows.append((minutes, full, streamed))
+
+    print(f"{'audio':>8} {'full':>18} {'streaming':>18} {'same windows':>13}")
+    for minutes, full, streamed in rows:
+        same = abs(full['checksum'] - streamed['checksum']) <= 1e-6 * abs(full['checksum'])
+        print(f"{minutes:>6.0f}min {full['peak_mb']:>8.0f}MB {full['seconds']:>7.1f}s "
+              f"{streamed['peak_mb']:>8.0f}MB {streamed['seconds']:>7.1f}s {str(same):>13}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Local stand-in for the Edge read-aloud websocket service, for offline tests and benchmarks of
+tools.step044_tts_edge_tts. It speaks the protocol edge_tts expects: after the speech.config and
+ssml messages it answers turn.start, audio frames of silent 24 kHz mono mp3 proportional to the
+text length, and turn.end. Every connection waits `latency` seconds first and with probability
+`failure_rate` closes without audio.
+
+    with FakeEdgeTTSServer(latency=0.3) as server, server.patch():
+        tts_batch(texts, output_paths)
+
+    python -m scripts.fake_edge_tts_server --port 8765
+"""
+import argparse
+import asyncio
+import contextlib
+import random
+import re
+import threading
+import uuid
+
+from aiohttp import WSMsgType, web
+from edge_tts import communicate
+
+# One MPEG-2 layer III frame of silence at 24 kHz, 48 kbit/s, mono: 576 samples in 144 bytes
+SILENT_FRAME = bytes([0xFF, 0xF3, 0x64, 0xC0]) + bytes(140)
+FRAMES_PER_CHAR = 4
+FRAMES_PER_MESSAGE = 32
+
+
+def _text_message(request_id, path, body=''):
+    return f'X-RequestId:{request_id}\r\nContent-Type:application/json; charset=utf-8\r\nPath:{path}\r\n\r\n{body}'
+
+
+def _audio_message(request_id, data):
+    # edge_tts drops the last two bytes of the header block, so it ends with \r\n
+    headers = f'X-RequestId:{request_id}\r\nContent-Type:audio/mpeg\r\nPath:audio\r\n'.encode('utf-8')
+    return len(headers).to_bytes(2, 'big') + headers + data
+
+
+def silent_mp3(text):
+    return SILENT_FRAME * (FRAMES_PER_CHAR * max(1, len(text)))
+
+
+class FakeEdgeTTSServer:
+    """Runs the fake service on its own thread and event loop; port 0 picks a free port, see `url`."""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.2, failure_rate=0.0):
+        self.host, self.port = host, port
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.lock = threading.Lock()
+        self.reset()
+        self.loop = asyncio.new_event_loop()
+        self.started = threading.Event()
+        self.thread = None
+
+    @property
+    def url(self):
+        return f'ws://{self.host}:{self.port}/edge/v1?TrustedClientToken=fake'
+
+    def reset(self):
+        self.connections = self.failures = self.active = self.max_active = 0
+
+    @property
+    def stats(self):
+        return {'connections': self.connections, 'failures': self.failures, 'max_active': self.max_active}
+
+    async def _handle(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        with self.lock:
+            self.connections += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            async for message in ws:
+                if message.type != WSMsgType.TEXT or 'Path:ssml' not in message.data:
+                    continue
+                request_id = uuid.uuid4().hex
+                match = re.search(r"<prosody[^>]*>(.*)</prosody>", message.data, re.S)
+                await asyncio.sleep(self.latency)
+                if random.random() < self.failure_rate:
+                    with self.lock:
+                        self.failures += 1
+                    break
+                await ws.send_str(_text_message(request_id, 'turn.start', '{}'))
+                audio = silent_mp3(match.group(1) if match else '')
+                step = len(SILENT_FRAME) * FRAMES_PER_MESSAGE
+                for i in range(0, len(audio), step):
+                    await ws.send_bytes(_audio_message(request_id, audio[i:i + step]))
+                await ws.send_str(_text_message(request_id, 'turn.end', '{}'))
+        finally:
+            with self.lock:
+                self.active -= 1
+            await ws.close()
+        return ws
+
+    def _serve(self):
+        asyncio.set_event_loop(self.loop)
+        app = web.Application()
+        app.router.add_get('/edge/v1', self._handle)
+        self.runner = web.AppRunner(app)
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, self.host, self.port)
+        self.loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self.started.set()
+        self.loop.run_forever()
+        self.loop.run_until_complete(self.runner.cleanup())
+
+    def start(self):
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+        self.started.wait()
+        return self
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    @contextlib.contextmanager
+    def patch(self):
+        """Point edge_tts at this server instead of the Microsoft endpoint."""
+        saved = communicate.WSS_URL
+        communicate.WSS_URL = self.url
+        try:
+            yield self
+        finally:
+            communicate.WSS_URL = saved
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser("fake_edge_tts_server")
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    with FakeEdgeTTSServer(args.host, args.port, args.latency, args.failure_rate) as server:
+        print(f"Serving {server.url}, set edge_tts.communicate.WSS_URL to it")
+        try:
+            server.thread.join()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
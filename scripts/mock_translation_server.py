@@ -0,0 +1,133 @@
+"""
+Local stand-in for the OpenAI and Ernie chat APIs, for tests and benchmarks of the translation
+clients. Every request waits `latency` seconds and fails with 429 with probability `failure_rate`.
+Numbered JSON requests are answered line by line and `Translate:"..."` requests with one line, in
+a form valid_translation accepts.
+
+    with MockTranslationServer(latency=0.2) as server:
+        os.environ['OPENAI_API_BASE'] = server.url + '/v1'   # before importing tools.step031_translation_openai
+        os.environ['BAIDU_API_BASE'] = server.url            # before importing tools.step034_translation_ernie
+
+    python -m scripts.mock_translation_server --port 8000 --latency 0.5
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def mock_translation(text):
+    return f'译{len(text)}'
+
+
+def mock_reply(messages):
+    content = messages[-1]['content']
+    match = re.search(r'\{[^{}]*\}\s*$', content)
+    if match:
+        lines = json.loads(match.group(0))
+        return json.dumps({key: mock_translation(text) for key, text in lines.items()}, ensure_ascii=False)
+    match = re.search(r'Translate:"(.*)"', content, re.S)
+    return f'翻译：“{mock_translation(match.group(1) if match else content)}”'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with server.lock:
+            server.requests += 1
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            time.sleep(server.latency)
+            if self.path.startswith('/oauth/2.0/token'):
+                return self._send(200, {'access_token': 'mock-token'})
+            if random.random() < server.failure_rate:
+                with server.lock:
+                    server.failures += 1
+                return self._send(429, {'error': 'rate limited'})
+            if self.path.endswith('/chat/completions'):
+                reply = mock_reply(json.loads(body)['messages'])
+                return self._send(200, {'choices': [{'message': {'role': 'assistant', 'content': reply}}]})
+            if '/wenxinworkshop/chat/' in self.path:
+                return self._send(200, {'result': mock_reply(json.loads(body)['messages'])})
+            self._send(404, {'error': 'not found'})
+        finally:
+            with server.lock:
+                server.active -= 1
+
+
+class MockTranslationServer:
+    """Runs the mock API on a background thread; port 0 picks a free port, see `url`."""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.1, failure_rate=0.0):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.failure_rate = failure_rate
+        self.httpd.lock = threading.Lock()
+        self.reset()
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def reset(self):
+        self.httpd.requests = self.httpd.failures = self.httpd.active = self.httpd.max_active = 0
+
+    @property
+    def stats(self):
+        return {'requests': self.httpd.requests, 'failures': self.httpd.failures, 'max_active': self.httpd.max_active}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser("mock_translation_server")
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = MockTranslationServer(args.host, args.port, args.latency, args.failure_rate)
+    print(f"OPENAI_API_BASE={server.url}/v1 BAIDU_API_BASE={server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
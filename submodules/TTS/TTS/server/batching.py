@@ -0,0 +1,205 @@
+import collections
+import queue
+import struct
+import threading
+import time
+from typing import Callable, Dict, Hashable, Iterator, List, Optional
+
+import numpy as np
+
+
+def streaming_wav_header(sample_rate: int, num_channels: int = 1, bits_per_sample: int = 16) -> bytes:
+    """RIFF header of a PCM WAV whose length is not known yet.
+
+    The RIFF and data sizes are set to the maximum, which players and decoders read as "until the end
+    of the stream".
+    """
+    block_align = num_channels * bits_per_sample // 8
+    return (
+        b"RIFF"
+        + struct.pack("<I", 0xFFFFFFFF)
+        + b"WAVE"
+        + b"fmt "
+        + struct.pack(
+            "<IHHIIHH", 16, 1, num_channels, sample_rate, sample_rate * block_align, block_align, bits_per_sample
+        )
+        + b"data"
+        + struct.pack("<I", 0xFFFFFFFF)
+    )
+
+
+def wav_to_pcm16(wav: np.ndarray) -> bytes:
+    """Encode a float waveform in [-1, 1] as little-endian 16 bit PCM, clipping what is outside."""
+    return (np.clip(np.asarray(wav, dtype=np.float32), -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+class SynthesisRequest:
+    """One text to synthesize, split into sentences that the scheduler may batch with other requests.
+
+    Iterating over the request yields the waveform of every sentence, in order, as soon as it is ready.
+
+    Args:
+        sentences (List[str]): sentences of the text.
+        key (Hashable): requests with the same key (speaker, language, style) can share a model call.
+    """
+
+    def __init__(self, sentences: List[str], key: Hashable):
+        self.sentences = sentences
+        self.key = key
+        self.created = time.perf_counter()
+        self.first_chunk = None
+        self.failed = False
+        self._results = queue.Queue()
+
+    def _put(self, index: int, wav: Optional[np.ndarray], error: Optional[Exception] = None):
+        if error is not None:
+            self.failed = True
+        self._results.put((index, wav, error))
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        pending = {}
+        for index in range(len(self.sentences)):
+            while index not in pending:
+                done, wav, error = self._results.get()
+                if error is not None:
+                    raise error
+                pending[done] = wav
+            yield pending.pop(index)
+
+
+class BatchScheduler:
+    """Micro-batching scheduler of synthesis requests.
+
+    A worker thread takes the sentences of all queued requests in arrival order. It waits at most
+    `max_wait_ms` after the first one for more to arrive, up to `max_batch_size`. Then it calls
+    `synthesize_batch(texts, key)` once per group of sentences that share a key. Results go back to
+    their requests as soon as a batch is done, so a long text streams sentence by sentence.
+
+    Args:
+        synthesize_batch (Callable): `(texts, key) -> list of waveforms`, one per text.
+        max_batch_size (int): maximum number of sentences per batch. Defaults to 8.
+        max_wait_ms (float): how long to wait for a batch to fill. Defaults to 10.
+        history (int): number of finished requests kept for the latency percentiles. Defaults to 1000.
+    """
+
+    def __init__(
+        self,
+        synthesize_batch: Callable[[List[str], Hashable], List[np.ndarray]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        history: int = 1000,
+    ):
+        self.synthesize_batch = synthesize_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._first_chunk_latencies = collections.deque(maxlen=history)
+        self._latencies = collections.deque(maxlen=history)
+        self._batch_sizes = collections.deque(maxlen=history)
+        self.requests_total = self.requests_in_flight = self.sentences_total = self.batches_total = 0
+        self.errors_total = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, sentences: List[str], key: Hashable = None) -> SynthesisRequest:
+        """Queue the sentences of one text and return the request to iterate over."""
+        request = SynthesisRequest(sentences, key)
+        with self._lock:
+            self.requests_total += 1
+            self.requests_in_flight += 1
+        for index, sentence in enumerate(sentences):
+            self._jobs.put((request, index, sentence))
+        if not sentences:
+            self._finish(request)
+        return request
+
+    def stop(self):
+        self._jobs.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        job = self._jobs.get()
+        if job is None:
+            return None
+        batch = [job]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                job = self._jobs.get(timeout=timeout) if timeout > 0 else self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                # stop after this batch
+                self._jobs.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    def _finish(self, request: SynthesisRequest):
+        now = time.perf_counter()
+        with self._lock:
+            self.requests_in_flight -= 1
+            self._latencies.append(now - request.created)
+            if request.first_chunk is not None:
+                self._first_chunk_latencies.append(request.first_chunk - request.created)
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            # sentences of requests that already failed are not synthesized
+            batch = [job for job in batch if not job[0].failed]
+            groups = collections.OrderedDict()
+            for job in batch:
+                groups.setdefault(job[0].key, []).append(job)
+            for key, jobs in groups.items():
+                try:
+                    wavs = self.synthesize_batch([sentence for _, _, sentence in jobs], key)
+                except Exception as e:  # pylint: disable=broad-except
+                    with self._lock:
+                        self.errors_total += 1
+                    for request in {id(request): request for request, _, _ in jobs}.values():
+                        if not request.failed:
+                            request._put(-1, None, e)  # pylint: disable=protected-access
+                            self._finish(request)
+                    continue
+                with self._lock:
+                    self.batches_total += 1
+                    self.sentences_total += len(jobs)
+                    self._batch_sizes.append(len(jobs))
+                now = time.perf_counter()
+                for (request, index, _), wav in zip(jobs, wavs):
+                    if request.first_chunk is None:
+                        request.first_chunk = now
+                    request._put(index, wav)  # pylint: disable=protected-access
+                    if index == len(request.sentences) - 1:
+                        self._finish(request)
+
+    def metrics(self) -> Dict:
+        """Queue depth, throughput counters and latency percentiles in seconds."""
+
+        def percentiles(values):
+            if not values:
+                return {"p50": None, "p95": None, "max": None}
+            values = np.asarray(values)
+            return {
+                "p50": float(np.percentile(values, 50)),
+                "p95": float(np.percentile(values, 95)),
+                "max": float(values.max()),
+            }
+
+        with self._lock:
+            return {
+                "queue_depth": self._jobs.qsize(),
+                "requests_in_flight": self.requests_in_flight,
+                "requests_total": self.requests_total,
+                "sentences_total": self.sentences_total,
+                "batches_total": self.batches_total,
+                "errors_total": self.errors_total,
+                "mean_batch_size": float(np.mean(self._batch_sizes)) if self._batch_sizes else None,
+                "first_chunk_latency": percentiles(list(self._first_chunk_latencies)),
+                "latency": percentiles(list(self._latencies)),
+            }
@@ -9,9 +9,11 @@ from threading import Lock
 from typing import Union
 from urllib.parse import parse_qs
 
-from flask import Flask, render_template, render_template_string, request, send_file
+import numpy as np
+from flask import Flask, Response, jsonify, render_template, render_template_string, request, send_file
 
 from TTS.config import load_config
+from TTS.server.batching import BatchScheduler, streaming_wav_header, wav_to_pcm16
 from TTS.utils.manage import ModelManager
 from TTS.utils.synthesizer import Synthesizer
 
@@ -57,6 +59,16 @@ def create_argparser():
     parser.add_argument("--use_cuda", type=convert_boolean, default=False, help="true to use CUDA.")
     parser.add_argument("--debug", type=convert_boolean, default=False, help="true to enable Flask debug mode.")
     parser.add_argument("--show_details", type=convert_boolean, default=False, help="Generate model detail page.")
+    parser.add_argument(
+        "--batching",
+        type=convert_boolean,
+        default=False,
+        help="true to batch concurrent requests sentence by sentence and stream the audio back.",
+    )
+    parser.add_argument("--max_batch_size", type=int, default=8, help="maximum number of sentences per batch.")
+    parser.add_argument(
+        "--batch_wait_ms", type=float, default=10.0, help="how long a batch waits for more sentences, in ms."
+    )
     return parser
 
 
@@ -188,18 +200,83 @@ def details():
 lock = Lock()
 
 
+def synthesize_batch(texts, key):
+    """Synthesize sentences that share speaker, language and style for the batching scheduler."""
+    speaker_idx, language_idx, style_wav = key
+    model = synthesizer.tts_model
+    if hasattr(model, "inference_batch") and speaker_idx:
+        # XTTS: one GPT generate and one decoder call for the whole batch, with the settings of `synthesize()`
+        config = synthesizer.tts_config
+        gpt_cond_latent, speaker_embedding = model.speaker_manager.speakers[speaker_idx].values()
+        outputs = model.inference_batch(
+            texts,
+            language_idx,
+            gpt_cond_latent,
+            speaker_embedding,
+            temperature=config.temperature,
+            length_penalty=config.length_penalty,
+            repetition_penalty=config.repetition_penalty,
+            top_k=config.top_k,
+            top_p=config.top_p,
+        )
+        # same pause after every sentence as `Synthesizer.tts()`
+        return [np.concatenate([output["wav"], np.zeros(10000)]) for output in outputs]
+    # other models synthesize one sentence per call, still without queueing behind a lock per request
+    return [
+        np.asarray(
+            synthesizer.tts(
+                text,
+                speaker_name=speaker_idx,
+                language_name=language_idx,
+                style_wav=style_wav_uri_to_dict(style_wav),
+                split_sentences=False,
+            )
+        )
+        for text in texts
+    ]
+
+
+scheduler = (
+    BatchScheduler(synthesize_batch, max_batch_size=args.max_batch_size, max_wait_ms=args.batch_wait_ms)
+    if args.batching
+    else None
+)
+
+
+def stream_tts(text, speaker_idx="", language_idx="", style_wav=""):
+    """Queue the sentences of text on the scheduler and stream a WAV as they are synthesized."""
+    synthesis = scheduler.submit(synthesizer.split_into_sentences(text), (speaker_idx, language_idx, style_wav))
+
+    def generate():
+        yield streaming_wav_header(synthesizer.output_sample_rate)
+        for wav in synthesis:
+            yield wav_to_pcm16(wav)
+
+    return Response(generate(), mimetype="audio/wav")
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Queue depth, counters and latency percentiles of the batching scheduler."""
+    if scheduler is None:
+        return jsonify({"batching": False})
+    return jsonify({"batching": True, **scheduler.metrics()})
+
+
 @app.route("/api/tts", methods=["GET", "POST"])
 def tts():
+    text = request.headers.get("text") or request.values.get("text", "")
+    speaker_idx = request.headers.get("speaker-id") or request.values.get("speaker_id", "")
+    language_idx = request.headers.get("language-id") or request.values.get("language_id", "")
+    style_wav = request.headers.get("style-wav") or request.values.get("style_wav", "")
+
+    print(f" > Model input: {text}")
+    print(f" > Speaker Idx: {speaker_idx}")
+    print(f" > Language Idx: {language_idx}")
+    if scheduler is not None:
+        return stream_tts(text, speaker_idx, language_idx, style_wav)
     with lock:
-        text = request.headers.get("text") or request.values.get("text", "")
-        speaker_idx = request.headers.get("speaker-id") or request.values.get("speaker_id", "")
-        language_idx = request.headers.get("language-id") or request.values.get("language_id", "")
-        style_wav = request.headers.get("style-wav") or request.values.get("style_wav", "")
         style_wav = style_wav_uri_to_dict(style_wav)
-
-        print(f" > Model input: {text}")
-        print(f" > Speaker Idx: {speaker_idx}")
-        print(f" > Language Idx: {language_idx}")
         wavs = synthesizer.tts(text, speaker_name=speaker_idx, language_name=language_idx, style_wav=style_wav)
         out = io.BytesIO()
         synthesizer.save_wav(wavs, out)
@@ -236,22 +313,27 @@ def mary_tts_api_voices():
 @app.route("/process", methods=["GET", "POST"])
 def mary_tts_api_process():
     """MaryTTS-compatible /process endpoint"""
-    with lock:
-        if request.method == "POST":
-            data = parse_qs(request.get_data(as_text=True))
-            # NOTE: we ignore param. LOCALE and VOICE for now since we have only one active model
-            text = data.get("INPUT_TEXT", [""])[0]
-        else:
-            text = request.args.get("INPUT_TEXT", "")
-        print(f" > Model input: {text}")
-        wavs = synthesizer.tts(text)
-        out = io.BytesIO()
+    if request.method == "POST":
+        data = parse_qs(request.get_data(as_text=True))
+        # NOTE: we ignore param. LOCALE and VOICE for now since we have only one active model
+        text = data.get("INPUT_TEXT", [""])[0]
+    else:
+        text = request.args.get("INPUT_TEXT", "")
+    print(f" > Model input: {text}")
+    out = io.BytesIO()
+    if scheduler is not None:
+        synthesis = scheduler.submit(synthesizer.split_into_sentences(text), ("", "", ""))
+        wavs = list(np.concatenate(list(synthesis) or [np.zeros(0)]))
         synthesizer.save_wav(wavs, out)
+    else:
+        with lock:
+            wavs = synthesizer.tts(text)
+            synthesizer.save_wav(wavs, out)
     return send_file(out, mimetype="audio/wav")
 
 
 def main():
-    app.run(debug=args.debug, host="::", port=args.port)
+    app.run(debug=args.debug, host="::", port=args.port, threaded=True)
 
 
 if __name__ == "__main__":
@@ -599,6 +599,71 @@ class GPT(nn.Module):
             return gen.sequences[:, gpt_inputs.shape[1] :], gen
         return gen[:, gpt_inputs.shape[1] :]
 
+    def compute_batch_embeddings(
+        self,
+        cond_latents,
+        text_inputs,
+        text_lengths,
+    ):
+        """Batched `compute_embeddings` for texts of different lengths.
+
+        Every prefix is built at its own length and left padded, so the start audio tokens of the batch line up
+        and the mel positions stay shared. The transformer has no positional embedding of its own, so the padding
+        only has to be masked out.
+
+        Shapes:
+            cond_latents: (1, c, d) or (b, c, d)
+            text_inputs: (b, t), right padded
+            text_lengths: (b,)
+        """
+        embs = []
+        for idx, length in enumerate(text_lengths.tolist()):
+            text_input = F.pad(text_inputs[idx : idx + 1, :length], (0, 1), value=self.stop_text_token)
+            text_input = F.pad(text_input, (1, 0), value=self.start_text_token)
+            emb = self.text_embedding(text_input) + self.text_pos_embedding(text_input)
+            cond_latent = cond_latents[idx : idx + 1] if cond_latents.shape[0] > 1 else cond_latents
+            embs.append(torch.cat([cond_latent, emb], dim=1))
+
+        prefix_len = max(emb.shape[1] for emb in embs)
+        prefix_emb = embs[0].new_zeros(len(embs), prefix_len, embs[0].shape[-1])
+        attention_mask = torch.zeros(len(embs), prefix_len + 1, dtype=torch.long, device=text_inputs.device)
+        for idx, emb in enumerate(embs):
+            prefix_emb[idx, prefix_len - emb.shape[1] :] = emb[0]
+            attention_mask[idx, prefix_len - emb.shape[1] :] = 1
+        self.gpt_inference.store_prefix_emb(prefix_emb)
+
+        gpt_inputs = torch.full(
+            (len(embs), prefix_len + 1),  # +1 for the start_audio_token
+            fill_value=1,
+            dtype=torch.long,
+            device=text_inputs.device,
+        )
+        gpt_inputs[:, -1] = self.start_audio_token
+        return gpt_inputs, attention_mask
+
+    def generate_batch(
+        self,
+        cond_latents,
+        text_inputs,
+        text_lengths,
+        **hf_generate_kwargs,
+    ):
+        """Generate the audio codes of several texts in one `generate` call.
+
+        Finished rows are padded with `stop_audio_token`, so the codes of each row end at its first stop token.
+        """
+        gpt_inputs, attention_mask = self.compute_batch_embeddings(cond_latents, text_inputs, text_lengths)
+        gen = self.gpt_inference.generate(
+            gpt_inputs,
+            attention_mask=attention_mask,
+            bos_token_id=self.start_audio_token,
+            pad_token_id=self.stop_audio_token,
+            eos_token_id=self.stop_audio_token,
+            max_length=self.max_gen_mel_tokens + gpt_inputs.shape[-1],
+            **hf_generate_kwargs,
+        )
+        return gen[:, gpt_inputs.shape[1] :]
+
     def get_generator(self, fake_inputs, **hf_generate_kwargs):
         return self.gpt_inference.generate_stream(
             fake_inputs,
@@ -582,6 +582,103 @@ class Xtts(BaseTTS):
             "speaker_embedding": speaker_embedding,
         }
 
+    @torch.inference_mode()
+    def inference_batch(
+        self,
+        texts,
+        language,
+        gpt_cond_latent,
+        speaker_embedding,
+        # GPT inference
+        temperature=0.75,
+        length_penalty=1.0,
+        repetition_penalty=10.0,
+        top_k=50,
+        top_p=0.85,
+        do_sample=True,
+        num_beams=1,
+        speed=1.0,
+        **hf_generate_kwargs,
+    ):
+        """Synthesize several texts of one speaker at once.
+
+        The GPT codes of all texts are sampled in a single padded `generate` call and the HiFi-GAN decoder runs
+        on the padded batch of latents, each waveform is then trimmed back to its own length. The conditioning
+        latents are shared by the whole batch. Same settings as `inference()`, without text splitting.
+
+        Returns:
+            A list with a dictionary per text, holding `wav` and `gpt_latents` like `inference()`.
+        """
+        language = language.split("-")[0]  # remove the country code
+        length_scale = 1.0 / max(speed, 0.05)
+        gpt_cond_latent = gpt_cond_latent.to(self.device)
+        speaker_embedding = speaker_embedding.to(self.device)
+
+        tokens = [self.tokenizer.encode(text.strip().lower(), lang=language) for text in texts]
+        assert all(
+            len(token) < self.args.gpt_max_text_tokens for token in tokens
+        ), " ❗ XTTS can only generate text with a maximum of 400 tokens."
+        text_lengths = torch.tensor([len(token) for token in tokens], device=self.device)
+        text_inputs = torch.zeros(len(tokens), int(text_lengths.max()), dtype=torch.int32, device=self.device)
+        for idx, token in enumerate(tokens):
+            text_inputs[idx, : len(token)] = torch.IntTensor(token)
+
+        gpt_codes = self.gpt.generate_batch(
+            cond_latents=gpt_cond_latent,
+            text_inputs=text_inputs,
+            text_lengths=text_lengths,
+            do_sample=do_sample,
+            top_p=top_p,
+            top_k=top_k,
+            temperature=temperature,
+            num_return_sequences=1,
+            num_beams=num_beams,
+            length_penalty=length_penalty,
+            repetition_penalty=repetition_penalty,
+            output_attentions=False,
+            **hf_generate_kwargs,
+        )
+
+        gpt_latents_list = []
+        for idx, codes in enumerate(gpt_codes):
+            # keep the codes up to and including the first stop token, like a single `generate` call
+            stops = (codes == self.gpt.stop_audio_token).nonzero()
+            codes = codes[: int(stops[0]) + 1] if len(stops) else codes
+            expected_output_len = torch.tensor([codes.shape[-1] * self.gpt.code_stride_len], device=self.device)
+            gpt_latents = self.gpt(
+                text_inputs[idx : idx + 1, : text_lengths[idx]],
+                text_lengths[idx : idx + 1],
+                codes[None],
+                expected_output_len,
+                cond_latents=gpt_cond_latent,
+                return_attentions=False,
+                return_latent=True,
+            )
+            if length_scale != 1.0:
+                gpt_latents = F.interpolate(
+                    gpt_latents.transpose(1, 2), scale_factor=length_scale, mode="linear"
+                ).transpose(1, 2)
+            gpt_latents_list.append(gpt_latents)
+
+        # pad by repeating the last frame so the padding does not ring into the end of shorter waveforms
+        max_len = max(latents.shape[1] for latents in gpt_latents_list)
+        padded = torch.cat(
+            [
+                F.pad(latents.transpose(1, 2), (0, max_len - latents.shape[1]), mode="replicate")
+                for latents in gpt_latents_list
+            ]
+        ).transpose(1, 2)
+        wavs = self.hifigan_decoder(padded, g=speaker_embedding.expand(len(gpt_latents_list), -1, -1)).cpu()
+        samples_per_latent = wavs.shape[-1] / max_len
+
+        return [
+            {
+                "wav": wav.squeeze()[: round(samples_per_latent * latents.shape[1])].numpy(),
+                "gpt_latents": latents.cpu().numpy(),
+            }
+            for wav, latents in zip(wavs, gpt_latents_list)
+        ]
+
     def handle_chunks(self, wav_gen, wav_gen_prev, wav_overlap, overlap_len):
         """Handle chunk formatting in streaming mode"""
         wav_chunk = wav_gen[:-overlap_len]
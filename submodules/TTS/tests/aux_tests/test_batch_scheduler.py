@@ -0,0 +1,69 @@
+import struct
+import unittest
+
+import numpy as np
+
+from TTS.server.batching import BatchScheduler, streaming_wav_header, wav_to_pcm16
+
+
+class FakeModel:
+    """Returns a constant waveform per text, its value the text length, and records every batch."""
+
+    def __init__(self, fail_on=None):
+        self.batches = []
+        self.fail_on = fail_on
+
+    def __call__(self, texts, key):
+        self.batches.append((list(texts), key))
+        if self.fail_on in texts:
+            raise RuntimeError("synthesis failed")
+        return [np.full(4, len(text), dtype=np.float32) for text in texts]
+
+
+class TestBatchScheduler(unittest.TestCase):
+    def test_sentences_come_back_in_order(self):
+        model = FakeModel()
+        scheduler = BatchScheduler(model, max_batch_size=2, max_wait_ms=1)
+        sentences = ["a", "bb", "ccc", "dddd", "eeeee"]
+        wavs = list(scheduler.submit(sentences, "speaker"))
+        scheduler.stop()
+        self.assertEqual([wav[0] for wav in wavs], [1, 2, 3, 4, 5])
+        self.assertTrue(all(len(texts) <= 2 for texts, _ in model.batches))
+
+    def test_concurrent_requests_share_batches_per_key(self):
+        model = FakeModel()
+        # everything is submitted well within the batching window
+        scheduler = BatchScheduler(model, max_batch_size=8, max_wait_ms=200)
+        first = scheduler.submit(["x"], "a")
+        requests = [scheduler.submit(["a" * i], "a" if i % 2 else "b") for i in range(1, 7)]
+        self.assertEqual([wav[0] for wav in first], [1])
+        for i, request in enumerate(requests, start=1):
+            self.assertEqual([wav[0] for wav in request], [i])
+        scheduler.stop()
+        self.assertEqual(model.batches, [(["x", "a", "aaa", "aaaaa"], "a"), (["aa", "aaaa", "aaaaaa"], "b")])
+
+        metrics = scheduler.metrics()
+        self.assertEqual(metrics["requests_total"], 7)
+        self.assertEqual(metrics["requests_in_flight"], 0)
+        self.assertEqual(metrics["sentences_total"], 7)
+        self.assertEqual(metrics["batches_total"], 2)
+        self.assertEqual(metrics["queue_depth"], 0)
+        self.assertIsNotNone(metrics["latency"]["p95"])
+
+    def test_errors_reach_the_request(self):
+        model = FakeModel(fail_on="bad")
+        scheduler = BatchScheduler(model, max_batch_size=1, max_wait_ms=1)
+        with self.assertRaises(RuntimeError):
+            list(scheduler.submit(["good", "bad", "never"]))
+        self.assertEqual(len(list(scheduler.submit(["fine"]))), 1)
+        scheduler.stop()
+        self.assertEqual(scheduler.metrics()["errors_total"], 1)
+        self.assertEqual(scheduler.metrics()["requests_in_flight"], 0)
+
+    def test_streaming_wav(self):
+        header = streaming_wav_header(24000)
+        self.assertEqual(len(header), 44)
+        self.assertEqual(header[:4], b"RIFF")
+        self.assertEqual(struct.unpack("<I", header[24:28])[0], 24000)
+        pcm = np.frombuffer(wav_to_pcm16(np.array([0.0, 0.5, 2.0, -2.0])), dtype="<i2")
+        self.assertEqual(pcm.tolist(), [0, 16383, 32767, -32767])
@@ -209,6 +209,36 @@ def test_xtts_v2_streaming():
     assert normal_len > fast_len
 
 
+def test_xtts_v2_batch():
+    """Testing the inference_batch method"""
+    from TTS.tts.configs.xtts_config import XttsConfig
+    from TTS.tts.models.xtts import Xtts
+
+    speaker_wav = [os.path.join(get_tests_data_path(), "ljspeech", "wavs", "LJ001-0001.wav")]
+    model_path = os.path.join(get_user_data_dir("tts"), "tts_models--multilingual--multi-dataset--xtts_v2")
+    config = XttsConfig()
+    config.load_json(os.path.join(model_path, "config.json"))
+    model = Xtts.init_from_config(config)
+    model.load_checkpoint(config, checkpoint_dir=model_path)
+    model.to(torch.device("cuda" if torch.cuda.is_available() else "cpu"))
+
+    print("Computing speaker latents...")
+    gpt_cond_latent, speaker_embedding = model.get_conditioning_latents(audio_path=speaker_wav)
+
+    print("Inference...")
+    texts = [
+        "Hello.",
+        "It took me quite a long time to develop a voice and now that I have it I am not going to be silent.",
+        "This is a test.",
+    ]
+    outputs = model.inference_batch(texts, "en", gpt_cond_latent, speaker_embedding)
+    assert len(outputs) == len(texts)
+    lengths = [len(output["wav"]) for output in outputs]
+    assert all(length > 0 for length in lengths)
+    assert lengths[1] > lengths[0]
+    assert lengths[1] > lengths[2]
+
+
 def test_tortoise():
     output_path = os.path.join(get_tests_output_path(), "output.wav")
     use_gpu = torch.cuda.is_available()
@@ -142,6 +142,37 @@ def _replace_dict(_dict: tp.Optional[dict], *subs: tp.Tuple[tp.Hashable, tp.Any]
     return _dict
 
 
+def _valid_length(model: Model, length: int, segment: tp.Optional[float] = None) -> int:
+    if isinstance(model, HTDemucs) and segment is not None:
+        return int(segment * model.samplerate)
+    elif hasattr(model, 'valid_length'):
+        return model.valid_length(length)  # type: ignore
+    else:
+        return length
+
+
+def _transition_weight(segment_length: int, transition_power: float, device) -> th.Tensor:
+    # We start from a triangle shaped weight, with maximal weight in the middle
+    # of the segment. Then we normalize and take to the power `transition_power`.
+    # Large values of transition power will lead to sharper transitions.
+    weight = th.cat([th.arange(1, segment_length // 2 + 1, device=device),
+                     th.arange(segment_length - segment_length // 2, 0, -1, device=device)])
+    assert len(weight) == segment_length
+    # If the overlap < 50%, this will translate to linear transition when
+    # transition_power is 1.
+    return (weight / weight.max())**transition_power
+
+
+def _shift_offsets(shifts: int, max_shift: int, seed: tp.Optional[int] = None) -> tp.List[int]:
+    """
+    Offsets used by the shift trick. With a `seed`, the same offsets are drawn every time
+    so that separations can be reproduced and cached. Without one, they come from the
+    global `random` state as they always did.
+    """
+    rng: tp.Any = random if seed is None else random.Random(seed)
+    return [rng.randint(0, max_shift) for _ in range(shifts)]
+
+
 def apply_model(model: tp.Union[BagOfModels, Model],
                 mix: tp.Union[th.Tensor, TensorChunk],
                 shifts: int = 1, split: bool = True,
@@ -150,7 +181,8 @@ def apply_model(model: tp.Union[BagOfModels, Model],
                 num_workers: int = 0, segment: tp.Optional[float] = None,
                 pool=None, lock=None,
                 callback: tp.Optional[tp.Callable[[dict], None]] = None,
-                callback_arg: tp.Optional[dict] = None) -> th.Tensor:
+                callback_arg: tp.Optional[dict] = None,
+                seed: tp.Optional[int] = None) -> th.Tensor:
     """
     Apply model to a given mixture.
 
@@ -158,7 +190,12 @@ def apply_model(model: tp.Union[BagOfModels, Model],
         shifts (int): if > 0, will shift in time `mix` by a random amount between 0 and 0.5 sec
             and apply the oppositve shift to the output. This is repeated `shifts` time and
             all predictions are averaged. This effectively makes the model time equivariant
-            and improves SDR by up to 0.2 points.
+            and improves SDR by up to 0.2 points. With `split` on a device other than the
+            CPU, the same chunk of every shifted copy goes through the model in a single
+            batched forward pass, so each pass holds `shifts` chunks whatever batch size the
+            caller uses elsewhere. On the CPU, where larger batches measured slower, the
+            shifted copies go through the model one after the other.
+            `num_workers` (or `pool`) runs several forward passes in parallel.
         split (bool): if True, the input will be broken down in 8 seconds extracts
             and predictions will be performed individually on each and concatenated.
             Useful for model with large memory footprint like Tasnet.
@@ -170,6 +207,8 @@ def apply_model(model: tp.Union[BagOfModels, Model],
         num_workers (int): if non zero, device is 'cpu', how many threads to
             use in parallel.
         segment (float or None): override the model segment parameter.
+        seed (int or None): if provided, seeds the random offsets of the shift trick so that
+            the output is reproducible. Each model of a bag uses `seed + index`.
     """
     if device is None:
         device = mix.device
@@ -210,6 +249,8 @@ def apply_model(model: tp.Union[BagOfModels, Model],
                     lambda d, i=callback_arg["model_idx_in_bag"]: callback(
                         _replace_dict(d, ("model_idx_in_bag", i))) if callback else None)
             )
+            if seed is not None:
+                kwargs["seed"] = seed + callback_arg["model_idx_in_bag"]
             original_model_device = next(iter(sub_model.parameters())).device
             sub_model.to(device)
 
@@ -234,15 +275,30 @@ def apply_model(model: tp.Union[BagOfModels, Model],
     model.eval()
     assert transition_power >= 1, "transition_power < 1 leads to weird behavior."
     batch, channels, length = mix.shape
-    if shifts:
+    if shifts and split and device.type != 'cpu':
+        max_shift = int(0.5 * model.samplerate)
+        padded_mix = tensor_chunk(mix).padded(length + 2 * max_shift)
+        out = th.zeros(batch, len(model.sources), channels, length, device=mix.device)
+        views = []
+        for shift_idx, offset in enumerate(_shift_offsets(shifts, max_shift, seed)):
+            shifted = TensorChunk(padded_mix, offset, length + max_shift - offset)
+            views.append(_View(shifted, out, max_shift - offset, 1. / shifts,
+                               _replace_dict(callback_arg, ("shift_idx", shift_idx))))
+        # Shifted copies are stacked along the batch dimension instead of being run one
+        # after the other, every forward pass sees the same chunk of all of them.
+        _apply_split_batched(model, views, batch_size=shifts, overlap=overlap,
+                             transition_power=transition_power, progress=progress,
+                             device=device, segment=segment, pool=pool, lock=lock,
+                             callback=callback)
+        return out
+    elif shifts:
         kwargs['shifts'] = 0
         max_shift = int(0.5 * model.samplerate)
         mix = tensor_chunk(mix)
         assert isinstance(mix, TensorChunk)
         padded_mix = mix.padded(length + 2 * max_shift)
         out = 0.
-        for shift_idx in range(shifts):
-            offset = random.randint(0, max_shift)
+        for shift_idx, offset in enumerate(_shift_offsets(shifts, max_shift, seed)):
             shifted = TensorChunk(padded_mix, offset, length + max_shift - offset)
             kwargs["callback"] = (
                     (lambda d, i=shift_idx: callback(_replace_dict(d, ("shift_idx", i)))
@@ -265,15 +321,7 @@ def apply_model(model: tp.Union[BagOfModels, Model],
         stride = int((1 - overlap) * segment_length)
         offsets = range(0, length, stride)
         scale = float(format(stride / model.samplerate, ".2f"))
-        # We start from a triangle shaped weight, with maximal weight in the middle
-        # of the segment. Then we normalize and take to the power `transition_power`.
-        # Large values of transition power will lead to sharper transitions.
-        weight = th.cat([th.arange(1, segment_length // 2 + 1, device=device),
-                         th.arange(segment_length - segment_length // 2, 0, -1, device=device)])
-        assert len(weight) == segment_length
-        # If the overlap < 50%, this will translate to linear transition when
-        # transition_power is 1.
-        weight = (weight / weight.max())**transition_power
+        weight = _transition_weight(segment_length, transition_power, device)
         futures = []
         for offset in offsets:
             chunk = TensorChunk(mix, offset, segment_length)
@@ -300,13 +348,7 @@ def apply_model(model: tp.Union[BagOfModels, Model],
         assert isinstance(out, th.Tensor)
         return out
     else:
-        valid_length: int
-        if isinstance(model, HTDemucs) and segment is not None:
-            valid_length = int(segment * model.samplerate)
-        elif hasattr(model, 'valid_length'):
-            valid_length = model.valid_length(length)  # type: ignore
-        else:
-            valid_length = length
+        valid_length = _valid_length(model, length, segment)
         mix = tensor_chunk(mix)
         assert isinstance(mix, TensorChunk)
         padded_mix = mix.padded(valid_length).to(device)
@@ -320,3 +362,411 @@ def apply_model(model: tp.Union[BagOfModels, Model],
                 callback(_replace_dict(callback_arg, ("state", "end")))  # type: ignore
         assert isinstance(out, th.Tensor)
         return center_trim(out, length)
+
+
+class _View(tp.NamedTuple):
+    mix: tp.Union[th.Tensor, TensorChunk]
+    out: th.Tensor
+    trim: int = 0
+    scale: float = 1.
+    callback_arg: tp.Optional[dict] = None
+
+
+def _apply_split_batched(model: Model, views: tp.Sequence[_View], batch_size: int = 1,
+                         overlap: float = 0.25, transition_power: float = 1.,
+                         progress: bool = False, device=None,
+                         segment: tp.Optional[float] = None, pool=None, lock=None,
+                         callback: tp.Optional[tp.Callable[[dict], None]] = None) -> None:
+    """
+    Same as the `split` branch of `apply_model` for a single model, except that the chunks
+    of all the `views` are packed together and sent `batch_size` at a time through the model.
+    The forward passes are submitted to `pool`, and accumulated in order on the calling thread.
+
+    Each view is normalized by its own overlap-add weights, multiplied by `view.scale`, and
+    accumulated inplace into `view.out`, dropping its first `view.trim` samples. This is
+    how shifted copies of a mix are averaged without keeping each of them in memory.
+    """
+    if pool is None:
+        pool = DummyPoolExecutor()
+    if lock is None:
+        lock = Lock()
+    if segment is None:
+        chunk_segment = model.segment
+    else:
+        chunk_segment = segment
+    assert chunk_segment is not None and chunk_segment > 0.
+    segment_length: int = int(model.samplerate * chunk_segment)
+    stride = int((1 - overlap) * segment_length)
+    weight = _transition_weight(segment_length, transition_power, device)
+
+    # Chunks are grouped by the length they are padded to, so that a batch never needs
+    # extra padding and every chunk sees exactly the same input as with `apply_model`.
+    buckets: tp.Dict[int, list] = {}
+    sum_weights = []
+    for view_idx, view in enumerate(views):
+        length = view.mix.shape[-1]
+        sum_weight = th.zeros(length, device=view.out.device)
+        for chunk_idx, offset in enumerate(range(0, length, stride)):
+            chunk = TensorChunk(view.mix, offset, segment_length)
+            sum_weight[offset:offset + segment_length] += \
+                weight[:chunk.length].to(sum_weight.device)
+            valid_length = _valid_length(model, chunk.length, segment)
+            buckets.setdefault(valid_length, []).append((chunk_idx, view_idx, offset, chunk))
+        assert sum_weight.min() > 0
+        sum_weights.append(sum_weight)
+
+    batches = []
+    for valid_length, bucket in buckets.items():
+        # Interleave views so that the same chunk of every view lands in the same batch.
+        bucket.sort(key=lambda job: job[:2])
+        for start in range(0, len(bucket), batch_size):
+            batches.append((valid_length, bucket[start:start + batch_size]))
+
+    def forward(valid_length, jobs):
+        padded = th.cat([chunk.padded(valid_length) for *_, chunk in jobs]).to(device)
+        with lock:
+            if callback is not None:
+                for _, view_idx, offset, _ in jobs:
+                    callback(_replace_dict(views[view_idx].callback_arg, ("segment_offset", offset),
+                                           ("state", "start")))
+        with th.no_grad():
+            out = model(padded)
+        with lock:
+            if callback is not None:
+                for _, view_idx, offset, _ in jobs:
+                    callback(_replace_dict(views[view_idx].callback_arg, ("segment_offset", offset),
+                                           ("state", "end")))
+        return out
+
+    futures = [(pool.submit(forward, valid_length, jobs), jobs) for valid_length, jobs in batches]
+    if progress:
+        futures = tqdm.tqdm(futures, ncols=120, unit='batch')
+
+    for future, jobs in futures:
+        try:
+            out = future.result()
+        except Exception:
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+        row = 0
+        for _, view_idx, offset, chunk in jobs:
+            view = views[view_idx]
+            rows = chunk.shape[0]
+            chunk_length = chunk.length
+            chunk_out = center_trim(out[row:row + rows], chunk_length)
+            row += rows
+            chunk_out = (weight[:chunk_length] * chunk_out).to(view.out.device)
+            chunk_out *= view.scale / sum_weights[view_idx][offset:offset + chunk_length]
+            skip = max(0, view.trim - offset)
+            start = offset + skip - view.trim
+            view.out[..., start:start + chunk_length - skip] += chunk_out[..., skip:]
+
+
+def apply_model_batched(model: tp.Union[BagOfModels, Model],
+                        mixes: tp.Sequence[tp.Union[th.Tensor, TensorChunk]],
+                        batch_size: int = 8, shifts: int = 1,
+                        overlap: float = 0.25, transition_power: float = 1.,
+                        progress: bool = False, device=None,
+                        segment: tp.Optional[float] = None,
+                        callback: tp.Optional[tp.Callable[[dict], None]] = None,
+                        callback_arg: tp.Optional[dict] = None,
+                        seed: tp.Optional[int] = None) -> tp.List[th.Tensor]:
+    """
+    Apply model to several mixtures at once, always splitting them in chunks. Chunks from all
+    the mixtures (and from all the shifted copies of each mixture) are packed into batches of
+    `batch_size` so that the model runs a few large forward passes instead of one per chunk,
+    which is much faster on CPU. Overlap-add is done per mixture exactly as in `apply_model`.
+
+    Args:
+        mixes (list[torch.Tensor]): mixtures of shape `(batch, channels, length)`, their
+            lengths may differ.
+        batch_size (int): how many chunks go through the model in a single forward pass.
+        Other arguments are the same as for `apply_model`.
+
+    Returns:
+        list[torch.Tensor]: one `(batch, sources, channels, length)` tensor per mixture.
+    """
+    assert len(mixes) > 0
+    if device is None:
+        device = mixes[0].device
+    else:
+        device = th.device(device)
+    callback_arg = _replace_dict(
+        callback_arg, *{"model_idx_in_bag": 0, "shift_idx": 0, "segment_offset": 0}.items()
+    )
+    if isinstance(model, BagOfModels):
+        estimates: tp.List[tp.Union[float, th.Tensor]] = [0.] * len(mixes)
+        totals = [0.] * len(model.sources)
+        callback_arg["models"] = len(model.models)
+        for sub_model, model_weights in zip(model.models, model.weights):
+            original_model_device = next(iter(sub_model.parameters())).device
+            sub_model.to(device)
+            outs = apply_model_batched(
+                sub_model, mixes, batch_size=batch_size, shifts=shifts, overlap=overlap,
+                transition_power=transition_power, progress=progress, device=device,
+                segment=segment, callback=callback, callback_arg=callback_arg,
+                seed=None if seed is None else seed + callback_arg["model_idx_in_bag"])
+            sub_model.to(original_model_device)
+            for k, inst_weight in enumerate(model_weights):
+                for out in outs:
+                    out[:, k, :, :] *= inst_weight
+                totals[k] += inst_weight
+            for idx, out in enumerate(outs):
+                estimates[idx] += out
+            del outs
+            callback_arg["model_idx_in_bag"] += 1
+        for estimate in estimates:
+            assert isinstance(estimate, th.Tensor)
+            for k in range(estimate.shape[1]):
+                estimate[:, k, :, :] /= totals[k]
+        return tp.cast(tp.List[th.Tensor], estimates)
+
+    if "models" not in callback_arg:
+        callback_arg["models"] = 1
+    model.to(device)
+    model.eval()
+    assert transition_power >= 1, "transition_power < 1 leads to weird behavior."
+    outs = []
+    views = []
+    for mix in mixes:
+        batch, channels, length = mix.shape
+        out = th.zeros(batch, len(model.sources), channels, length, device=mix.device)
+        outs.append(out)
+        if not shifts:
+            views.append(_View(mix, out, callback_arg=callback_arg))
+            continue
+        max_shift = int(0.5 * model.samplerate)
+        padded_mix = tensor_chunk(mix).padded(length + 2 * max_shift)
+        for shift_idx, offset in enumerate(_shift_offsets(shifts, max_shift, seed)):
+            shifted = TensorChunk(padded_mix, offset, length + max_shift - offset)
+            views.append(_View(shifted, out, max_shift - offset, 1. / shifts,
+                               _replace_dict(callback_arg, ("shift_idx", shift_idx))))
+    _apply_split_batched(model, views, batch_size=batch_size, overlap=overlap,
+                         transition_power=transition_power, progress=progress, device=device,
+                         segment=segment, callback=callback)
+    return outs
+
+
+class _Stream:
+    """
+    Overlap-add state of one model over one (possibly shifted) view of a mix that is only
+    available block by block. The view is the mix preceded by `trim` zeros, as produced by
+    the shift trick in `apply_model`.
+    """
+    def __init__(self, model: Model, trim: int, scale: th.Tensor, overlap: float,
+                 transition_power: float, device, segment: tp.Optional[float],
+                 callback_arg: dict):
+        self.model = model
+        self.trim = trim
+        self.scale = scale
+        self.device = device
+        self.segment = segment
+        self.callback_arg = callback_arg
+        chunk_segment = model.segment if segment is None else segment
+        assert chunk_segment is not None and chunk_segment > 0.
+        self.segment_length = int(model.samplerate * chunk_segment)
+        self.stride = int((1 - overlap) * self.segment_length)
+        self.weight = _transition_weight(self.segment_length, transition_power, device)
+        # How far past its end a full chunk reads because of the padding to `valid_length`.
+        full_delta = _valid_length(model, self.segment_length, segment) - self.segment_length
+        self.lookahead = full_delta - full_delta // 2
+        # A short last chunk is padded on both sides and can read up to a whole
+        # `valid_length` before its offset.
+        self.history = _valid_length(model, self.segment_length, segment)
+        self.buffer: tp.Optional[th.Tensor] = None
+        self.buffer_start = 0
+        self.available = 0
+        self.next_offset = 0
+        self.out: tp.Optional[th.Tensor] = None
+        self.sum_weight: tp.Optional[th.Tensor] = None
+        self.out_start = 0
+
+    def feed(self, block: th.Tensor):
+        if self.buffer is None:
+            block = F.pad(block, (self.trim, 0))
+            batch, channels, _ = block.shape
+            self.out = th.zeros(batch, len(self.model.sources), channels, 0, device=block.device)
+            self.sum_weight = th.zeros(0, device=block.device)
+            self.buffer = block
+        else:
+            self.buffer = th.cat([self.buffer, block], dim=-1)
+        self.available += block.shape[-1]
+
+    def ready_chunks(self, final: bool):
+        """Return the (offset, length) of every chunk whose input is entirely known."""
+        chunks = []
+        while self.next_offset < self.available:
+            offset = self.next_offset
+            length = min(self.segment_length, self.available - offset)
+            if not final and offset + self.segment_length + self.lookahead > self.available:
+                break
+            chunks.append((offset, length))
+            self.next_offset += self.stride
+        return chunks
+
+    def padded(self, offset: int, length: int) -> th.Tensor:
+        assert self.buffer is not None
+        valid_length = _valid_length(self.model, length, self.segment)
+        delta = valid_length - length
+        start = offset - delta // 2
+        end = start + valid_length
+        correct_start = max(self.buffer_start, start)
+        correct_end = min(self.available, end)
+        # Only the zeros before the start of the view may be missing from the buffer.
+        assert start >= self.buffer_start or self.buffer_start == 0
+        out = self.buffer[..., correct_start - self.buffer_start:correct_end - self.buffer_start]
+        return F.pad(out, (correct_start - start, end - correct_end))
+
+    def add(self, offset: int, chunk_out: th.Tensor):
+        assert self.out is not None and self.sum_weight is not None
+        length = chunk_out.shape[-1]
+        start = offset - self.out_start
+        if start + length > self.out.shape[-1]:
+            missing = start + length - self.out.shape[-1]
+            self.out = F.pad(self.out, (0, missing))
+            self.sum_weight = F.pad(self.sum_weight, (0, missing))
+        weighted = self.weight[:length] * chunk_out
+        self.out[..., start:start + length] += weighted.to(self.out.device)
+        self.sum_weight[start:start + length] += self.weight[:length].to(self.out.device)
+
+    def pop_finished(self, final: bool) -> th.Tensor:
+        """
+        Return the samples that no further chunk can contribute to, in mix coordinates
+        (that is with the `trim` leading samples dropped), and forget about them.
+        """
+        assert self.out is not None and self.sum_weight is not None and self.buffer is not None
+        end = self.available if final else min(self.next_offset, self.available)
+        count = end - self.out_start
+        out = self.out[..., :count] / self.sum_weight[:count]
+        out *= self.scale.to(out.device)[:, None, None]
+        skip = max(0, self.trim - self.out_start)
+        out = out[..., skip:]
+        self.out = self.out[..., count:]
+        self.sum_weight = self.sum_weight[count:]
+        self.out_start = end
+        keep_from = max(0, self.next_offset - self.history)
+        if keep_from > self.buffer_start:
+            self.buffer = self.buffer[..., keep_from - self.buffer_start:]
+            self.buffer_start = keep_from
+        return out
+
+
+def apply_model_streaming(model: tp.Union[BagOfModels, Model],
+                          blocks: tp.Iterable[th.Tensor],
+                          shifts: int = 1, overlap: float = 0.25,
+                          transition_power: float = 1., device=None,
+                          segment: tp.Optional[float] = None, batch_size: int = 1,
+                          callback: tp.Optional[tp.Callable[[dict], None]] = None,
+                          callback_arg: tp.Optional[dict] = None,
+                          seed: tp.Optional[int] = None) -> tp.Iterator[th.Tensor]:
+    """
+    Apply model to a mix that is only available block by block, always splitting it in chunks.
+    Separated audio is yielded as soon as no further chunk can contribute to it, so memory
+    stays bounded by a few segments no matter how long the mix is.
+
+    Args:
+        blocks (iterable of torch.Tensor): consecutive pieces of the mix, each of shape
+            `(batch, channels, length)`. Blocks may have any length.
+        batch_size (int): how many chunks go through the model in a single forward pass.
+            Chunks of all shifts (and all models of a bag) are packed together.
+        Other arguments are the same as for `apply_model`.
+
+    Yields:
+        torch.Tensor: consecutive pieces of shape `(batch, sources, channels, length)`. Their
+            concatenation is what `apply_model` with `split=True` returns for the whole mix,
+            up to the random offsets used by the shift trick.
+    """
+    if device is not None:
+        device = th.device(device)
+    callback_arg = _replace_dict(
+        callback_arg, *{"model_idx_in_bag": 0, "shift_idx": 0, "segment_offset": 0}.items()
+    )
+    if isinstance(model, BagOfModels):
+        sub_models = list(zip(model.models, model.weights))
+    else:
+        sub_models = [(model, [1. for _ in model.sources])]
+    totals = th.tensor([sum(weights) for weights in zip(*(w for _, w in sub_models))])
+    callback_arg["models"] = len(sub_models)
+
+    streams: tp.List[_Stream] = []
+    lock = Lock()
+    blocks = iter(blocks)
+    first = next(blocks, None)
+    if first is None:
+        return
+    if device is None:
+        device = first.device
+    for model_idx, (sub_model, model_weights) in enumerate(sub_models):
+        sub_model.to(device)
+        sub_model.eval()
+        scale = th.tensor(model_weights) / totals
+        arg = _replace_dict(callback_arg, ("model_idx_in_bag", model_idx))
+        if not shifts:
+            streams.append(_Stream(sub_model, 0, scale, overlap, transition_power, device,
+                                   segment, arg))
+            continue
+        max_shift = int(0.5 * sub_model.samplerate)
+        model_seed = None if seed is None else seed + model_idx
+        for shift_idx, offset in enumerate(_shift_offsets(shifts, max_shift, model_seed)):
+            streams.append(_Stream(sub_model, max_shift - offset, scale / shifts, overlap,
+                                   transition_power, device, segment,
+                                   _replace_dict(arg, ("shift_idx", shift_idx))))
+
+    total: tp.Optional[th.Tensor] = None
+    total_start = 0
+    ends = [0] * len(streams)
+    block: tp.Optional[th.Tensor] = first
+    while True:
+        final = block is None
+        if block is not None:
+            for stream in streams:
+                stream.feed(block)
+        groups: tp.Dict[tp.Tuple[int, int], list] = {}
+        for stream_idx, stream in enumerate(streams):
+            for offset, length in stream.ready_chunks(final):
+                valid_length = _valid_length(stream.model, length, stream.segment)
+                key = (id(stream.model), valid_length)
+                groups.setdefault(key, []).append((offset, stream_idx, length))
+        for jobs in groups.values():
+            jobs.sort()
+            for start in range(0, len(jobs), batch_size):
+                batch_jobs = jobs[start:start + batch_size]
+                sub_model = streams[batch_jobs[0][1]].model
+                padded = th.cat([streams[stream_idx].padded(offset, length)
+                                 for offset, stream_idx, length in batch_jobs]).to(device)
+                with lock:
+                    if callback is not None:
+                        for offset, stream_idx, _ in batch_jobs:
+                            callback(_replace_dict(streams[stream_idx].callback_arg,
+                                                   ("segment_offset", offset), ("state", "start")))
+                with th.no_grad():
+                    out = sub_model(padded)
+                with lock:
+                    if callback is not None:
+                        for offset, stream_idx, _ in batch_jobs:
+                            callback(_replace_dict(streams[stream_idx].callback_arg,
+                                                   ("segment_offset", offset), ("state", "end")))
+                rows = out.shape[0] // len(batch_jobs)
+                for idx, (offset, stream_idx, length) in enumerate(batch_jobs):
+                    streams[stream_idx].add(
+                        offset, center_trim(out[idx * rows:(idx + 1) * rows], length))
+
+        for stream_idx, stream in enumerate(streams):
+            finished = stream.pop_finished(final)
+            if total is None:
+                total = th.zeros_like(finished[..., :0])
+            start = ends[stream_idx] - total_start
+            end = start + finished.shape[-1]
+            if end > total.shape[-1]:
+                total = F.pad(total, (0, end - total.shape[-1]))
+            total[..., start:end] += finished
+            ends[stream_idx] += finished.shape[-1]
+        assert total is not None
+        ready = min(ends) - total_start
+        if ready > 0:
+            yield total[..., :ready]
+            total = total[..., ready:]
+            total_start += ready
+        if final:
+            return
+        block = next(blocks, None)
@@ -0,0 +1,75 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+"""Checks that the batched and streaming paths of `demucs.apply` match `apply_model`."""
+
+import random
+import unittest
+
+import torch as th
+
+from demucs import transformer
+from demucs.apply import BagOfModels, apply_model, apply_model_batched, apply_model_streaming
+from demucs.demucs import Demucs
+from demucs.htdemucs import HTDemucs
+
+SOURCES = ['drums', 'bass', 'other', 'vocals']
+SAMPLERATE = 8000
+TOLERANCE = 1e-5
+
+
+def small_models():
+    th.manual_seed(0)
+    # The transformer draws its random positional shift from this module level generator
+    transformer.random = random.Random(0)
+    htdemucs = HTDemucs(SOURCES, channels=8, depth=2, segment=2, t_layers=1, samplerate=SAMPLERATE,
+                        nfft=512, bottom_channels=0, dconv_mode=0).eval()
+    demucs = Demucs(SOURCES, channels=8, depth=3, segment=2, samplerate=SAMPLERATE).eval()
+    return {'htdemucs': htdemucs, 'demucs': demucs, 'bag': BagOfModels([htdemucs, demucs])}
+
+
+class TestApply(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.models = small_models()
+        generator = th.Generator().manual_seed(1)
+        # Shorter than one 2 seconds segment, and several segments plus a few samples
+        cls.mixes = [th.randn(1, 2, SAMPLERATE + 123, generator=generator),
+                     th.randn(1, 2, 5 * SAMPLERATE + 37, generator=generator)]
+
+    def assertClose(self, actual, expected):
+        self.assertEqual(actual.shape, expected.shape)
+        self.assertLess((actual - expected).abs().max().item(), TOLERANCE)
+
+    def test_batched(self):
+        for name, model in self.models.items():
+            for shifts in [0, 2]:
+                with self.subTest(model=name, shifts=shifts), th.no_grad():
+                    expected = [apply_model(model, mix, shifts=shifts, seed=3)
+                                for mix in self.mixes]
+                    for batch_size in [1, 3]:
+                        outs = apply_model_batched(model, self.mixes, batch_size=batch_size,
+                                                   shifts=shifts, seed=3)
+                        for out, ref in zip(outs, expected):
+                            self.assertClose(out, ref)
+
+    def test_streaming(self):
+        # 3001 is not a multiple of anything the models use, so blocks cut through chunks
+        block = 3001
+        for name, model in self.models.items():
+            for shifts in [0, 2]:
+                with self.subTest(model=name, shifts=shifts), th.no_grad():
+                    for mix in self.mixes:
+                        expected = apply_model(model, mix, shifts=shifts, seed=3)
+                        blocks = [mix[..., start:start + block]
+                                  for start in range(0, mix.shape[-1], block)]
+                        pieces = apply_model_streaming(model, blocks, shifts=shifts, seed=3,
+                                                       batch_size=2)
+                        out = th.cat(list(pieces), dim=-1)
+                        self.assertClose(out, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Benchmark of the shift trick: wall-clock time against `shifts`, with the shifted copies batched
+together versus run one after the other. `apply_model` only batches them off the CPU, both are
+timed here whatever the device.
+
+    python3 -m tools.bench_shifts -n htdemucs_ft --shifts 0 1 2 5 --duration 30
+
+With `--random`, the pretrained weights are not downloaded: an untrained bag of four HTDemucs
+with the htdemucs_ft architecture is used instead, which has the same cost per forward pass.
+"""
+import argparse
+import time
+
+import torch
+
+from demucs.apply import (BagOfModels, TensorChunk, apply_model, tensor_chunk, _apply_split_batched,
+                          _shift_offsets, _View)
+from demucs.htdemucs import HTDemucs
+from demucs.pretrained import get_model
+
+
+def random_htdemucs_ft():
+    """Untrained bag with the layout of htdemucs_ft: one HTDemucs per source."""
+    sources = ['drums', 'bass', 'other', 'vocals']
+    models = [HTDemucs(sources, segment=7.8).eval() for _ in sources]
+    weights = [[float(i == k) for k in range(len(sources))] for i in range(len(sources))]
+    return BagOfModels(models, weights)
+
+
+def per_model(fn, model, mix, shifts, seed):
+    """Apply `fn` to each model of a bag with the seeds `apply_model` uses, and mix the outputs."""
+    if not isinstance(model, BagOfModels):
+        return fn(model, mix, shifts, seed)
+    estimates = 0.
+    totals = [0.] * len(model.sources)
+    for idx, (sub_model, weights) in enumerate(zip(model.models, model.weights)):
+        out = fn(sub_model, mix, shifts, seed + idx)
+        for k, weight in enumerate(weights):
+            out[:, k] *= weight
+            totals[k] += weight
+        estimates += out
+    for k in range(len(totals)):
+        estimates[:, k] /= totals[k]
+    return estimates
+
+
+def serial_shifts(model, mix, shifts, seed):
+    """One full pass of `apply_model` per shift."""
+    if not shifts:
+        return apply_model(model, mix, shifts=0)
+    length = mix.shape[-1]
+    max_shift = int(0.5 * model.samplerate)
+    padded_mix = tensor_chunk(mix).padded(length + 2 * max_shift)
+    out = 0.
+    for offset in _shift_offsets(shifts, max_shift, seed):
+        shifted = TensorChunk(padded_mix, offset, length + max_shift - offset)
+        out += apply_model(model, shifted, shifts=0)[..., max_shift - offset:]
+    return out / shifts
+
+
+def batched_shifts(model, mix, shifts, seed):
+    """The same chunk of every shifted copy in one forward pass, as `apply_model` does on GPU."""
+    if not shifts:
+        return apply_model(model, mix, shifts=0)
+    length = mix.shape[-1]
+    max_shift = int(0.5 * model.samplerate)
+    padded_mix = tensor_chunk(mix).padded(length + 2 * max_shift)
+    out = torch.zeros(mix.shape[0], len(model.sources), mix.shape[1], length, device=mix.device)
+    views = [_View(TensorChunk(padded_mix, offset, length + max_shift - offset), out,
+                   max_shift - offset, 1. / shifts, {})
+             for offset in _shift_offsets(shifts, max_shift, seed)]
+    _apply_split_batched(model, views, batch_size=shifts, device=mix.device)
+    return out
+
+
+def timed(fn):
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    begin = time.time()
+    out = fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return time.time() - begin, out
+
+
+def main():
+    parser = argparse.ArgumentParser("bench_shifts")
+    parser.add_argument("-n", "--name", default="htdemucs_ft")
+    parser.add_argument("--repo", type=str)
+    parser.add_argument("-d", "--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--duration", type=float, default=30., help="seconds of random audio")
+    parser.add_argument("--shifts", type=int, nargs="+", default=[0, 1, 2, 5])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--random", action="store_true",
+                        help="untrained htdemucs_ft architecture, nothing is downloaded")
+    args = parser.parse_args()
+
+    model = random_htdemucs_ft() if args.random else get_model(args.name, repo=args.repo)
+    model.to(args.device)
+    mix = torch.randn(1, model.audio_channels, int(args.duration * model.samplerate),
+                      device=args.device)
+    name = 'random htdemucs_ft' if args.random else args.name
+    print(f"{name} on {args.device}, {args.duration:.0f}s of audio")
+    print(f"{'shifts':>6} {'serial':>10} {'batched':>10} {'speedup':>8} {'max diff':>10}")
+    for shifts in args.shifts:
+        serial_time, ref = timed(lambda: per_model(serial_shifts, model, mix, shifts, args.seed))
+        batched_time, out = timed(lambda: per_model(batched_shifts, model, mix, shifts, args.seed))
+        diff = (out - ref).abs().max().item()
+        print(f"{shifts:>6} {serial_time:>9.2f}s {batched_time:>9.2f}s "
+              f"{serial_time / batched_time:>7.2f}x {diff:>10.2e}")
+
+
+if __name__ == "__main__":
+    main()
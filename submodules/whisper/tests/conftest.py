@@ -2,6 +2,10 @@ import random as rand
 
 import numpy
 import pytest
+import torch
+
+from whisper.audio import N_FRAMES
+from whisper.model import ModelDimensions, Whisper
 
 
 def pytest_configure(config):
@@ -12,3 +16,24 @@ def pytest_configure(config):
 def random():
     rand.seed(42)
     numpy.random.seed(42)
+
+
+@pytest.fixture
+def tiny_model():
+    torch.manual_seed(0)
+    dims = ModelDimensions(
+        n_mels=80,
+        n_audio_ctx=N_FRAMES // 2,
+        n_audio_state=64,
+        n_audio_head=2,
+        n_audio_layer=2,
+        n_vocab=51865,
+        n_text_ctx=448,
+        n_text_state=64,
+        n_text_head=2,
+        n_text_layer=2,
+    )
+    model = Whisper(dims).eval()
+    with torch.no_grad():
+        model.decoder.positional_embedding.normal_(0, 0.02)
+    return model
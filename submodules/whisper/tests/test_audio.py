@@ -2,7 +2,14 @@ import os.path
 
 import numpy as np
 
-from whisper.audio import SAMPLE_RATE, load_audio, log_mel_spectrogram
+from whisper.audio import (
+    N_FRAMES,
+    N_SAMPLES,
+    SAMPLE_RATE,
+    LogMelSpectrogramStream,
+    load_audio,
+    log_mel_spectrogram,
+)
 
 
 def test_audio():
@@ -17,3 +24,22 @@ def test_audio():
 
     assert np.allclose(mel_from_audio, mel_from_file)
     assert mel_from_audio.max() - mel_from_audio.min() <= 2.0
+
+
+def test_log_mel_spectrogram_stream():
+    audio_path = os.path.join(os.path.dirname(__file__), "jfk.flac")
+    mel = log_mel_spectrogram(audio_path, padding=N_SAMPLES)
+    stream = LogMelSpectrogramStream(audio_path, padding=N_SAMPLES, block_frames=300)
+    assert stream.shape == mel.shape
+    for start in range(0, mel.shape[-1], 700):
+        assert np.allclose(
+            stream[:, start : start + N_FRAMES], mel[:, start : start + N_FRAMES]
+        )
+    # going back restarts the stream
+    assert np.allclose(stream[:, :100], mel[:, :100])
+
+    audio = np.random.randn(SAMPLE_RATE * 7 + 123).astype(np.float32)
+    mel = log_mel_spectrogram(audio)
+    for block_frames in [1, 64, N_FRAMES]:
+        stream = LogMelSpectrogramStream(audio, block_frames=block_frames)
+        assert np.allclose(stream[:, :], mel, atol=1e-6)
@@ -0,0 +1,91 @@
+from dataclasses import replace
+
+import numpy as np
+import pytest
+import torch
+
+from whisper.audio import N_FRAMES, SAMPLE_RATE, log_mel_spectrogram, pad_or_trim
+from whisper.decoding import DecodingOptions, decode
+from whisper.transcribe import transcribe
+
+
+@pytest.mark.parametrize("beam_size", [None, 3])
+def test_batch_decodes_like_single_windows(tiny_model, beam_size):
+    mel = torch.randn(3, 80, N_FRAMES)
+    options = DecodingOptions(
+        language="en", beam_size=beam_size, sample_len=12, fp16=False
+    )
+    batched = decode(tiny_model, mel, options)
+    for window, result in zip(mel, batched):
+        assert result.tokens == decode(tiny_model, window, options).tokens
+
+
+def record_batches(model, fail_first_at_zero=False):
+    batches = []
+    decode_batch = model.decode
+
+    def wrapped(features, options):
+        results = decode_batch(features, options)
+        batches.append((len(features), options.temperature))
+        if fail_first_at_zero and options.temperature == 0:
+            results[0] = replace(results[0], avg_logprob=-10.0)
+        return results
+
+    model.decode = wrapped
+    return batches
+
+
+def test_transcribe_batched(tiny_model):
+    audio = np.random.default_rng(0).normal(0, 0.1, 75 * SAMPLE_RATE).astype(np.float32)
+    batches = record_batches(tiny_model)
+    result = transcribe(
+        tiny_model,
+        audio,
+        condition_on_previous_text=False,
+        batch_size=2,
+        temperature=0.0,
+        logprob_threshold=None,
+        no_speech_threshold=None,
+        language="en",
+        sample_len=12,
+        fp16=False,
+    )
+
+    assert batches == [(2, 0.0), (1, 0.0)]
+    assert sorted({s["seek"] for s in result["segments"]}) == [
+        0,
+        N_FRAMES,
+        2 * N_FRAMES,
+    ]
+
+    # the segments of a window split the tokens it decodes to on its own
+    mel = log_mel_spectrogram(audio)
+    options = DecodingOptions(language="en", sample_len=12, fp16=False, prompt=[])
+    for seek in [0, N_FRAMES, 2 * N_FRAMES]:
+        window = pad_or_trim(mel[:, seek : seek + N_FRAMES], N_FRAMES)
+        expected = decode(tiny_model, window, options)
+        segments = [s for s in result["segments"] if s["seek"] == seek]
+        assert sum((s["tokens"] for s in segments), []) == expected.tokens
+
+
+def test_transcribe_batched_falls_back_per_window(tiny_model):
+    audio = np.random.default_rng(0).normal(0, 0.1, 75 * SAMPLE_RATE).astype(np.float32)
+    batches = record_batches(tiny_model, fail_first_at_zero=True)
+    result = transcribe(
+        tiny_model,
+        audio,
+        condition_on_previous_text=False,
+        batch_size=3,
+        temperature=(0.0, 0.5),
+        logprob_threshold=-1.0,
+        compression_ratio_threshold=None,
+        no_speech_threshold=None,
+        language="en",
+        sample_len=12,
+        fp16=False,
+    )
+
+    # only the window that failed at temperature 0 is decoded again
+    assert batches[0] == (3, 0.0)
+    assert batches[1] == (1, 0.5)
+    assert result["segments"][0]["temperature"] == 0.5
@@ -0,0 +1,53 @@
+import pytest
+import torch
+
+from whisper.audio import N_FRAMES
+from whisper.decoding import DecodingOptions, decode
+from whisper.model import KVCache
+
+
+def test_kv_cache_matches_full_forward(tiny_model):
+    model = tiny_model
+    xa = model.embed_audio(torch.randn(2, 80, N_FRAMES))
+    tokens = torch.randint(0, 50000, (2, 12))
+
+    with torch.no_grad():
+        expected = model.decoder(tokens, xa)
+        for cache in [None, KVCache(model.dims.n_text_ctx)]:
+            cache, hooks = model.install_kv_cache_hooks(cache)
+            actual = torch.cat(
+                [
+                    model.decoder(tokens[:, start:end], xa, kv_cache=cache)
+                    for start, end in [(0, 8)] + [(i, i + 1) for i in range(8, 12)]
+                ],
+                dim=1,
+            )
+            for hook in hooks:
+                hook.remove()
+            assert torch.allclose(actual, expected, atol=1e-4)
+
+    assert cache.offset == 12
+
+
+@pytest.mark.parametrize("beam_size", [None, 3])
+def test_static_kv_cache_decodes_the_same_tokens(tiny_model, beam_size):
+    model = tiny_model
+    mel = torch.randn(1, 80, N_FRAMES)
+    results = [
+        decode(
+            model,
+            mel,
+            DecodingOptions(
+                language="en",
+                beam_size=beam_size,
+                sample_len=20,
+                fp16=False,
+                static_kv_cache=static_kv_cache,
+            ),
+        )
+        for static_kv_cache in [False, True]
+    ]
+
+    for expected, actual in zip(*results):
+        assert actual.tokens == expected.tokens
+        assert actual.avg_logprob == pytest.approx(expected.avg_logprob, abs=1e-4)
@@ -1,7 +1,8 @@
 import os
+import tempfile
 from functools import lru_cache
-from subprocess import CalledProcessError, run
-from typing import Optional, Union
+from subprocess import PIPE, CalledProcessError, Popen, run
+from typing import Iterator, Optional, Union
 
 import numpy as np
 import torch
@@ -62,6 +63,68 @@ def load_audio(file: str, sr: int = SAMPLE_RATE):
     return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
 
 
+def load_audio_blocks(
+    audio: Union[str, np.ndarray, torch.Tensor],
+    block_size: int,
+    sr: int = SAMPLE_RATE,
+) -> Iterator[torch.Tensor]:
+    """
+    Read the mono waveform of an audio file block by block, decoding it through ffmpeg as
+    `load_audio` does but without holding the whole file in memory. An in-memory waveform is
+    split into blocks of the same size.
+
+    Parameters
+    ----------
+    audio: Union[str, np.ndarray, torch.Tensor]
+        The path to the audio file to open, or the audio waveform
+
+    block_size: int
+        Number of samples per block; the last block may be shorter
+
+    sr: int
+        The sample rate to resample the audio if necessary
+
+    Returns
+    -------
+    An iterator over float32 Tensors of the consecutive samples.
+    """
+    if not isinstance(audio, str):
+        if not torch.is_tensor(audio):
+            audio = torch.from_numpy(audio)
+        for start in range(0, audio.shape[-1], block_size):
+            yield audio[start : start + block_size]
+        return
+
+    # fmt: off
+    cmd = [
+        "ffmpeg",
+        "-nostdin",
+        "-threads", "0",
+        "-i", audio,
+        "-f", "s16le",
+        "-ac", "1",
+        "-acodec", "pcm_s16le",
+        "-ar", str(sr),
+        "-"
+    ]
+    # fmt: on
+    # stderr goes to a file, a pipe nobody reads could fill up and stall ffmpeg
+    with tempfile.TemporaryFile() as stderr:
+        process = Popen(cmd, stdout=PIPE, stderr=stderr)
+        try:
+            while data := process.stdout.read(block_size * 2):
+                samples = np.frombuffer(data, np.int16).astype(np.float32) / 32768.0
+                yield torch.from_numpy(samples)
+            if process.wait() != 0:
+                stderr.seek(0)
+                raise RuntimeError(f"Failed to load audio: {stderr.read().decode()}")
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+
+
 def pad_or_trim(array, length: int = N_SAMPLES, *, axis: int = -1):
     """
     Pad or trim the audio array to N_SAMPLES, as expected by the encoder.
@@ -155,3 +218,162 @@ def log_mel_spectrogram(
     log_spec = torch.maximum(log_spec, log_spec.max() - 8.0)
     log_spec = (log_spec + 4.0) / 4.0
     return log_spec
+
+
+class LogMelSpectrogramStream:
+    """
+    The log-Mel spectrogram of `log_mel_spectrogram`, computed a block of frames at a time while
+    the audio is read with `load_audio_blocks`, so that long inputs never have their waveform,
+    STFT or spectrogram in memory at once. Frames are read by slicing, `stream[:, start:end]`,
+    with non-decreasing starts; going back restarts the stream from the beginning.
+
+    The spectrogram is clamped at 8 below its global maximum, so a first pass over the audio
+    finds that maximum and the number of samples, and the frames are recomputed on demand in a
+    second pass. Each frame sees the same samples as in the STFT of the whole signal, including
+    the reflect padding at both ends.
+
+    Parameters
+    ----------
+    audio: Union[str, np.ndarray, torch.Tensor], shape = (*)
+        The path to audio or either a NumPy array or Tensor containing the audio waveform in 16 kHz
+
+    n_mels: int
+        The number of Mel-frequency filters, only 80 is supported
+
+    padding: int
+        Number of zero samples to pad to the right
+
+    device: Optional[Union[str, torch.device]]
+        If given, the audio blocks are moved to this device before STFT
+
+    block_frames: int
+        Number of frames computed at a time
+    """
+
+    def __init__(
+        self,
+        audio: Union[str, np.ndarray, torch.Tensor],
+        n_mels: int = 80,
+        padding: int = 0,
+        device: Optional[Union[str, torch.device]] = None,
+        block_frames: int = N_FRAMES,
+    ):
+        self.audio = audio
+        self.n_mels = n_mels
+        self.padding = padding
+        self.device = device
+        self.block_frames = block_frames
+
+        self.n_samples = 0
+        log_spec_max = None
+        for block in self._log_spec_blocks():
+            block_max = block.max()
+            log_spec_max = (
+                block_max
+                if log_spec_max is None
+                else torch.maximum(log_spec_max, block_max)
+            )
+        self.log_spec_max = log_spec_max
+        self.n_frames = (self.n_samples + padding) // HOP_LENGTH
+        self._restart()
+
+    @property
+    def shape(self):
+        return self.n_mels, self.n_frames
+
+    def _samples(self) -> Iterator[torch.Tensor]:
+        block_size = self.block_frames * HOP_LENGTH
+        self.n_samples = 0
+        for block in load_audio_blocks(self.audio, block_size):
+            self.n_samples += block.shape[-1]
+            yield block
+        for start in range(0, self.padding, block_size):
+            yield torch.zeros(min(block_size, self.padding - start))
+
+    def _log_spec_blocks(self) -> Iterator[torch.Tensor]:
+        """Unnormalized log10 Mel frames of the whole signal, a block at a time"""
+        window = None
+        pending = None  # samples of the reflect-padded signal, from the next frame on
+        head = torch.zeros(
+            0
+        )  # the signal, until there is enough of it for the left padding
+        block_length = (self.block_frames - 1) * HOP_LENGTH + N_FFT
+        n_frames = 0
+
+        def log_spec(samples):
+            stft = torch.stft(
+                samples,
+                N_FFT,
+                HOP_LENGTH,
+                window=window,
+                center=False,
+                return_complex=True,
+            )
+            magnitudes = stft.abs() ** 2
+            mel_spec = mel_filters(samples.device, self.n_mels) @ magnitudes
+            return torch.clamp(mel_spec, min=1e-10).log10()
+
+        for block in self._samples():
+            if self.device is not None:
+                block = block.to(self.device)
+            if window is None:
+                window = torch.hann_window(N_FFT).to(block.device)
+                head = head.to(block.device)
+            if pending is None:
+                head = torch.cat([head, block])
+                if head.shape[-1] <= N_FFT // 2:
+                    continue
+                # reflect padding on the left, as in torch.stft(center=True)
+                pending, head = (
+                    torch.cat([head[1 : N_FFT // 2 + 1].flip(0), head]),
+                    None,
+                )
+            else:
+                pending = torch.cat([pending, block])
+            n_blocks = (pending.shape[-1] - block_length) // (
+                self.block_frames * HOP_LENGTH
+            ) + 1
+            if n_blocks > 0:
+                n = (n_blocks * self.block_frames - 1) * HOP_LENGTH + N_FFT
+                yield log_spec(pending[:n])
+                pending = pending[n_blocks * self.block_frames * HOP_LENGTH :]
+                n_frames += n_blocks * self.block_frames
+
+        if pending is None:
+            # shorter than the padding, fail like torch.stft
+            pending = torch.cat([head[1 : N_FFT // 2 + 1].flip(0), head])
+        # reflect padding on the right, and all frames but the last, as log_mel_spectrogram drops it
+        pending = torch.cat([pending, pending[-N_FFT // 2 - 1 : -1].flip(0)])
+        remaining = (self.n_samples + self.padding) // HOP_LENGTH - n_frames
+        if remaining > 0:
+            yield log_spec(pending)[:, :remaining]
+
+    def _restart(self):
+        self._blocks = self._log_spec_blocks()
+        self._frames = torch.zeros(self.n_mels, 0, device=self.device)
+        self._frames_start = 0
+
+    def __getitem__(self, index):
+        rows, columns = index if isinstance(index, tuple) else (index, slice(None))
+        start, end, step = columns.indices(self.n_frames)
+        assert step == 1, "only contiguous frames can be read"
+        if start < self._frames_start:
+            self._restart()
+
+        # compute the frames up to end, dropping the ones before start
+        frames, frames_start = [self._frames], self._frames_start
+        frames_end = frames_start + self._frames.shape[-1]
+        while frames_end < end:
+            block = next(self._blocks)
+            if frames_end + block.shape[-1] <= start:
+                frames, frames_start = [], frames_end + block.shape[-1]
+            else:
+                frames.append(block)
+            frames_end += block.shape[-1]
+        self._frames = torch.cat(frames, dim=1)[:, max(0, start - frames_start) :]
+        self._frames_start = max(start, frames_start)
+
+        log_spec = self._frames[:, : end - self._frames_start]
+        log_spec = torch.maximum(log_spec, self.log_spec_max - 8.0)
+        log_spec = (log_spec + 4.0) / 4.0
+        return log_spec[rows]
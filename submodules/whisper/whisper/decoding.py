@@ -112,6 +112,7 @@ class DecodingOptions:
 
     # implementation details
     fp16: bool = True  # use fp16 for most of the calculation
+    static_kv_cache: bool = True  # write the decoder's key/value cache in place
 
 
 @dataclass(frozen=True)
@@ -142,9 +143,13 @@ class Inference:
 
 
 class PyTorchInference(Inference):
-    def __init__(self, model: "Whisper", initial_token_length: int):
+    def __init__(
+        self, model: "Whisper", initial_token_length: int, static_kv_cache: bool = True
+    ):
         self.model: "Whisper" = model
         self.initial_token_length = initial_token_length
+        # preallocated cache written in place, or the tensors grown by the hooks on every token
+        self.static_kv_cache = static_kv_cache
         self.kv_cache = {}
         self.hooks = []
 
@@ -154,7 +159,12 @@ class PyTorchInference(Inference):
 
     def logits(self, tokens: Tensor, audio_features: Tensor) -> Tensor:
         if not self.kv_cache:
-            self.kv_cache, self.hooks = self.model.install_kv_cache_hooks()
+            from .model import KVCache
+
+            cache = (
+                KVCache(self.model.dims.n_text_ctx) if self.static_kv_cache else None
+            )
+            self.kv_cache, self.hooks = self.model.install_kv_cache_hooks(cache)
 
         if tokens.shape[-1] > self.initial_token_length:
             # only need to use the last token except in the first forward pass
@@ -170,7 +180,12 @@ class PyTorchInference(Inference):
         self.hooks = []
 
     def rearrange_kv_cache(self, source_indices):
+        from .model import KVCache
+
         if source_indices != list(range(len(source_indices))):
+            if isinstance(self.kv_cache, KVCache):
+                self.kv_cache.rearrange(source_indices)
+                return
             for module in self.kv_modules:
                 # update the key/value cache to contain the selected sequences
                 self.kv_cache[module] = self.kv_cache[module][source_indices].detach()
@@ -537,7 +552,9 @@ class DecodingTask:
         self.sot_index: int = self.initial_tokens.index(tokenizer.sot)
 
         # inference: implements the forward pass through the decoder, including kv caching
-        self.inference = PyTorchInference(model, len(self.initial_tokens))
+        self.inference = PyTorchInference(
+            model, len(self.initial_tokens), options.static_kv_cache
+        )
 
         # sequence ranker: implements how to rank a group of sampled sequences
         self.sequence_ranker = MaximumLikelihoodRanker(options.length_penalty)
@@ -732,6 +749,9 @@ class DecodingTask:
 
         # repeat text tensors by the group size, for beam search or best-of-n sampling
         tokens = tokens.repeat_interleave(self.n_group, dim=0).to(audio_features.device)
+        if n_audio > 1 and self.n_group > 1:
+            # a single audio is broadcast to its group, several have to line up with their tokens
+            audio_features = audio_features.repeat_interleave(self.n_group, dim=0)
 
         # call the main sampling loop
         tokens, sum_logprobs, no_speech_probs = self._main_loop(audio_features, tokens)
@@ -1,6 +1,7 @@
 import base64
 import gzip
 from dataclasses import dataclass
+from functools import partial
 from typing import Dict, Iterable, Optional
 
 import numpy as np
@@ -59,6 +60,67 @@ def sinusoids(length, channels, max_timescale=10000):
     return torch.cat([torch.sin(scaled_time), torch.cos(scaled_time)], dim=1)
 
 
+class KVCache(dict):
+    """
+    Key/value cache of the text decoder that preallocates `n_ctx` positions for every self-attention
+    projection. New positions are written in place at `offset`, and beam reorders gather the cached
+    rows within the same buffer, so a decoded token neither grows nor reallocates the cache. As in
+    the dictionary returned by `install_kv_cache_hooks`, every projection module maps to its cached
+    tensor, a view of the filled part of its buffer for self-attention; the cross-attention keys and
+    values are computed once per audio.
+    """
+
+    def __init__(self, n_ctx: int):
+        super().__init__()
+        self.n_ctx = n_ctx
+        self.offset = 0
+        self.buffers: Dict[nn.Module, Tensor] = {}
+
+    def update(
+        self, module: nn.Module, output: Tensor, n_head: Optional[int] = None
+    ) -> Tensor:
+        """
+        Store the projection `output` of `module` and return the keys or values to attend to.
+        `n_head` is given for key projections: the cross-attention keys are then stored with the
+        memory layout `qkv_attention` transposes them to, so every decoding step multiplies them
+        as a contiguous tensor instead of copying the transposed keys of the whole audio.
+        """
+        if output.shape[1] > self.n_ctx:
+            # cross attention, computed once per audio
+            if n_head is not None:
+                n_batch, n_ctx, n_state = output.shape
+                output = (
+                    output.view(n_batch, n_ctx, n_head, -1)
+                    .permute(0, 2, 3, 1)
+                    .contiguous()
+                    .permute(0, 3, 1, 2)
+                    .view(n_batch, n_ctx, n_state)
+                )
+            self[module] = output
+            return output
+
+        end = self.offset + output.shape[1]
+        buffer = self.buffers.get(module)
+        if buffer is None or buffer.shape[0] != output.shape[0]:
+            buffer = output.new_empty(output.shape[0], self.n_ctx, output.shape[2])
+            self.buffers[module] = buffer
+        buffer[:, self.offset : end] = output.detach()
+        self[module] = buffer[:, :end]
+        return self[module]
+
+    def advance(self, n_tokens: int):
+        """Mark the positions written by the last forward pass as cached"""
+        self.offset += n_tokens
+
+    def rearrange(self, source_indices: Tensor):
+        """Gather the cached positions of the selected sequences, for the updated beams"""
+        for module, buffer in self.buffers.items():
+            index = torch.as_tensor(source_indices, device=buffer.device)
+            # the gathered rows are copied out before they are written back
+            buffer[:, : self.offset] = buffer[index, : self.offset]
+            self[module] = buffer[:, : self.offset]
+
+
 class MultiHeadAttention(nn.Module):
     def __init__(self, n_state: int, n_head: int):
         super().__init__()
@@ -200,16 +262,23 @@ class TextDecoder(nn.Module):
         xa : torch.Tensor, shape = (batch_size, n_audio_ctx, n_audio_state)
             the encoded audio features to be attended on
         """
-        offset = next(iter(kv_cache.values())).shape[1] if kv_cache else 0
+        n_tokens = x.shape[-1]
+        if isinstance(kv_cache, KVCache):
+            offset = kv_cache.offset
+        else:
+            offset = next(iter(kv_cache.values())).shape[1] if kv_cache else 0
         x = (
             self.token_embedding(x)
-            + self.positional_embedding[offset : offset + x.shape[-1]]
+            + self.positional_embedding[offset : offset + n_tokens]
         )
         x = x.to(xa.dtype)
 
         for block in self.blocks:
             x = block(x, xa, mask=self.mask, kv_cache=kv_cache)
 
+        if isinstance(kv_cache, KVCache):
+            kv_cache.advance(n_tokens)
+
         x = self.ln(x)
         logits = (
             x @ torch.transpose(self.token_embedding.weight.to(x.dtype), 0, 1)
@@ -283,6 +352,9 @@ class Whisper(nn.Module):
         all caches, and the necessary hooks for the key and value projection modules that save the
         intermediate tensors to be reused during later calculations.
 
+        When `cache` is a `KVCache`, the hooks write into its preallocated buffers instead of
+        concatenating a new tensor for every token, and the same object is returned.
+
         Returns
         -------
         cache : Dict[nn.Module, torch.Tensor]
@@ -290,10 +362,13 @@ class Whisper(nn.Module):
         hooks : List[RemovableHandle]
             List of PyTorch RemovableHandle objects to stop the hooks to be called
         """
-        cache = {**cache} if cache is not None else {}
+        if not isinstance(cache, KVCache):
+            cache = {**cache} if cache is not None else {}
         hooks = []
 
-        def save_to_cache(module, _, output):
+        def save_to_cache(module, _, output, n_head=None):
+            if isinstance(cache, KVCache):
+                return cache.update(module, output, n_head)
             if module not in cache or output.shape[1] > self.dims.n_text_ctx:
                 # save as-is, for the first token or cross attention
                 cache[module] = output
@@ -303,7 +378,11 @@ class Whisper(nn.Module):
 
         def install_hooks(layer: nn.Module):
             if isinstance(layer, MultiHeadAttention):
-                hooks.append(layer.key.register_forward_hook(save_to_cache))
+                hooks.append(
+                    layer.key.register_forward_hook(
+                        partial(save_to_cache, n_head=layer.n_head)
+                    )
+                )
                 hooks.append(layer.value.register_forward_hook(save_to_cache))
 
         self.decoder.apply(install_hooks)
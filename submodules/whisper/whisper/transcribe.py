@@ -14,6 +14,7 @@ from .audio import (
     N_FRAMES,
     N_SAMPLES,
     SAMPLE_RATE,
+    LogMelSpectrogramStream,
     log_mel_spectrogram,
     pad_or_trim,
 )
@@ -51,6 +52,8 @@ def transcribe(
     append_punctuations: str = "\"'.。,，!！?？:：”)]}、",
     clip_timestamps: Union[str, List[float]] = "0",
     hallucination_silence_threshold: Optional[float] = None,
+    stream_audio: bool = True,
+    batch_size: int = 1,
     **decode_options,
 ):
     """
@@ -113,6 +116,19 @@ def transcribe(
         When word_timestamps is True, skip silent periods longer than this threshold (in seconds)
         when a possible hallucination is detected
 
+    stream_audio: bool
+        Decode the audio and compute the Mel spectrogram block by block, one 30-second window at a
+        time, so that memory use does not grow with the length of the audio. The audio is read
+        twice, since the spectrogram is normalized by its maximum over the whole audio.
+
+    batch_size: int
+        Number of 30-second windows to encode and decode together. Batching needs the windows to
+        be independent, so it only applies when `condition_on_previous_text` is False and
+        `hallucination_silence_threshold` is None; the windows are then cut at a fixed stride
+        instead of at the last timestamp of the previous window, and a segment still open at the
+        end of a window is closed there. Temperature fallback re-decodes only the windows of a
+        batch that fail the thresholds.
+
     Returns
     -------
     A dictionary containing the resulting text ("text") and segment-level details ("segments"), and
@@ -130,7 +146,10 @@ def transcribe(
         decode_options["fp16"] = False
 
     # Pad 30-seconds of silence to the input audio, for slicing
-    mel = log_mel_spectrogram(audio, model.dims.n_mels, padding=N_SAMPLES)
+    if stream_audio:
+        mel = LogMelSpectrogramStream(audio, model.dims.n_mels, padding=N_SAMPLES)
+    else:
+        mel = log_mel_spectrogram(audio, model.dims.n_mels, padding=N_SAMPLES)
     content_frames = mel.shape[-1] - N_FRAMES
     content_duration = float(content_frames * HOP_LENGTH / SAMPLE_RATE)
 
@@ -142,7 +161,8 @@ def transcribe(
                 print(
                     "Detecting language using up to the first 30 seconds. Use `--language` to specify the language"
                 )
-            mel_segment = pad_or_trim(mel, N_FRAMES).to(model.device).to(dtype)
+            mel_segment = mel[:, :N_FRAMES]
+            mel_segment = pad_or_trim(mel_segment, N_FRAMES).to(model.device).to(dtype)
             _, probs = model.detect_language(mel_segment)
             decode_options["language"] = max(probs, key=probs.get)
             if verbose is not None:
@@ -175,46 +195,91 @@ def transcribe(
     if word_timestamps and task == "translate":
         warnings.warn("Word-level timestamps on translations may not be reliable.")
 
-    def decode_with_fallback(segment: torch.Tensor) -> DecodingResult:
-        temperatures = (
-            [temperature] if isinstance(temperature, (int, float)) else temperature
+    batched = (
+        batch_size > 1
+        and not condition_on_previous_text
+        and hallucination_silence_threshold is None
+    )
+    if batch_size > 1 and not batched:
+        warnings.warn(
+            "batch_size requires condition_on_previous_text=False and no "
+            "hallucination_silence_threshold; decoding one window at a time"
         )
-        decode_result = None
 
-        for t in temperatures:
-            kwargs = {**decode_options}
-            if t > 0:
-                # disable beam_size and patience when t > 0
-                kwargs.pop("beam_size", None)
-                kwargs.pop("patience", None)
-            else:
-                # disable best_of when t == 0
-                kwargs.pop("best_of", None)
+    temperatures = (
+        [temperature] if isinstance(temperature, (int, float)) else temperature
+    )
 
-            options = DecodingOptions(**kwargs, temperature=t)
-            decode_result = model.decode(segment, options)
+    def decoding_options(t: float) -> DecodingOptions:
+        kwargs = {**decode_options}
+        if t > 0:
+            # disable beam_size and patience when t > 0
+            kwargs.pop("beam_size", None)
+            kwargs.pop("patience", None)
+        else:
+            # disable best_of when t == 0
+            kwargs.pop("best_of", None)
+        return DecodingOptions(**kwargs, temperature=t)
+
+    def needs_fallback(decode_result: DecodingResult) -> bool:
+        needs_fallback = False
+        if (
+            compression_ratio_threshold is not None
+            and decode_result.compression_ratio > compression_ratio_threshold
+        ):
+            needs_fallback = True  # too repetitive
+        if (
+            logprob_threshold is not None
+            and decode_result.avg_logprob < logprob_threshold
+        ):
+            needs_fallback = True  # average log probability is too low
+        if (
+            no_speech_threshold is not None
+            and decode_result.no_speech_prob > no_speech_threshold
+        ):
+            needs_fallback = False  # silence
+        return needs_fallback
 
-            needs_fallback = False
-            if (
-                compression_ratio_threshold is not None
-                and decode_result.compression_ratio > compression_ratio_threshold
-            ):
-                needs_fallback = True  # too repetitive
-            if (
-                logprob_threshold is not None
-                and decode_result.avg_logprob < logprob_threshold
-            ):
-                needs_fallback = True  # average log probability is too low
-            if (
-                no_speech_threshold is not None
-                and decode_result.no_speech_prob > no_speech_threshold
-            ):
-                needs_fallback = False  # silence
-            if not needs_fallback:
+    def decode_with_fallback(segment: torch.Tensor) -> DecodingResult:
+        decode_result = None
+
+        for t in temperatures:
+            decode_result = model.decode(segment, decoding_options(t))
+            if not needs_fallback(decode_result):
                 break
 
         return decode_result
 
+    def decode_batch_with_fallback(
+        audio_features: torch.Tensor,
+    ) -> List[DecodingResult]:
+        # each temperature only decodes the windows that failed at the previous one
+        decode_results: List[Optional[DecodingResult]] = [None] * len(audio_features)
+        pending = list(range(len(audio_features)))
+
+        for t in temperatures:
+            if not pending:
+                break
+            decoded = model.decode(audio_features[pending], decoding_options(t))
+            pending_next = []
+            for i, decode_result in zip(pending, decoded):
+                decode_results[i] = decode_result
+                if needs_fallback(decode_result):
+                    pending_next.append(i)
+            pending = pending_next
+
+        return decode_results
+
+    def is_silent(result: DecodingResult) -> bool:
+        if no_speech_threshold is None:
+            return False
+        # no voice activity check
+        should_skip = result.no_speech_prob > no_speech_threshold
+        if logprob_threshold is not None and result.avg_logprob > logprob_threshold:
+            # don't skip if the logprob is high enough, despite the no_speech_prob
+            should_skip = False
+        return should_skip
+
     clip_idx = 0
     seek = seek_clips[clip_idx][0]
     input_stride = exact_div(
@@ -250,16 +315,126 @@ def transcribe(
             "no_speech_prob": result.no_speech_prob,
         }
 
+    def add_segments(current_segments: List[dict]):
+        if verbose:
+            for segment in current_segments:
+                start, end, text = segment["start"], segment["end"], segment["text"]
+                line = f"[{format_timestamp(start)} --> {format_timestamp(end)}] {text}"
+                print(make_safe(line))
+
+        # if a segment is instantaneous or does not contain text, clear it
+        for i, segment in enumerate(current_segments):
+            if segment["start"] == segment["end"] or segment["text"].strip() == "":
+                segment["text"] = ""
+                segment["tokens"] = []
+                segment["words"] = []
+
+        all_segments.extend(
+            [
+                {"id": i, **segment}
+                for i, segment in enumerate(current_segments, start=len(all_segments))
+            ]
+        )
+        all_tokens.extend(
+            [token for segment in current_segments for token in segment["tokens"]]
+        )
+
     # show the progress bar when verbose is False (if True, transcribed text will be printed)
     with tqdm.tqdm(
         total=content_frames, unit="frames", disable=verbose is not False
     ) as pbar:
         last_speech_timestamp = 0.0
+        windows = []
+        if batched:
+            # fixed-stride windows, so that they can all be cut before any is decoded
+            windows = [
+                (start, min(start + N_FRAMES, seek_clip_end, content_frames))
+                for seek_clip_start, seek_clip_end in seek_clips
+                for start in range(
+                    seek_clip_start, min(seek_clip_end, content_frames), N_FRAMES
+                )
+            ]
+        for batch_start in range(0, len(windows), batch_size):
+            batch = windows[batch_start : batch_start + batch_size]
+            mel_segments = torch.stack(
+                [pad_or_trim(mel[:, start:end], N_FRAMES) for start, end in batch]
+            )
+            mel_segments = mel_segments.to(model.device).to(dtype)
+            with torch.no_grad():
+                # one encoder pass per batch, shared by every fallback temperature
+                audio_features = model.embed_audio(mel_segments)
+
+            decode_options["prompt"] = []
+            if batch_start == 0 and initial_prompt_tokens:
+                # as in the sequential loop, only the first window sees the initial prompt
+                decode_options["prompt"] = initial_prompt_tokens
+                results = decode_batch_with_fallback(audio_features[:1])
+                decode_options["prompt"] = []
+                results += decode_batch_with_fallback(audio_features[1:])
+            else:
+                results = decode_batch_with_fallback(audio_features)
+
+            for (seek, window_end), mel_segment, result in zip(
+                batch, mel_segments, results
+            ):
+                segment_size = window_end - seek
+                time_offset = float(seek * HOP_LENGTH / SAMPLE_RATE)
+                window_end_time = time_offset + segment_size * HOP_LENGTH / SAMPLE_RATE
+                pbar.update(segment_size)
+                if is_silent(result):
+                    continue
+
+                # the windows do not overlap, so the segment left open at the end of a
+                # window is kept and ends with it instead of being decoded again
+                tokens = torch.tensor(result.tokens)
+                timestamp_tokens: torch.Tensor = tokens.ge(tokenizer.timestamp_begin)
+                both = timestamp_tokens[:-1] & timestamp_tokens[1:]
+                consecutive = torch.where(both)[0]
+                slices = [0] + (consecutive + 1).tolist() + [len(tokens)]
+                current_segments = []
+                for last_slice, current_slice in zip(slices[:-1], slices[1:]):
+                    sliced_tokens = tokens[last_slice:current_slice]
+                    if len(sliced_tokens) == 0:
+                        continue
+                    start, end = time_offset, window_end_time
+                    if timestamp_tokens[last_slice]:
+                        start_timestamp_pos = (
+                            sliced_tokens[0].item() - tokenizer.timestamp_begin
+                        )
+                        start = time_offset + start_timestamp_pos * time_precision
+                    if len(sliced_tokens) > 1 and timestamp_tokens[current_slice - 1]:
+                        end_timestamp_pos = (
+                            sliced_tokens[-1].item() - tokenizer.timestamp_begin
+                        )
+                        end = time_offset + end_timestamp_pos * time_precision
+                    current_segments.append(
+                        new_segment(
+                            start=start, end=end, tokens=sliced_tokens, result=result
+                        )
+                    )
+
+                if word_timestamps:
+                    add_word_timestamps(
+                        segments=current_segments,
+                        model=model,
+                        tokenizer=tokenizer,
+                        mel=mel_segment,
+                        num_frames=segment_size,
+                        prepend_punctuations=prepend_punctuations,
+                        append_punctuations=append_punctuations,
+                        last_speech_timestamp=last_speech_timestamp,
+                    )
+                    last_word_end = get_end(current_segments)
+                    if last_word_end is not None:
+                        last_speech_timestamp = last_word_end
+
+                add_segments(current_segments)
+
         # NOTE: This loop is obscurely flattened to make the diff readable.
         # A later commit should turn this into a simpler nested loop.
         # for seek_clip_start, seek_clip_end in seek_clips:
         #     while seek < seek_clip_end
-        while clip_idx < len(seek_clips):
+        while not batched and clip_idx < len(seek_clips):
             seek_clip_start, seek_clip_end = seek_clips[clip_idx]
             if seek < seek_clip_start:
                 seek = seek_clip_start
@@ -279,19 +454,9 @@ def transcribe(
             result: DecodingResult = decode_with_fallback(mel_segment)
             tokens = torch.tensor(result.tokens)
 
-            if no_speech_threshold is not None:
-                # no voice activity check
-                should_skip = result.no_speech_prob > no_speech_threshold
-                if (
-                    logprob_threshold is not None
-                    and result.avg_logprob > logprob_threshold
-                ):
-                    # don't skip if the logprob is high enough, despite the no_speech_prob
-                    should_skip = False
-
-                if should_skip:
-                    seek += segment_size  # fast-forward to the next segment boundary
-                    continue
+            if is_silent(result):
+                seek += segment_size  # fast-forward to the next segment boundary
+                continue
 
             previous_seek = seek
             current_segments = []
@@ -459,30 +624,7 @@ def transcribe(
                 if last_word_end is not None:
                     last_speech_timestamp = last_word_end
 
-            if verbose:
-                for segment in current_segments:
-                    start, end, text = segment["start"], segment["end"], segment["text"]
-                    line = f"[{format_timestamp(start)} --> {format_timestamp(end)}] {text}"
-                    print(make_safe(line))
-
-            # if a segment is instantaneous or does not contain text, clear it
-            for i, segment in enumerate(current_segments):
-                if segment["start"] == segment["end"] or segment["text"].strip() == "":
-                    segment["text"] = ""
-                    segment["tokens"] = []
-                    segment["words"] = []
-
-            all_segments.extend(
-                [
-                    {"id": i, **segment}
-                    for i, segment in enumerate(
-                        current_segments, start=len(all_segments)
-                    )
-                ]
-            )
-            all_tokens.extend(
-                [token for segment in current_segments for token in segment["tokens"]]
-            )
+            add_segments(current_segments)
 
             if not condition_on_previous_text or result.temperature > 0.5:
                 # do not feed the prompt tokens if a high temperature was used
@@ -546,6 +688,8 @@ def cli():
     parser.add_argument("--threads", type=optional_int, default=0, help="number of threads used by torch for CPU inference; supercedes MKL_NUM_THREADS/OMP_NUM_THREADS")
     parser.add_argument("--clip_timestamps", type=str, default="0", help="comma-separated list start,end,start,end,... timestamps (in seconds) of clips to process, where the last end timestamp defaults to the end of the file")
     parser.add_argument("--hallucination_silence_threshold", type=optional_float, help="(requires --word_timestamps True) skip silent periods longer than this threshold (in seconds) when a possible hallucination is detected")
+    parser.add_argument("--batch_size", type=int, default=1, help="number of 30-second windows to decode together; requires --condition_on_previous_text False, and windows are then cut at a fixed stride")
+    parser.add_argument("--stream_audio", type=str2bool, default=True, help="whether to decode the audio and compute the Mel spectrogram one window at a time, keeping memory use independent of the audio length")
     # fmt: on
 
     args = parser.parse_args().__dict__
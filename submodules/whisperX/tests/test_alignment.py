@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+import torch
+
+from whisperx.alignment import Point, backtrack, forced_align, get_trellis, merge_repeats
+
+
+# The loop trellis and backtrack that alignment.py used before they were vectorized
+def reference_get_trellis(emission, tokens, blank_id=0):
+    num_frame = emission.size(0)
+    num_tokens = len(tokens)
+
+    trellis = torch.empty((num_frame + 1, num_tokens + 1))
+    trellis[0, 0] = 0
+    trellis[1:, 0] = torch.cumsum(emission[:, 0], 0)
+    trellis[0, -num_tokens:] = -float("inf")
+    trellis[-num_tokens:, 0] = float("inf")
+
+    for t in range(num_frame):
+        trellis[t + 1, 1:] = torch.maximum(
+            trellis[t, 1:] + emission[t, blank_id],
+            trellis[t, :-1] + emission[t, tokens],
+        )
+    return trellis
+
+
+def reference_backtrack(trellis, emission, tokens, blank_id=0):
+    j = trellis.size(1) - 1
+    t_start = torch.argmax(trellis[:, j]).item()
+
+    path = []
+    for t in range(t_start, 0, -1):
+        stayed = trellis[t - 1, j] + emission[t - 1, blank_id]
+        changed = trellis[t - 1, j - 1] + emission[t - 1, tokens[j - 1]]
+        prob = emission[t - 1, tokens[j - 1] if changed > stayed else 0].exp().item()
+        path.append((j - 1, t - 1, prob))
+        if changed > stayed:
+            j -= 1
+            if j == 0:
+                break
+    else:
+        return None
+    return path[::-1]
+
+
+def random_case(rng, num_frame, num_tokens, num_labels=32):
+    emission = torch.log_softmax(torch.from_numpy(rng.normal(0, 3, (num_frame, num_labels))).float(), dim=-1)
+    tokens = rng.integers(1, num_labels, num_tokens).tolist()
+    return emission, tokens
+
+
+def as_tuples(path):
+    return None if path is None else [(p.token_index, p.time_index, p.score) for p in path]
+
+
+def assert_same_path(actual, expected):
+    if expected is None:
+        assert actual is None
+        return
+    assert [p[:2] for p in actual] == [p[:2] for p in expected]
+    assert [p[2] for p in actual] == pytest.approx([p[2] for p in expected], abs=1e-6)
+
+
+@pytest.mark.parametrize("num_frame,num_tokens", [(1, 1), (5, 8), (20, 5), (80, 40), (150, 149), (200, 60)])
+def test_trellis_and_backtrack_match_reference(num_frame, num_tokens):
+    rng = np.random.default_rng(num_frame * 1000 + num_tokens)
+    for _ in range(5):
+        emission, tokens = random_case(rng, num_frame, num_tokens)
+        expected_trellis = reference_get_trellis(emission, tokens)
+        trellis = get_trellis(emission, tokens)
+        assert torch.allclose(trellis, expected_trellis, atol=1e-4)
+
+        expected = reference_backtrack(expected_trellis, emission, tokens)
+        assert_same_path(as_tuples(backtrack(trellis, emission, tokens)), expected)
+
+
+def test_forced_align_matches_reference():
+    rng = np.random.default_rng(0)
+    cases = [random_case(rng, int(rng.integers(10, 300)), int(rng.integers(1, 10))) for _ in range(30)]
+    # a small max_cells forces several groups of segments with padded trellises
+    paths = forced_align([e for e, _ in cases], [t for _, t in cases], max_cells=20000)
+
+    for (emission, tokens), path in zip(cases, paths):
+        expected = reference_backtrack(reference_get_trellis(emission, tokens), emission, tokens)
+        assert_same_path(as_tuples(path), expected)
+
+        transcript = "".join(chr(ord("a") + token % 26) for token in tokens)
+        expected_segments = merge_repeats([Point(*p) for p in expected], transcript)
+        segments = merge_repeats(path, transcript)
+        assert [(s.label, s.start, s.end) for s in segments] == [
+            (s.label, s.start, s.end) for s in expected_segments
+        ]
+        assert [s.score for s in segments] == pytest.approx([s.score for s in expected_segments], abs=1e-6)
@@ -0,0 +1,95 @@
+import copy
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from whisperx.diarize import assign_word_speakers
+
+
+# The assign_word_speakers that diarize.py used before SpeakerIndex
+def reference_assign_word_speakers(diarize_df, transcript_result, fill_nearest=False):
+    def best_speaker(start, end):
+        intersection = np.minimum(diarize_df["end"], end) - np.maximum(diarize_df["start"], start)
+        hits = diarize_df.assign(intersection=intersection)
+        if not fill_nearest:
+            hits = hits[hits["intersection"] > 0]
+        if len(hits) == 0:
+            return None
+        return hits.groupby("speaker")["intersection"].sum().sort_values(ascending=False).index[0]
+
+    for seg in transcript_result["segments"]:
+        speaker = best_speaker(seg["start"], seg["end"])
+        if speaker is not None:
+            seg["speaker"] = speaker
+        for word in seg.get("words", []):
+            if "start" in word:
+                speaker = best_speaker(word["start"], word["end"])
+                if speaker is not None:
+                    word["speaker"] = speaker
+    return transcript_result
+
+
+def grid_case(seed, step, num_turns=60, num_segments=40, num_speakers=4):
+    """Turns and words on a grid of step seconds, so many speakers overlap an interval equally."""
+    rng = np.random.default_rng(seed)
+    starts = rng.integers(0, 400, num_turns) * step
+    diarize_df = pd.DataFrame({
+        "start": starts,
+        "end": starts + rng.integers(1, 40, num_turns) * step,
+        "speaker": [f"SPEAKER_{i:02d}" for i in rng.integers(num_speakers, size=num_turns)],
+    })
+    segments = []
+    for _ in range(num_segments):
+        start = int(rng.integers(0, 420)) * step
+        end = start + int(rng.integers(1, 60)) * step
+        words = []
+        for _ in range(5):
+            word_start = int(rng.integers(0, 420)) * step
+            words.append({"word": "w", "start": word_start, "end": word_start + int(rng.integers(1, 10)) * step})
+        segments.append({"start": start, "end": end, "words": words})
+    return diarize_df, {"segments": segments}
+
+
+def assert_same_speakers(diarize_df, transcript, fill_nearest):
+    expected = reference_assign_word_speakers(diarize_df, copy.deepcopy(transcript), fill_nearest)
+    result = assign_word_speakers(diarize_df, copy.deepcopy(transcript), fill_nearest)
+    assert result["segments"] == expected["segments"]
+
+
+@pytest.mark.parametrize("fill_nearest", [False, True])
+def test_tied_overlaps(fill_nearest):
+    # SPEAKER_02 and SPEAKER_03 both overlap the segment by 4.30s
+    diarize_df = pd.DataFrame({
+        "start": [0.0, 1.0, 2.0, 3.3],
+        "end": [0.5, 1.5, 6.3, 7.6],
+        "speaker": ["SPEAKER_00", "SPEAKER_01", "SPEAKER_02", "SPEAKER_03"],
+    })
+    transcript = {"segments": [{"start": 2.0, "end": 7.6}, {"start": 0.0, "end": 0.5}, {"start": 8.0, "end": 9.0}]}
+    assert_same_speakers(diarize_df, transcript, fill_nearest)
+
+
+@pytest.mark.parametrize("step", [0.25, 0.1, 0.01])
+@pytest.mark.parametrize("fill_nearest", [False, True])
+def test_grid_aligned_matches_reference(step, fill_nearest):
+    for seed in range(20):
+        diarize_df, transcript = grid_case(seed, step)
+        assert_same_speakers(diarize_df, transcript, fill_nearest)
+
+
+@pytest.mark.parametrize("fill_nearest", [False, True])
+def test_random_matches_reference(fill_nearest):
+    rng = np.random.default_rng(0)
+    durations = rng.uniform(0.5, 10, 300)
+    starts = np.cumsum(durations + rng.uniform(-0.5, 1.5, 300)) - durations
+    diarize_df = pd.DataFrame({
+        "start": starts,
+        "end": starts + durations,
+        "speaker": [f"SPEAKER_{i:02d}" for i in rng.integers(6, size=300)],
+    })
+    segments = []
+    for start in np.sort(rng.uniform(0, diarize_df["end"].max(), 100)):
+        end = start + rng.uniform(1, 15)
+        words = [{"word": "w", "start": s, "end": min(s + 0.4, end)} for s in np.sort(rng.uniform(start, end, 5))]
+        segments.append({"start": start, "end": end, "words": words})
+    assert_same_speakers(diarize_df, {"segments": segments}, fill_nearest)
@@ -94,6 +94,70 @@ def load_align_model(language_code, device, model_name=None, model_dir=None):
     return align_model, align_metadata
 
 
+def padding_is_masked(model, model_type):
+    """
+    Whether zero padding leaves the emissions of the shorter waveforms in a batch unchanged.
+    Feature encoders with group norm (WAV2VEC2_ASR_BASE_960H, the VoxPopuli bases and Hugging Face
+    models with feat_extract_norm="group") normalize every channel over the whole padded length,
+    which lengths or an attention mask do not undo.
+    """
+    if model_type == "torchaudio":
+        return not any(isinstance(m, torch.nn.GroupNorm) for m in model.feature_extractor.modules())
+    if model_type == "huggingface":
+        return model.config.feat_extract_norm == "layer"
+    return False
+
+
+def get_emissions(model, model_type, waveforms, device, batch_size=1):
+    """
+    Yield (index, emission) for a list of [channel, samples] waveforms, where emission holds the
+    [frame, label] log-probabilities of the first channel. With batch_size > 1 waveforms of similar
+    length are zero padded into one batch and the model is given their true lengths. Models whose
+    feature encoder cannot mask the padding (see padding_is_masked) only batch waveforms of the
+    same length, so the emissions always match the ones computed one waveform at a time.
+    """
+    batch_size = max(1, batch_size)
+    size = lambda i: waveforms[i].shape[-1]
+    order = sorted(range(len(waveforms)), key=size, reverse=True)
+    masked = padding_is_masked(model, model_type)
+    batches = []
+    for i in order:
+        # waveforms under the 400 sample minimum are padded to it with their true length, as alone
+        same_size_only = not masked or size(i) < 400
+        if (batches and len(batches[-1]) < batch_size
+                and not (same_size_only and size(batches[-1][0]) != size(i))):
+            batches[-1].append(i)
+        else:
+            batches.append([i])
+
+    for batch in batches:
+        sizes = [size(i) for i in batch]
+        # Handle the minimum input length for wav2vec2 models
+        waveform_segment = torch.zeros(len(batch), max(sizes[0], 400))
+        for b, i in enumerate(batch):
+            waveform_segment[b, :sizes[b]] = waveforms[i][0]
+        padded = sizes[-1] != sizes[0]
+        lengths = torch.as_tensor(sizes).to(device) if padded or sizes[0] < 400 else None
+
+        with torch.inference_mode():
+            if model_type == "torchaudio":
+                emissions, num_frames = model(waveform_segment.to(device), lengths=lengths)
+            elif model_type == "huggingface":
+                attention_mask, num_frames = None, None
+                if padded:
+                    num_frames = model._get_feat_extract_output_lengths(lengths)
+                    attention_mask = (torch.arange(waveform_segment.shape[-1], device=device)[None]
+                                      < lengths[:, None]).long()
+                emissions = model(waveform_segment.to(device), attention_mask=attention_mask).logits
+            else:
+                raise NotImplementedError(f"Align model of type {model_type} not supported.")
+            emissions = torch.log_softmax(emissions, dim=-1)
+
+        emissions = emissions.cpu().detach()
+        for b, i in enumerate(batch):
+            yield i, emissions[b, :int(num_frames[b])] if padded else emissions[b]
+
+
 def align(
     transcript: Iterable[SingleSegment],
     model: torch.nn.Module,
@@ -104,9 +168,14 @@ def align(
     return_char_alignments: bool = False,
     print_progress: bool = False,
     combined_progress: bool = False,
+    batch_alignment: bool = False,
+    batch_size: int = 1,
 ) -> AlignedTranscriptionResult:
     """
     Align phoneme recognition predictions to known transcription.
+    batch_size segments are passed through the alignment model at once, see get_emissions.
+    With batch_alignment, the emissions of every segment are collected first and the forced
+    alignment of the whole file runs in batches of segments instead of one segment at a time.
     """
     
     if not torch.is_tensor(audio):
@@ -123,6 +192,12 @@ def align(
     model_type = align_model_metadata["type"]
 
     # 1. Preprocess to keep only characters in dictionary
+    punkt_param = PunktParameters()
+    punkt_param.abbrev_types = set(PUNKT_ABBREVIATIONS)
+    sentence_splitter = PunktSentenceTokenizer(punkt_param)
+    # dictionary spelling of every character seen so far, None when the model does not know it
+    char_lookup = {}
+
     total_segments = len(transcript)
     for sdx, segment in enumerate(transcript):
         # strip spaces at beginning / end, but keep track of the amount.
@@ -142,30 +217,24 @@ def align(
             per_word = text
 
         clean_char, clean_cdx = [], []
-        for cdx, char in enumerate(text):
-            char_ = char.lower()
-            # wav2vec2 models use "|" character to represent spaces
-            if model_lang not in LANGUAGES_WITHOUT_SPACES:
-                char_ = char_.replace(" ", "|")
-            
-            # ignore whitespace at beginning and end of transcript
-            if cdx < num_leading:
-                pass
-            elif cdx > len(text) - num_trailing - 1:
-                pass
-            elif char_ in model_dictionary.keys():
-                clean_char.append(char_)
+        # ignore whitespace at beginning and end of transcript
+        for cdx in range(num_leading, len(text) - num_trailing):
+            char = text[cdx]
+            if char not in char_lookup:
+                char_ = char.lower()
+                # wav2vec2 models use "|" character to represent spaces
+                if model_lang not in LANGUAGES_WITHOUT_SPACES:
+                    char_ = char_.replace(" ", "|")
+                char_lookup[char] = char_ if char_ in model_dictionary else None
+            if char_lookup[char] is not None:
+                clean_char.append(char_lookup[char])
                 clean_cdx.append(cdx)
 
         clean_wdx = []
         for wdx, wrd in enumerate(per_word):
-            if any([c in model_dictionary.keys() for c in wrd]):
+            if any(c in model_dictionary for c in wrd):
                 clean_wdx.append(wdx)
 
-                
-        punkt_param = PunktParameters()
-        punkt_param.abbrev_types = set(PUNKT_ABBREVIATIONS)
-        sentence_splitter = PunktSentenceTokenizer(punkt_param)
         sentence_spans = list(sentence_splitter.span_tokenize(text))
 
         segment["clean_char"] = clean_char
@@ -174,10 +243,46 @@ def align(
         segment["sentence_spans"] = sentence_spans
     
     aligned_segments: List[SingleAlignedSegment] = []
-    
+
+    blank_id = 0
+    for char, code in model_dictionary.items():
+        if char == '[pad]' or char == '<pad>':
+            blank_id = code
+
     # 2. Get prediction matrix from alignment model & align
+    alignable = []
     for sdx, segment in enumerate(transcript):
-        
+        # check we can align
+        if len(segment["clean_char"]) == 0:
+            print(f'Failed to align segment ("{segment["text"]}"): no characters in this segment found in model dictionary, resorting to original...')
+        elif segment["start"] >= MAX_DURATION:
+            print(f'Failed to align segment ("{segment["text"]}"): original start time longer than audio duration, skipping...')
+        else:
+            alignable.append(sdx)
+
+    waveforms = [audio[:, int(transcript[sdx]["start"] * SAMPLE_RATE):int(transcript[sdx]["end"] * SAMPLE_RATE)]
+                 for sdx in alignable]
+    pending, paths, ratios = {}, {}, {}
+    for i, emission in get_emissions(model, model_type, waveforms, device, batch_size):
+        sdx = alignable[i]
+        segment = transcript[sdx]
+        tokens = [model_dictionary[c] for c in segment["clean_char"]]
+
+        duration = segment["end"] - segment["start"]
+        ratios[sdx] = duration * audio.size(0) / emission.size(0)
+
+        if batch_alignment:
+            # only keep the labels the alignment reads so a whole file of emissions fits in memory
+            pending[sdx] = _compact_emission(emission.numpy(), tokens, blank_id)
+        else:
+            paths[sdx] = forced_align([emission], [tokens], blank_id)[0]
+
+    if pending:
+        compact_emissions, compact_tokens = zip(*pending.values())
+        paths.update(zip(pending, forced_align(compact_emissions, compact_tokens, min(blank_id, 1))))
+
+    for sdx, segment in enumerate(transcript):
+
         t1 = segment["start"]
         t2 = segment["end"]
         text = segment["text"]
@@ -192,70 +297,27 @@ def align(
         if return_char_alignments:
             aligned_seg["chars"] = []
 
-        # check we can align
-        if len(segment["clean_char"]) == 0:
-            print(f'Failed to align segment ("{segment["text"]}"): no characters in this segment found in model dictionary, resorting to original...')
-            aligned_segments.append(aligned_seg)
-            continue
-
-        if t1 >= MAX_DURATION:
-            print(f'Failed to align segment ("{segment["text"]}"): original start time longer than audio duration, skipping...')
+        if sdx not in paths:
             aligned_segments.append(aligned_seg)
             continue
 
-        text_clean = "".join(segment["clean_char"])
-        tokens = [model_dictionary[c] for c in text_clean]
-
-        f1 = int(t1 * SAMPLE_RATE)
-        f2 = int(t2 * SAMPLE_RATE)
-
-        # TODO: Probably can get some speedup gain with batched inference here
-        waveform_segment = audio[:, f1:f2]
-        # Handle the minimum input length for wav2vec2 models
-        if waveform_segment.shape[-1] < 400:
-            lengths = torch.as_tensor([waveform_segment.shape[-1]]).to(device)
-            waveform_segment = torch.nn.functional.pad(
-                waveform_segment, (0, 400 - waveform_segment.shape[-1])
-            )
-        else:
-            lengths = None
-            
-        with torch.inference_mode():
-            if model_type == "torchaudio":
-                emissions, _ = model(waveform_segment.to(device), lengths=lengths)
-            elif model_type == "huggingface":
-                emissions = model(waveform_segment.to(device)).logits
-            else:
-                raise NotImplementedError(f"Align model of type {model_type} not supported.")
-            emissions = torch.log_softmax(emissions, dim=-1)
-
-        emission = emissions[0].cpu().detach()
-
-        blank_id = 0
-        for char, code in model_dictionary.items():
-            if char == '[pad]' or char == '<pad>':
-                blank_id = code
-
-        trellis = get_trellis(emission, tokens, blank_id)
-        path = backtrack(trellis, emission, tokens, blank_id)
-
+        path = paths[sdx]
         if path is None:
             print(f'Failed to align segment ("{segment["text"]}"): backtrack failed, resorting to original...')
             aligned_segments.append(aligned_seg)
             continue
 
-        char_segments = merge_repeats(path, text_clean)
-
-        duration = t2 -t1
-        ratio = duration * waveform_segment.size(0) / (trellis.size(0) - 1)
+        ratio = ratios[sdx]
+        clean_index = {cdx: i for i, cdx in enumerate(segment["clean_cdx"])}
+        char_segments = merge_repeats(path, "".join(segment["clean_char"]))
 
         # assign timestamps to aligned characters
         char_segments_arr = []
         word_idx = 0
         for cdx, char in enumerate(text):
             start, end, score = None, None, None
-            if cdx in segment["clean_cdx"]:
-                char_seg = char_segments[segment["clean_cdx"].index(cdx)]
+            if cdx in clean_index:
+                char_seg = char_segments[clean_index[cdx]]
                 start = round(char_seg.start * ratio + t1, 3)
                 end = round(char_seg.end * ratio + t1, 3)
                 score = round(char_seg.score, 3)
@@ -352,28 +414,67 @@ def align(
 
 """
 source: https://pytorch.org/tutorials/intermediate/forced_alignment_with_torchaudio_tutorial.html
+
+The trellis is filled with NumPy one frame at a time for a whole batch of segments, recording for
+every cell whether the best path got there by changing token. Backtracking then only follows those
+integer backpointers, so the results match the tutorial's implementation exactly.
 """
+def _fill_trellis(emissions, tokens, blank_id=0):
+    """
+    Fill the trellises of a batch of segments in one pass over frames.
+    emissions: list of float32 [num_frame, num_label] log-probabilities, tokens: list of token ids.
+    Returns the trellis [max_frame + 1, batch, max_tokens + 1] and the backpointers
+    [max_frame, batch, max_tokens] where moves[t, b, j - 1] tells if trellis cell (t + 1, j) was
+    reached by changing from token j - 1.
+    """
+    batch = len(emissions)
+    max_frame = max(len(emission) for emission in emissions)
+    max_tokens = max(len(token) for token in tokens)
+    stay = np.zeros((max_frame, batch, 1), dtype=np.float32)
+    change = np.zeros((max_frame, batch, max_tokens), dtype=np.float32)
+    trellis = np.zeros((max_frame + 1, batch, max_tokens + 1), dtype=np.float32)
+    for b, (emission, token) in enumerate(zip(emissions, tokens)):
+        num_frame, num_tokens = len(emission), len(token)
+        stay[:num_frame, b, 0] = emission[:, blank_id]
+        change[:num_frame, b, :num_tokens] = emission[:, token]
+        # Trellis has extra diemsions for both time axis and tokens.
+        # The extra dim for tokens represents <SoS> (start-of-sentence)
+        # The extra dim for time axis is for simplification of the code.
+        first = trellis[:num_frame + 1, b, 0]
+        first[0] = 0
+        # accumulate in double like torch.cumsum does on CPU
+        first[1:] = np.cumsum(emission[:, 0], dtype=np.float64)
+        first[-num_tokens:] = np.inf
+        trellis[0, b, 1:] = -np.inf
+
+    moves = np.empty((max_frame, batch, max_tokens), dtype=bool)
+    stayed = np.empty((batch, max_tokens), dtype=np.float32)
+    changed = np.empty((batch, max_tokens), dtype=np.float32)
+    for t in range(max_frame):
+        # Score for staying at the same token
+        np.add(trellis[t, :, 1:], stay[t], out=stayed)
+        # Score for changing to the next token
+        np.add(trellis[t, :, :-1], change[t], out=changed)
+        np.greater(changed, stayed, out=moves[t])
+        np.maximum(stayed, changed, out=trellis[t + 1, :, 1:])
+    return trellis, moves
+
+
+def _compact_emission(emission, tokens, blank_id):
+    """
+    Keep only label 0, the blank and the transcript tokens of an emission, in that order, so the
+    blank ends up at min(blank_id, 1). Returns the reduced emission and the remapped tokens.
+    """
+    labels = [0] + ([blank_id] if blank_id else [])
+    labels += sorted(set(tokens) - set(labels))
+    index = {label: i for i, label in enumerate(labels)}
+    return emission[:, labels], [index[token] for token in tokens]
+
+
 def get_trellis(emission, tokens, blank_id=0):
-    num_frame = emission.size(0)
-    num_tokens = len(tokens)
-
-    # Trellis has extra diemsions for both time axis and tokens.
-    # The extra dim for tokens represents <SoS> (start-of-sentence)
-    # The extra dim for time axis is for simplification of the code.
-    trellis = torch.empty((num_frame + 1, num_tokens + 1))
-    trellis[0, 0] = 0
-    trellis[1:, 0] = torch.cumsum(emission[:, 0], 0)
-    trellis[0, -num_tokens:] = -float("inf")
-    trellis[-num_tokens:, 0] = float("inf")
-
-    for t in range(num_frame):
-        trellis[t + 1, 1:] = torch.maximum(
-            # Score for staying at the same token
-            trellis[t, 1:] + emission[t, blank_id],
-            # Score for changing to the next token
-            trellis[t, :-1] + emission[t, tokens],
-        )
-    return trellis
+    emission = np.asarray(emission, dtype=np.float32)
+    trellis, _ = _fill_trellis([emission], [np.asarray(tokens, dtype=np.int64)], blank_id)
+    return torch.from_numpy(trellis[:, 0])
 
 @dataclass
 class Point:
@@ -381,7 +482,7 @@ class Point:
     time_index: int
     score: float
 
-def backtrack(trellis, emission, tokens, blank_id=0):
+def _follow(moves, last_column, emission, tokens):
     # Note:
     # j and t are indices for trellis, which has extra dimensions
     # for time and tokens at the beginning.
@@ -389,33 +490,62 @@ def backtrack(trellis, emission, tokens, blank_id=0):
     # the corresponding index in emission is `T-1`.
     # Similarly, when referring to token index `J` in trellis,
     # the corresponding index in transcript is `J-1`.
-    j = trellis.size(1) - 1
-    t_start = torch.argmax(trellis[:, j]).item()
+    j = len(tokens)
+    t_start = int(np.argmax(last_column))
 
-    path = []
+    time_index, token_index = [], []
     for t in range(t_start, 0, -1):
-        # 1. Figure out if the current position was stay or change
-        # Note (again):
-        # `emission[J-1]` is the emission at time frame `J` of trellis dimension.
-        # Score for token staying the same from time frame J-1 to T.
-        stayed = trellis[t - 1, j] + emission[t - 1, blank_id]
-        # Score for token changing from C-1 at T-1 to J at T.
-        changed = trellis[t - 1, j - 1] + emission[t - 1, tokens[j - 1]]
-
-        # 2. Store the path with frame-wise probability.
-        prob = emission[t - 1, tokens[j - 1] if changed > stayed else 0].exp().item()
-        # Return token index and time index in non-trellis coordinate.
-        path.append(Point(j - 1, t - 1, prob))
-
-        # 3. Update the token
-        if changed > stayed:
+        time_index.append(t - 1)
+        token_index.append(j - 1)
+        if moves[t - 1, j - 1]:
             j -= 1
             if j == 0:
                 break
     else:
         # failed
         return None
-    return path[::-1]
+
+    time_index, token_index = np.array(time_index[::-1]), np.array(token_index[::-1])
+    # Frame-wise probability of the token changed to, or of label 0 when staying
+    label = np.where(moves[time_index, token_index], tokens[token_index], 0)
+    score = torch.from_numpy(emission[time_index, label]).exp().tolist()
+    return [Point(j, t, s) for j, t, s in zip(token_index.tolist(), time_index.tolist(), score)]
+
+def backtrack(trellis, emission, tokens, blank_id=0):
+    trellis = np.asarray(trellis, dtype=np.float32)
+    emission = np.asarray(emission, dtype=np.float32)
+    tokens = np.asarray(tokens, dtype=np.int64)
+    # Score for token changing from C-1 at T-1 to J at T, against staying the same.
+    moves = trellis[:-1, :-1] + emission[:, tokens] > trellis[:-1, 1:] + emission[:, blank_id, None]
+    return _follow(moves, trellis[:, -1], emission, tokens)
+
+def forced_align(emissions, tokens, blank_id=0, max_cells=2 ** 24):
+    """
+    Align several segments at once: segments of similar length are grouped and their trellises
+    filled together, keeping each group under `max_cells` trellis cells.
+    emissions: list of [num_frame, num_label] log-probabilities, tokens: list of token id lists.
+    Returns one path per segment, None where the backtrack failed.
+    """
+    emissions = [np.asarray(emission, dtype=np.float32) for emission in emissions]
+    tokens = [np.asarray(token, dtype=np.int64) for token in tokens]
+    order = sorted(range(len(emissions)), key=lambda i: (len(emissions[i]), len(tokens[i])))
+    paths = [None] * len(emissions)
+    while order:
+        group = [order.pop(0)]
+        max_tokens = len(tokens[group[0]])
+        while order:
+            num_frame = len(emissions[order[0]])
+            num_tokens = max(max_tokens, len(tokens[order[0]]))
+            if (num_frame + 1) * (len(group) + 1) * (num_tokens + 1) > max_cells:
+                break
+            group.append(order.pop(0))
+            max_tokens = num_tokens
+        trellis, moves = _fill_trellis([emissions[i] for i in group], [tokens[i] for i in group], blank_id)
+        for b, i in enumerate(group):
+            num_frame, num_tokens = len(emissions[i]), len(tokens[i])
+            paths[i] = _follow(moves[:num_frame, b, :num_tokens], trellis[:num_frame + 1, b, num_tokens],
+                               emissions[i], tokens[i])
+    return paths
 
 # Merge the labels
 @dataclass
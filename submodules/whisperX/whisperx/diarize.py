@@ -32,36 +32,117 @@ class DiarizationPipeline:
         return diarize_df
 
 
+class SpeakerIndex:
+    """
+    Diarization turns sorted by start, for finding the speaker that overlaps an interval the most
+    without scanning every turn. A running maximum of the turn ends bounds the turns that can still
+    overlap, and per-speaker prefix sums give the total (possibly negative) overlap used by
+    fill_nearest. The speaker is the one the previous pandas groupby picked: totals closer than
+    tie_tolerance are summed again the way pandas summed them, and ties are broken by the same
+    descending sort, see best_speaker.
+    """
+    tie_tolerance = 1e-6
+
+    def __init__(self, diarize_df):
+        codes, self.speakers = pd.factorize(diarize_df['speaker'], sort=True)
+        starts = diarize_df['start'].to_numpy(dtype=np.float64)
+        ends = diarize_df['end'].to_numpy(dtype=np.float64)
+        keep = codes >= 0
+        codes, starts, ends = codes[keep], starts[keep], ends[keep]
+        # turns in the order of diarize_df, to sum near ties like pandas did
+        self.row_codes, self.row_starts, self.row_ends = codes, starts, ends
+        order = np.argsort(starts, kind='stable')
+        self.order = order
+        self.codes, self.starts, self.ends = codes[order], starts[order], ends[order]
+        self.max_ends = np.maximum.accumulate(self.ends)
+
+        self.sorted_starts, self.cum_starts, self.sorted_ends, self.cum_ends = [], [], [], []
+        for code in range(len(self.speakers)):
+            speaker_starts = np.sort(self.starts[self.codes == code])
+            speaker_ends = np.sort(self.ends[self.codes == code])
+            self.sorted_starts.append(speaker_starts)
+            self.cum_starts.append(np.concatenate([[0.], np.cumsum(speaker_starts)]))
+            self.sorted_ends.append(speaker_ends)
+            self.cum_ends.append(np.concatenate([[0.], np.cumsum(speaker_ends)]))
+
+    def overlap(self, start, end):
+        """Total overlap of [start, end] with every speaker's turns, counting only positive overlaps."""
+        # turns before lo end before start, turns from hi on start after end
+        lo = np.searchsorted(self.max_ends, start, side='right')
+        hi = np.searchsorted(self.starts, end, side='left')
+        intersection = np.minimum(self.ends[lo:hi], end) - np.maximum(self.starts[lo:hi], start)
+        hit = intersection > 0
+        totals = np.bincount(self.codes[lo:hi][hit], weights=intersection[hit], minlength=len(self.speakers))
+        return totals, self.order[lo:hi][hit]
+
+    def nearest_overlap(self, start, end):
+        """Total overlap of [start, end] with every speaker's turns, negative ones included."""
+        totals = np.empty(len(self.speakers))
+        for code in range(len(self.speakers)):
+            ends, starts = self.sorted_ends[code], self.sorted_starts[code]
+            # sum of min(turn end, end) and of max(turn start, start) over the speaker's turns
+            j = np.searchsorted(ends, end, side='left')
+            i = np.searchsorted(starts, start, side='right')
+            sum_min = self.cum_ends[code][j] + end * (len(ends) - j)
+            sum_max = start * i + self.cum_starts[code][-1] - self.cum_starts[code][i]
+            totals[code] = sum_min - sum_max
+        return totals
+
+    def pandas_totals(self, start, end, rows):
+        """Totals of the turns rows summed per speaker exactly as the pandas version summed them."""
+        rows = np.sort(rows)
+        intersection = np.minimum(self.row_ends[rows], end) - np.maximum(self.row_starts[rows], start)
+        totals = np.zeros(len(self.speakers))
+        sums = pd.Series(intersection).groupby(self.row_codes[rows]).sum()
+        totals[sums.index.to_numpy()] = sums.to_numpy()
+        return totals
+
+    @staticmethod
+    def best_speaker(totals, candidates):
+        """
+        Code of the speaker with the largest total among candidates, which are in sorted order.
+        pandas sorts descending by running numpy's unstable quicksort on the reversed values and
+        reading the result backwards, which orders ties neither first nor last consistently, so
+        the same steps are repeated here to pick the speaker the pandas version picked.
+        """
+        reversed_candidates = candidates[::-1]
+        return reversed_candidates[np.argsort(totals[reversed_candidates], kind='quicksort')[-1]]
+
+    def speaker(self, start, end, fill_nearest=False):
+        if len(self.speakers) == 0:
+            return None
+        if fill_nearest:
+            totals = self.nearest_overlap(start, end)
+            candidates = np.arange(len(self.speakers))
+            rows = np.arange(len(self.row_codes))
+        else:
+            totals, rows = self.overlap(start, end)
+            # remove no hit, otherwise we look for closest (even negative intersection...)
+            if len(rows) == 0:
+                return None
+            # only the speakers with a positive overlap took part in the groupby
+            candidates = np.flatnonzero(totals > 0)
+        if len(candidates) > 1 and np.diff(np.sort(totals[candidates])).min() < self.tie_tolerance:
+            # rounding differs from the pandas sums, which decide between nearly equal totals
+            totals = self.pandas_totals(start, end, rows)
+        return self.speakers[int(self.best_speaker(totals, candidates))]
+
+
 def assign_word_speakers(diarize_df, transcript_result, fill_nearest=False):
+    speaker_index = SpeakerIndex(diarize_df)
     transcript_segments = transcript_result["segments"]
     for seg in transcript_segments:
         # assign speaker to segment (if any)
-        diarize_df['intersection'] = np.minimum(diarize_df['end'], seg['end']) - np.maximum(diarize_df['start'], seg['start'])
-        diarize_df['union'] = np.maximum(diarize_df['end'], seg['end']) - np.minimum(diarize_df['start'], seg['start'])
-        # remove no hit, otherwise we look for closest (even negative intersection...)
-        if not fill_nearest:
-            dia_tmp = diarize_df[diarize_df['intersection'] > 0]
-        else:
-            dia_tmp = diarize_df
-        if len(dia_tmp) > 0:
-            # sum over speakers
-            speaker = dia_tmp.groupby("speaker")["intersection"].sum().sort_values(ascending=False).index[0]
+        speaker = speaker_index.speaker(seg['start'], seg['end'], fill_nearest)
+        if speaker is not None:
             seg["speaker"] = speaker
         
         # assign speaker to words
         if 'words' in seg:
             for word in seg['words']:
                 if 'start' in word:
-                    diarize_df['intersection'] = np.minimum(diarize_df['end'], word['end']) - np.maximum(diarize_df['start'], word['start'])
-                    diarize_df['union'] = np.maximum(diarize_df['end'], word['end']) - np.minimum(diarize_df['start'], word['start'])
-                    # remove no hit
-                    if not fill_nearest:
-                        dia_tmp = diarize_df[diarize_df['intersection'] > 0]
-                    else:
-                        dia_tmp = diarize_df
-                    if len(dia_tmp) > 0:
-                        # sum over speakers
-                        speaker = dia_tmp.groupby("speaker")["intersection"].sum().sort_values(ascending=False).index[0]
+                    speaker = speaker_index.speaker(word['start'], word['end'], fill_nearest)
+                    if speaker is not None:
                         word["speaker"] = speaker
         
     return transcript_result            
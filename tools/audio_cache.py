@@ -0,0 +1,139 @@
+import os
+import shutil
+import threading
+import librosa
+import numpy as np
+import soundfile as sf
+import soxr
+from loguru import logger
+
+CACHE_DIR = '.audio_cache'
+_lock = threading.Lock()
+_buffer_locks = {}
+
+
+def _buffer_lock(path):
+    with _lock:
+        return _buffer_locks.setdefault(path, threading.Lock())
+
+
+def _open(path):
+    # Copy-on-write so callers like torch.from_numpy get a writable array without touching the file
+    return np.load(path, mmap_mode='c')
+
+
+def _derive(native, native_sr, sr, mono, buffer_path, block_frames=1 << 20):
+    """
+    Write native, downmixed when mono and resampled to sr, into a float32 .npy block by block. The
+    streaming soxr resampler is the one librosa.resample uses by default and gives the same samples.
+    """
+    channels = 1 if mono else len(native)
+    length = int(np.ceil(native.shape[-1] * sr / native_sr))
+    tmp_path = f'{buffer_path}.tmp.npy'
+    buffer = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                       shape=(length,) if mono else (channels, length))
+    stream = soxr.ResampleStream(native_sr, sr, channels, dtype='float32', quality='HQ') if sr != native_sr else None
+    position = 0
+    for start in range(0, native.shape[-1], block_frames):
+        block = np.asarray(native[:, start:start + block_frames], dtype=np.float32)
+        if mono:
+            block = librosa.to_mono(block)[None]
+        if stream is not None:
+            last = start + block_frames >= native.shape[-1]
+            block = stream.resample_chunk(block.T, last=last).T
+        block = block[:, :length - position]
+        if mono:
+            buffer[position:position + block.shape[-1]] = block[0]
+        else:
+            buffer[:, position:position + block.shape[-1]] = block
+        position += block.shape[-1]
+    # The file starts out zeroed, which pads the samples the resampler may fall short of like librosa
+    buffer.flush()
+    del buffer
+    os.replace(tmp_path, buffer_path)
+
+
+def _decode(audio_path, buffer_path, block_frames=1 << 20):
+    """Decode audio_path once into a (channels, samples) float32 .npy without holding it in memory."""
+    tmp_path = f'{buffer_path}.tmp.npy'
+    try:
+        with sf.SoundFile(audio_path) as f:
+            sample_rate = f.samplerate
+            buffer = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(f.channels, f.frames))
+            position = 0
+            for block in f.blocks(block_frames, dtype='float32', always_2d=True):
+                buffer[:, position:position + len(block)] = block.T
+                position += len(block)
+            buffer.flush()
+            del buffer
+    except RuntimeError:
+        # Formats libsndfile cannot read, such as some mp3 files, go through librosa's audioread fallback
+        wav, sample_rate = librosa.load(audio_path, sr=None, mono=False)
+        np.save(tmp_path, np.atleast_2d(wav))
+    return sample_rate, tmp_path
+
+
+def _native(audio_path, cache_folder, prefix):
+    """Return the (channels, samples) decode of audio_path at its own sample rate and that rate."""
+    native_prefix = f'{prefix}.native'
+    with _buffer_lock(os.path.join(cache_folder, native_prefix)):
+        for name in os.listdir(cache_folder):
+            if name.startswith(native_prefix) and name.endswith('.npy') and '.tmp' not in name:
+                return _open(os.path.join(cache_folder, name)), int(name[len(native_prefix):-len('.npy')])
+        logger.info(f'Decoding {audio_path} into the audio cache')
+        sample_rate, tmp_path = _decode(audio_path, os.path.join(cache_folder, native_prefix))
+        buffer_path = os.path.join(cache_folder, f'{native_prefix}{sample_rate}.npy')
+        os.replace(tmp_path, buffer_path)
+        return _open(buffer_path), sample_rate
+
+
+def load_audio(audio_path, sr=None, mono=True):
+    """
+    Return (wav, sr) like librosa.load, from float32 buffers memory-mapped out of a .audio_cache
+    folder next to audio_path. The file is decoded once; every sample rate and channel layout asked
+    for afterwards is derived from that decode, block by block, and cached as well, so each stage of a
+    video reads the same samples without decoding again. Buffers are keyed on the size and mtime of
+    audio_path and rebuilt when it changes.
+
+    The buffers are uncompressed float32, one per sample rate and channel layout, so a long video
+    takes several times the size of its wavs. generate_all_wavs_under_folder and
+    synthesize_all_video_under_folder remove them with clear_cache once they are done with a video;
+    after running only the earlier steps, delete the .audio_cache folders or call clear_cache.
+
+    mono=True returns a (samples,) array, mono=False a (channels, samples) array.
+    """
+    stat = os.stat(audio_path)
+    name = os.path.basename(audio_path)
+    prefix = f'{name}.{stat.st_size}-{stat.st_mtime_ns}'
+    cache_folder = os.path.join(os.path.dirname(audio_path), CACHE_DIR)
+    os.makedirs(cache_folder, exist_ok=True)
+    with _lock:
+        # Drop buffers of an older version of the file
+        for stale in os.listdir(cache_folder):
+            if stale.startswith(f'{name}.') and not stale.startswith(f'{prefix}.'):
+                try:
+                    os.remove(os.path.join(cache_folder, stale))
+                except OSError:
+                    pass
+
+    native, native_sr = _native(audio_path, cache_folder, prefix)
+    sr = sr or native_sr
+    if sr == native_sr and (not mono or len(native) == 1):
+        return (native[0] if mono else native), sr
+
+    buffer_path = os.path.join(cache_folder, f'{prefix}.{sr}.{"mono" if mono else "multi"}.npy')
+    with _buffer_lock(buffer_path):
+        if not os.path.exists(buffer_path):
+            _derive(native, native_sr, sr, mono, buffer_path)
+    return _open(buffer_path), sr
+
+
+def clear_cache(folder):
+    """Remove the .audio_cache folders under folder, once nothing reads its audio anymore."""
+    for root, dirs, _ in os.walk(folder):
+        if CACHE_DIR in dirs:
+            dirs.remove(CACHE_DIR)
+            cache_folder = os.path.join(root, CACHE_DIR)
+            with _lock:
+                shutil.rmtree(cache_folder, ignore_errors=True)
+            logger.info(f'Removed the audio cache {cache_folder}')
@@ -15,6 +15,7 @@ import argparse
 import string
 import re
 import csv
+from functools import lru_cache
 
 # ================================================================================ #
 #                                    basic constant
@@ -572,6 +573,12 @@ def create_system(numbering_type=NUMBERING_TYPES[1]):
     return system
 
 
+@lru_cache(maxsize=None)
+def _cached_system(numbering_type):
+    # num2chn and chn2num only read the system, so one per numbering type is shared
+    return create_system(numbering_type)
+
+
 def chn2num(chinese_string, numbering_type=NUMBERING_TYPES[1]):
 
     def get_symbol(char, system):
@@ -648,7 +655,7 @@ def chn2num(chinese_string, numbering_type=NUMBERING_TYPES[1]):
                 value.append(0)
         return sum(value)
 
-    system = create_system(numbering_type)
+    system = _cached_system(numbering_type)
     int_part, dec_part = string2symbols(chinese_string, system)
     int_part = correct_symbols(int_part, system)
     int_str = str(compute_value(int_part))
@@ -659,6 +666,7 @@ def chn2num(chinese_string, numbering_type=NUMBERING_TYPES[1]):
         return int_str
 
 
+@lru_cache(maxsize=65536)
 def num2chn(number_string, numbering_type=NUMBERING_TYPES[1], big=False,
             traditional=False, alt_zero=False, alt_one=False, alt_two=True,
             use_zeros=True, use_units=True):
@@ -685,7 +693,7 @@ def num2chn(number_string, numbering_type=NUMBERING_TYPES[1], big=False,
             result_string = value_string[:-result_unit.power]
             return get_value(result_string) + [result_unit] + get_value(striped_string[-result_unit.power:])
 
-    system = create_system(numbering_type)
+    system = _cached_system(numbering_type)
 
     int_dec = number_string.split('.')
     if len(int_dec) == 1:
@@ -916,8 +924,7 @@ class Money:
 
     def money2chntext(self):
         money = self.money
-        pattern = re.compile(r'(\d+(\.\d+)?)')
-        matchers = pattern.findall(money)
+        matchers = NUMBER_PATTERN.findall(money)
         if matchers:
             for matcher in matchers:
                 money = money.replace(matcher[0], Cardinal(
@@ -942,109 +949,80 @@ class Percentage:
         return '百分之' + num2chn(self.percentage.strip().strip('%'))
 
 
+DATE_PATTERN = re.compile(
+    r"\D+((([089]\d|(19|20)\d{2})年)?(\d{1,2}月(\d{1,2}[日号])?)?)")
+MONEY_PATTERN = re.compile(
+    r"\D+((\d+(\.\d+)?)[多余几]?" + CURRENCY_UNITS + r"(\d" + CURRENCY_UNITS + r"?)?)")
+# 手机
+# http://www.jihaoba.com/news/show/13680
+# 移动：139、138、137、136、135、134、159、158、157、150、151、152、188、187、182、183、184、178、198
+# 联通：130、131、132、156、155、186、185、176
+# 电信：133、153、189、180、181、177
+MOBILE_PATTERN = re.compile(
+    r"\D((\+?86 ?)?1([38]\d|5[0-35-9]|7[678]|9[89])\d{8})\D")
+FIXED_TELEPHONE_PATTERN = re.compile(r"\D((0(10|2[1-3]|[3-9]\d{2})-?)?[1-9]\d{6,7})\D")
+FRACTION_PATTERN = re.compile(r"(\d+/\d+)")
+PERCENTAGE_PATTERN = re.compile(r"(\d+(\.\d+)?%)")
+QUANTIFIER_PATTERN = re.compile(r"(\d+(\.\d+)?)[多余几]?" + COM_QUANTIFIERS)
+DIGIT_PATTERN = re.compile(r"(\d{4,32})")
+NUMBER_PATTERN = re.compile(r"(\d+(\.\d+)?)")
+PARTICULAR_PATTERN = re.compile(r"(([a-zA-Z]+)二([a-zA-Z]+))")
+ANY_DIGIT_PATTERN = re.compile(r"\d")
+
+
+def _replace_each(text, pattern, convert, group=0):
+    # Every match is replaced at the first occurrence of its text, which is what the rules were
+    # written against, so this is kept rather than substituting at the match position
+    for matcher in pattern.findall(text):
+        if group is not None:
+            matcher = matcher[group]
+        text = text.replace(matcher, convert(matcher), 1)
+    return text
+
+
 def normalize_nsw(raw_text):
     text = '^' + raw_text + '$'
 
-    # 规范化日期
-    pattern = re.compile(
-        r"\D+((([089]\d|(19|20)\d{2})年)?(\d{1,2}月(\d{1,2}[日号])?)?)")
-    matchers = pattern.findall(text)
-    if matchers:
-        # print('date')
-        for matcher in matchers:
-            text = text.replace(matcher[0], Date(
-                date=matcher[0]).date2chntext(), 1)
-
-    # 规范化金钱
-    pattern = re.compile(
-        r"\D+((\d+(\.\d+)?)[多余几]?" + CURRENCY_UNITS + r"(\d" + CURRENCY_UNITS + r"?)?)")
-    matchers = pattern.findall(text)
-    if matchers:
-        # print('money')
-        for matcher in matchers:
-            text = text.replace(matcher[0], Money(
-                money=matcher[0]).money2chntext(), 1)
-
-    # 规范化固话/手机号码
-    # 手机
-    # http://www.jihaoba.com/news/show/13680
-    # 移动：139、138、137、136、135、134、159、158、157、150、151、152、188、187、182、183、184、178、198
-    # 联通：130、131、132、156、155、186、185、176
-    # 电信：133、153、189、180、181、177
-    pattern = re.compile(
-        r"\D((\+?86 ?)?1([38]\d|5[0-35-9]|7[678]|9[89])\d{8})\D")
-    matchers = pattern.findall(text)
-    if matchers:
-        # print('telephone')
-        for matcher in matchers:
-            text = text.replace(matcher[0], TelePhone(
-                telephone=matcher[0]).telephone2chntext(), 1)
-    # 固话
-    pattern = re.compile(r"\D((0(10|2[1-3]|[3-9]\d{2})-?)?[1-9]\d{6,7})\D")
-    matchers = pattern.findall(text)
-    if matchers:
-        # print('fixed telephone')
-        for matcher in matchers:
-            text = text.replace(matcher[0], TelePhone(
-                telephone=matcher[0]).telephone2chntext(fixed=True), 1)
-
-    # 规范化分数
-    pattern = re.compile(r"(\d+/\d+)")
-    matchers = pattern.findall(text)
-    if matchers:
-        # print('fraction')
-        for matcher in matchers:
-            text = text.replace(matcher, Fraction(
-                fraction=matcher).fraction2chntext(), 1)
+    # Every rule but the last needs a digit, most sentences skip them all
+    has_digits = ANY_DIGIT_PATTERN.search(text) is not None
+    if has_digits:
+        # 规范化日期
+        text = _replace_each(text, DATE_PATTERN, lambda m: Date(date=m).date2chntext())
+        # 规范化金钱
+        text = _replace_each(text, MONEY_PATTERN, lambda m: Money(money=m).money2chntext())
+        # 规范化固话/手机号码
+        text = _replace_each(text, MOBILE_PATTERN, lambda m: TelePhone(telephone=m).telephone2chntext())
+        text = _replace_each(text, FIXED_TELEPHONE_PATTERN,
+                             lambda m: TelePhone(telephone=m).telephone2chntext(fixed=True))
+        # 规范化分数
+        if '/' in text:
+            text = _replace_each(text, FRACTION_PATTERN, lambda m: Fraction(fraction=m).fraction2chntext(), None)
 
     # 规范化百分数
     text = text.replace('％', '%')
-    pattern = re.compile(r"(\d+(\.\d+)?%)")
-    matchers = pattern.findall(text)
-    if matchers:
-        # print('percentage')
-        for matcher in matchers:
-            text = text.replace(matcher[0], Percentage(
-                percentage=matcher[0]).percentage2chntext(), 1)
-
-    # 规范化纯数+量词
-    pattern = re.compile(r"(\d+(\.\d+)?)[多余几]?" + COM_QUANTIFIERS)
-    matchers = pattern.findall(text)
-    if matchers:
-        # print('cardinal+quantifier')
-        for matcher in matchers:
-            text = text.replace(matcher[0], Cardinal(
-                cardinal=matcher[0]).cardinal2chntext(), 1)
-
-    # 规范化数字编号
-    pattern = re.compile(r"(\d{4,32})")
-    matchers = pattern.findall(text)
-    if matchers:
-        # print('digit')
-        for matcher in matchers:
-            text = text.replace(matcher, Digit(
-                digit=matcher).digit2chntext(), 1)
-
-    # 规范化纯数
-    pattern = re.compile(r"(\d+(\.\d+)?)")
-    matchers = pattern.findall(text)
-    if matchers:
-        # print('cardinal')
-        for matcher in matchers:
-            text = text.replace(matcher[0], Cardinal(
-                cardinal=matcher[0]).cardinal2chntext(), 1)
+    if has_digits:
+        if '%' in text:
+            text = _replace_each(text, PERCENTAGE_PATTERN,
+                                 lambda m: Percentage(percentage=m).percentage2chntext())
+        # 规范化纯数+量词
+        text = _replace_each(text, QUANTIFIER_PATTERN, lambda m: Cardinal(cardinal=m).cardinal2chntext())
+        # 规范化数字编号
+        text = _replace_each(text, DIGIT_PATTERN, lambda m: Digit(digit=m).digit2chntext(), None)
+        # 规范化纯数
+        text = _replace_each(text, NUMBER_PATTERN, lambda m: Cardinal(cardinal=m).cardinal2chntext())
 
     # restore P2P, O2O, B2C, B2B etc
-    pattern = re.compile(r"(([a-zA-Z]+)二([a-zA-Z]+))")
-    matchers = pattern.findall(text)
-    if matchers:
-        # print('particular')
-        for matcher in matchers:
+    if '二' in text:
+        for matcher in PARTICULAR_PATTERN.findall(text):
             text = text.replace(matcher[0], matcher[1]+'2'+matcher[2], 1)
 
     return text.lstrip('^').rstrip('$')
 
 
+# TTS input repeats the same sentences and fragments a lot
+cached_normalize_nsw = lru_cache(maxsize=65536)(normalize_nsw)
+
+
 def remove_erhua(text):
     """
     去除儿化音词中的儿:
@@ -1127,7 +1105,7 @@ class TextNorm:
         if self.remove_erhua:
             text = remove_erhua(text)
 
-        text = normalize_nsw(text)
+        text = cached_normalize_nsw(text)
 
         # text = text.translate(PUNCS_TRANSFORM)
 
@@ -1143,6 +1121,11 @@ class TextNorm:
 
         return text
 
+    def batch(self, texts):
+        """Normalize a list of texts, each distinct text once."""
+        done = {}
+        return [done[text] if text in done else done.setdefault(text, self(text)) for text in texts]
+
 
 if __name__ == '__main__':
     p = argparse.ArgumentParser()
@@ -12,7 +12,9 @@ from .step040_tts import generate_all_wavs_under_folder
 from .step042_tts_xtts import init_TTS
 from .step043_tts_cosyvoice import init_cosyvoice
 from .step050_synthesize_video import synthesize_all_video_under_folder
+from .pipeline import Stage, StagePipeline
 from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 def get_safe_info_list(urls, num_videos):
     """Safely get video info list from URL."""
@@ -22,51 +24,35 @@ def get_safe_info_list(urls, num_videos):
         return []  # Return an empty list instead of None
     return result
 
-def process_video(info, root_folder, resolution,
-                  demucs_model, device, shifts,
-                  asr_method, whisper_model, batch_size, diarization, whisper_min_speakers, whisper_max_speakers,
-                  translation_method, translation_target_language,
-                  tts_method, tts_target_language, voice,
-                  subtitles, speed_up, fps, background_music, bgm_volume, video_volume,
-                  target_resolution, max_retries):
-    for retry in range(max_retries):
-        try:
-            folder = get_target_folder(info, root_folder) if isinstance(info, dict) else os.path.dirname(info)
-            if folder is None:
-                logger.warning(f'Failed to get target folder for video {info}')
-                return False, None
-            
-            folder = download_single_video(info, root_folder, resolution) if isinstance(info, dict) else folder
-            if folder is None:
-                logger.warning(f'Failed to download video {info}')
-                return False, None
+def download_stage(info, root_folder, resolution):
+    folder = get_target_folder(info, root_folder) if isinstance(info, dict) else os.path.dirname(info)
+    if folder is None:
+        logger.warning(f'Failed to get target folder for video {info}')
+        return None
+    folder = download_single_video(info, root_folder, resolution) if isinstance(info, dict) else folder
+    if folder is None:
+        logger.warning(f'Failed to download video {info}')
+    return folder
 
-            logger.info(f'Processing video in {folder}')
-            separate_all_audio_under_folder(folder, model_name=demucs_model, device=device, progress=True, shifts=shifts)
-            transcribe_all_audio_under_folder(folder, asr_method=asr_method, whisper_model_name=whisper_model, device=device,
-                                              batch_size=batch_size, diarization=diarization, min_speakers=whisper_min_speakers,
-                                              max_speakers=whisper_max_speakers)
-            translate_all_transcript_under_folder(folder, method=translation_method, target_language=translation_target_language)
-            generate_all_wavs_under_folder(folder, method=tts_method, target_language=tts_target_language, voice=voice)
-            _, output_video = synthesize_all_video_under_folder(folder, subtitles=subtitles, speed_up=speed_up, fps=fps,
-                                                                resolution=target_resolution, background_music=background_music,
-                                                                bgm_volume=bgm_volume, video_volume=video_volume)
-            return True, output_video
-        except Exception as e:
-            logger.error(f'Error processing video {info}: {e}')
-    return False, None
+def folder_stage(folder, fn, **kwargs):
+    fn(folder, **kwargs)
+    return folder
+
+def synthesize_stage(folder, **kwargs):
+    _, output_video = synthesize_all_video_under_folder(folder, **kwargs)
+    return output_video
 
 def do_everything(root_folder, url, num_videos=5, resolution='1080p',
                   demucs_model='htdemucs_ft', device='auto', shifts=5,
                   asr_method='WhisperX', whisper_model='large', batch_size=32, diarization=False,
                   whisper_min_speakers=None, whisper_max_speakers=None,
-                  translation_method='LLM', translation_target_language='简体中文',
+                  translation_method='LLM', translation_target_language='简体中文', translation_batch_size=20,
+                  translation_concurrency=1,
                   tts_method='xtts', tts_target_language='中文', voice='zh-CN-XiaoxiaoNeural',
                   subtitles=True, speed_up=1.00, fps=30,
                   background_music=None, bgm_volume=0.5, video_volume=1.0, target_resolution='1080p',
-                  max_workers=3, max_retries=5):
-    success_list = []
-    fail_list = []
+                  video_preset='medium', video_threads=0,
+                  max_workers=3, max_retries=5, queue_size=2):
     url = url.replace(' ', '').replace('，', '\n').replace(',', '\n')
     urls = [u for u in url.split('\n') if u]
     
@@ -83,22 +69,39 @@ def do_everything(root_folder, url, num_videos=5, resolution='1080p',
         elif asr_method == 'FunASR':
             executor.submit(init_funasr)
     
+    # GPU-bound stages share global models and run one video at a time, while downloads,
+    # remote translation and ffmpeg encodes overlap with them on neighbouring videos.
+    translation_workers = 1 if translation_method == 'LLM' else max_workers
+    stages = [
+        Stage('download', partial(download_stage, root_folder=root_folder, resolution=resolution),
+              workers=max_workers, queue_size=queue_size),
+        Stage('demucs', partial(folder_stage, fn=separate_all_audio_under_folder, model_name=demucs_model,
+                                device=device, progress=True, shifts=shifts),
+              workers=1, queue_size=queue_size),
+        Stage('asr', partial(folder_stage, fn=transcribe_all_audio_under_folder, asr_method=asr_method,
+                             whisper_model_name=whisper_model, device=device, batch_size=batch_size,
+                             diarization=diarization, min_speakers=whisper_min_speakers,
+                             max_speakers=whisper_max_speakers),
+              workers=1, queue_size=queue_size),
+        Stage('translation', partial(folder_stage, fn=translate_all_transcript_under_folder, method=translation_method,
+                                     target_language=translation_target_language, batch_size=translation_batch_size,
+                                     concurrency=translation_concurrency),
+              workers=translation_workers, queue_size=queue_size),
+        Stage('tts', partial(folder_stage, fn=generate_all_wavs_under_folder, method=tts_method,
+                             target_language=tts_target_language, voice=voice),
+              workers=1, queue_size=queue_size),
+        Stage('synthesis', partial(synthesize_stage, subtitles=subtitles, speed_up=speed_up, fps=fps,
+                                   resolution=target_resolution, background_music=background_music,
+                                   bgm_volume=bgm_volume, video_volume=video_volume, preset=video_preset,
+                                   threads=video_threads),
+              workers=max_workers, queue_size=queue_size),
+    ]
+    pipeline = StagePipeline(stages, max_retries=max_retries)
     video_info_list = get_safe_info_list(urls, num_videos)
-    out_video = None
-    for info in video_info_list:
-        success, output_video = process_video(info, root_folder, resolution, demucs_model, device, shifts,
-                                              asr_method, whisper_model, batch_size, diarization, whisper_min_speakers, whisper_max_speakers,
-                                              translation_method, translation_target_language,
-                                              tts_method, tts_target_language, voice,
-                                              subtitles, speed_up, fps, background_music, bgm_volume, video_volume,
-                                              target_resolution, max_retries)
-        if success:
-            success_list.append(info)
-            out_video = output_video
-        else:
-            fail_list.append(info)
-    
-    return f'Success: {len(success_list)}\nFail: {len(fail_list)}', out_video
+    results, errors = pipeline.run(video_info_list)
+
+    out_video = results[-1][1] if results else None
+    return f'Success: {len(results)}\nFail: {len(errors)}', out_video
 
 if __name__ == '__main__':
     do_everything(root_folder='videos', url='https://www.bilibili.com/video/BV1kr421M7vz/', translation_method='LLM')
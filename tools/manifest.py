@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from loguru import logger
+
+MANIFEST_NAME = 'manifest.json'
+INDEX_NAME = '.jobs.json'
+JOB_MARKERS = ('download.mp4', 'audio.wav', 'audio_vocals.wav')
+_lock = threading.Lock()
+
+
+def _write_json(path, data):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def hash_file(path, chunk_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class Manifest:
+    """
+    Per-video record of what every stage consumed and produced. Stored as manifest.json in the
+    video folder:
+
+        {"files": {name: {"size", "mtime", "hash"}},
+         "stages": {stage: {"params": {...}, "inputs": {name: hash}, "outputs": {name: hash}}}}
+
+    File hashes are cached by size and mtime so unchanged files are not read again.
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        data = _read_json(self.path) or {}
+        self.files = data.get('files', {})
+        self.stages = data.get('stages', {})
+
+    def _abspath(self, name):
+        return name if os.path.isabs(name) else os.path.join(self.folder, name)
+
+    def hash(self, name):
+        path = self._abspath(name)
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        cached = self.files.get(name)
+        if cached and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime_ns:
+            return cached['hash']
+        digest = hash_file(path)
+        self.files[name] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': digest}
+        return digest
+
+    def save(self):
+        with _lock:
+            _write_json(self.path, {'files': self.files, 'stages': self.stages})
+
+    def is_fresh(self, stage, inputs, params, outputs):
+        record = self.stages.get(stage)
+        if record is None or record['params'] != params:
+            return False
+        if any(not os.path.exists(self._abspath(name)) for name in outputs):
+            return False
+        # An input dropped since the last run, such as the background music, makes it stale too
+        if set(record['inputs']) != set(inputs):
+            return False
+        return all(record['inputs'][name] == self.hash(name) for name in inputs)
+
+    def needs_run(self, stage, inputs, params, outputs, artifacts=(), adopt=True):
+        """
+        Decide whether a stage has to run. A stage is skipped when its parameters, its set of inputs
+        and their hashes match the last recorded run and its outputs still exist. Outputs produced
+        before the manifest existed are adopted as-is when `adopt` is set. Outputs of a stale run,
+        along with any extra `artifacts` such as per-sentence caches, are removed so the stage does
+        not reuse them.
+        """
+        params = json.loads(json.dumps(params))
+        if self.is_fresh(stage, inputs, params, outputs):
+            return False
+        outputs_exist = all(os.path.exists(self._abspath(name)) for name in outputs)
+        if stage not in self.stages:
+            if adopt and outputs_exist:
+                logger.info(f'Adopting existing {stage} outputs in {self.folder}')
+                self.record(stage, inputs, params, outputs)
+                return False
+            return True
+        logger.info(f'{stage} is out of date in {self.folder}, rerunning')
+        for name in list(outputs) + list(artifacts):
+            path = self._abspath(name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+        del self.stages[stage]
+        self.save()
+        return True
+
+    def record(self, stage, inputs, params, outputs):
+        self.stages[stage] = {
+            'params': json.loads(json.dumps(params)),
+            'inputs': {name: self.hash(name) for name in inputs},
+            'outputs': {name: self.hash(name) for name in outputs},
+        }
+        self.save()
+
+
+def _is_job_folder(folder, files=None):
+    if files is None:
+        return any(os.path.exists(os.path.join(folder, marker)) for marker in JOB_MARKERS)
+    return any(marker in files for marker in JOB_MARKERS)
+
+
+def _subdirs(folder):
+    return sorted(entry.name for entry in os.scandir(folder) if entry.is_dir())
+
+
+def _build_index(root_folder):
+    jobs, dirs = [], {}
+    for root, subdirs, files in os.walk(root_folder):
+        if _is_job_folder(root, files):
+            jobs.append(os.path.relpath(root, root_folder))
+            # Video folders hold hundreds of per-sentence files, never descend into them
+            subdirs[:] = []
+            continue
+        dirs[os.path.relpath(root, root_folder)] = sorted(subdirs)
+    return {'dirs': dirs, 'jobs': sorted(jobs)}
+
+
+def _index_is_valid(root_folder, index):
+    for rel_path, subdirs in index['dirs'].items():
+        path = os.path.join(root_folder, rel_path)
+        if not os.path.isdir(path) or _subdirs(path) != subdirs:
+            return False
+        # A folder yt-dlp had only just created may have become a video folder since
+        if rel_path != '.' and _is_job_folder(path):
+            return False
+    return all(os.path.isdir(os.path.join(root_folder, rel_path)) for rel_path in index['jobs'])
+
+
+def list_video_folders(root_folder):
+    """
+    Return every video folder under root_folder. The folder list is cached in root_folder/.jobs.json
+    together with the subdirectories of every intermediate directory, so revalidating it only lists
+    the uploader folders instead of walking into every video folder.
+    """
+    if not os.path.isdir(root_folder):
+        return []
+    if _is_job_folder(root_folder):
+        return [root_folder]
+    index_path = os.path.join(root_folder, INDEX_NAME)
+    index = _read_json(index_path)
+    if index is None or not _index_is_valid(root_folder, index):
+        index = _build_index(root_folder)
+        with _lock:
+            _write_json(index_path, index)
+    return [os.path.normpath(os.path.join(root_folder, rel_path)) for rel_path in index['jobs']]
@@ -0,0 +1,140 @@
+import queue
+import threading
+import time
+from loguru import logger
+
+_STOP = object()
+
+
+class Stage:
+    def __init__(self, name, fn, workers=1, queue_size=2):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.processed = 0
+        self.failed = 0
+        self.busy_time = 0.0
+        self.active = 0
+        self.lock = threading.Lock()
+        self.finished_workers = 0
+
+    def stats(self, elapsed):
+        with self.lock:
+            return {
+                'stage': self.name,
+                'queue': self.queue.qsize(),
+                'active': self.active,
+                'processed': self.processed,
+                'failed': self.failed,
+                'throughput': self.processed / elapsed * 60 if elapsed > 0 else 0.0,
+                'busy': self.busy_time,
+            }
+
+
+class StagePipeline:
+    """
+    Runs items through a chain of stages. Every stage owns a bounded input queue and a fixed
+    number of worker threads, so a slow stage back-pressures the ones before it while the
+    others keep working on neighbouring items.
+
+    Each stage function takes the output of the previous stage and returns the input of the
+    next one. Returning None marks the item as failed and drops it from the pipeline.
+    """
+    def __init__(self, stages, max_retries=1, report_interval=30):
+        self.stages = stages
+        self.max_retries = max(1, max_retries)
+        self.report_interval = report_interval
+        self.results = []
+        self.errors = []
+        self._results_lock = threading.Lock()
+        self._done = threading.Event()
+        self._t_start = None
+
+    def _call(self, stage, item):
+        for retry in range(self.max_retries):
+            try:
+                return stage.fn(item)
+            except Exception as e:
+                logger.error(f'[{stage.name}] Error processing {item} (attempt {retry + 1}/{self.max_retries}): {e}')
+        return None
+
+    def _worker(self, index):
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            job = stage.queue.get()
+            if job is _STOP:
+                break
+            key, item = job
+            with stage.lock:
+                stage.active += 1
+            t_start = time.time()
+            output = self._call(stage, item)
+            with stage.lock:
+                stage.active -= 1
+                stage.busy_time += time.time() - t_start
+                if output is None:
+                    stage.failed += 1
+                else:
+                    stage.processed += 1
+            if output is None:
+                with self._results_lock:
+                    self.errors.append((key, stage.name))
+            elif next_stage is None:
+                with self._results_lock:
+                    self.results.append((key, output))
+            else:
+                next_stage.queue.put((key, output))
+
+        # The last worker of a stage to leave tells every worker of the next stage to stop
+        with stage.lock:
+            stage.finished_workers += 1
+            last = stage.finished_workers == stage.workers
+        if last and next_stage is not None:
+            for _ in range(next_stage.workers):
+                next_stage.queue.put(_STOP)
+
+    def _report(self):
+        while not self._done.wait(self.report_interval):
+            self.log_stats()
+
+    def log_stats(self):
+        elapsed = time.time() - self._t_start
+        for stats in (stage.stats(elapsed) for stage in self.stages):
+            logger.info(f'[{stats["stage"]}] queue: {stats["queue"]}, active: {stats["active"]}, '
+                        f'done: {stats["processed"]}, failed: {stats["failed"]}, '
+                        f'throughput: {stats["throughput"]:.2f}/min, busy: {stats["busy"]:.1f}s')
+
+    def stats(self):
+        elapsed = time.time() - self._t_start if self._t_start else 0.0
+        return [stage.stats(elapsed) for stage in self.stages]
+
+    def run(self, items):
+        """
+        Feed items into the first stage and block until every stage has drained.
+        Returns (results, errors) where results are (index, output) pairs in input order
+        and errors are (index, stage_name) pairs.
+        """
+        self._t_start = time.time()
+        threads = []
+        for i, stage in enumerate(self.stages):
+            for j in range(stage.workers):
+                thread = threading.Thread(target=self._worker, args=(i,), name=f'{stage.name}-{j}', daemon=True)
+                thread.start()
+                threads.append(thread)
+        reporter = threading.Thread(target=self._report, name='pipeline-report', daemon=True)
+        reporter.start()
+
+        first = self.stages[0]
+        for key, item in enumerate(items):
+            first.queue.put((key, item))
+        for _ in range(first.workers):
+            first.queue.put(_STOP)
+
+        for thread in threads:
+            thread.join()
+        self._done.set()
+        reporter.join()
+        self.log_stats()
+        return sorted(self.results, key=lambda x: x[0]), sorted(self.errors, key=lambda x: x[0])
@@ -3,32 +3,45 @@ from demucs.api import Separator
 import os
 from loguru import logger
 import time
-from .utils import save_wav, normalize_wav
+import numpy as np
+from .utils import save_wav, normalize_wav, WavWriter
+from .audio_cache import load_audio
+from .manifest import Manifest, list_video_folders
 import torch
+import librosa
 auto_device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+# Batching chunks pays off on CPU, on GPU a single chunk already keeps the device busy
+auto_batch_size = 1 if torch.cuda.is_available() else 8
+# Fixed offsets for the shift trick, so that a rerun reproduces the separation the manifest recorded
+shift_seed = 0
 separator = None
+# (model_name, device) of the loaded separator, shifts and batch_size are set per call
+loaded_model = None
 
 def init_demucs():
-    global separator
-    separator = load_model()
+    load_model()
     
 def load_model(model_name: str = "htdemucs_ft", device: str = 'auto', progress: bool = True, shifts: int=5) -> Separator:
-    global separator
-    if separator is not None:
+    global separator, loaded_model
+    device = auto_device if device == 'auto' else torch.device(device)
+    if separator is not None and loaded_model == (model_name, device):
         logger.info(f'Demucs model already loaded')
         return
     
     logger.info(f'Loading Demucs model: {model_name}')
     t_start = time.time()
-    separator = Separator(model_name, device=auto_device if device=='auto' else device, progress=progress, shifts=shifts)
+    separator = Separator(model_name, device=device, progress=progress, shifts=shifts, seed=shift_seed)
+    loaded_model = (model_name, device)
     t_end = time.time()
     logger.info(f'Demucs model loaded in {t_end - t_start:.2f} seconds')
 
 def reload_model(model_name: str = "htdemucs_ft", device: str = 'auto', progress: bool = True, shifts: int=5) -> Separator:
-    global separator
+    global separator, loaded_model
     logger.info(f'Reloading Demucs model: {model_name}')
     t_start = time.time()
-    separator = Separator(model_name, device=auto_device if device=='auto' else device, progress=progress, shifts=shifts)
+    device = auto_device if device == 'auto' else torch.device(device)
+    separator = Separator(model_name, device=device, progress=progress, shifts=shifts, seed=shift_seed)
+    loaded_model = (model_name, device)
     t_end = time.time()
     logger.info(f'Demucs model reloaded in {t_end - t_start:.2f} seconds')
     
@@ -46,9 +59,11 @@ def separate_audio(folder: str, model_name: str = "htdemucs_ft", device: str = '
     
     logger.info(f'Separating audio from {folder}')
     load_model(model_name, device, progress, shifts)
+    separator.update_parameter(shifts=shifts, batch_size=1)
     t_start = time.time()
     try:
-        origin, separated = separator.separate_audio_file(audio_path)
+        wav, sr = load_audio(audio_path, sr=separator.samplerate, mono=False)
+        origin, separated = separator.separate_tensor(torch.from_numpy(wav), sr)
     except:
         # reload_model(model_name, device, progress, shifts)
                 # origin, separated = separator.separate_audio_file(audio_path)
@@ -57,7 +72,9 @@ def separate_audio(folder: str, model_name: str = "htdemucs_ft", device: str = '
         raise Exception(f'Error separating audio from {folder}')
     t_end = time.time()
     logger.info(f'Audio separated in {t_end - t_start:.2f} seconds')
-    
+    return save_separated(folder, separated)
+
+def save_separated(folder: str, separated: dict):
     vocals = separated['vocals'].numpy().T
     instruments = None
     for k, v in separated.items():
@@ -79,6 +96,62 @@ def separate_audio(folder: str, model_name: str = "htdemucs_ft", device: str = '
     logger.info(f'Instruments saved to {instruments_output_path}')
     return vocal_output_path, instruments_output_path
 
+def separate_audio_streaming(folder: str, model_name: str = "htdemucs_ft", device: str = 'auto', progress: bool = True, shifts: int = 5, batch_size: int = 1, block_seconds: float = 30) -> None:
+    """Separate audio.wav block by block, appending the stems to the output wavs as they are produced."""
+    global separator
+    audio_path = os.path.join(folder, 'audio.wav')
+    if not os.path.exists(audio_path):
+        return None, None
+    vocal_output_path = os.path.join(folder, 'audio_vocals.wav')
+    instruments_output_path = os.path.join(folder, 'audio_instruments.wav')
+    
+    load_model(model_name, device, progress, shifts)
+    wav, sample_rate = load_audio(audio_path, sr=separator.samplerate, mono=False)
+    channels, frames = wav.shape
+    if channels != separator.audio_channels:
+        logger.warning(f'{audio_path} does not have {separator.audio_channels} channels, separating it in memory')
+        return separate_audio(folder, model_name, device, progress, shifts)
+    
+    logger.info(f'Separating audio from {folder} in {block_seconds}s blocks')
+    separator.update_parameter(shifts=shifts, batch_size=batch_size)
+    block_frames = int(block_seconds * sample_rate)
+    t_start = time.time()
+    # First pass: statistics of the mono mix, which Separator normalizes the whole track with
+    total, total_sq, count = 0.0, 0.0, 0
+    for start in range(0, frames, block_frames):
+        mono = wav[:, start:start + block_frames].mean(axis=0, dtype=np.float64)
+        total += mono.sum()
+        total_sq += np.square(mono).sum()
+        count += len(mono)
+    mean = total / max(count, 1)
+    std = np.sqrt(max(total_sq - count * mean * mean, 0) / max(count - 1, 1))
+    
+    vocal_part_path = vocal_output_path.replace('.wav', '.part.wav')
+    instruments_part_path = instruments_output_path.replace('.wav', '.part.wav')
+    blocks = (torch.from_numpy(np.array(wav[:, start:start + block_frames])) for start in range(0, frames, block_frames))
+    written = 0
+    try:
+        with WavWriter(vocal_part_path, sample_rate, channels) as vocals_writer, \
+                WavWriter(instruments_part_path, sample_rate, channels) as instruments_writer:
+            for separated in separator.separate_stream(blocks, float(mean), float(std)):
+                instruments = sum(v for k, v in separated.items() if k != 'vocals')
+                vocals_writer.write(separated['vocals'].numpy().T)
+                instruments_writer.write(instruments.numpy().T)
+                written += instruments.shape[-1]
+                if progress:
+                    logger.info(f'Separated {written / sample_rate:.0f}/{frames / sample_rate:.0f} seconds')
+    except:
+        time.sleep(5)
+        logger.error(f'Error separating audio from {folder}')
+        raise Exception(f'Error separating audio from {folder}')
+    os.replace(vocal_part_path, vocal_output_path)
+    os.replace(instruments_part_path, instruments_output_path)
+    t_end = time.time()
+    logger.info(f'Audio separated in {t_end - t_start:.2f} seconds')
+    logger.info(f'Vocals saved to {vocal_output_path}')
+    logger.info(f'Instruments saved to {instruments_output_path}')
+    return vocal_output_path, instruments_output_path
+
 def extract_audio_from_video(folder: str) -> bool:
     video_path = os.path.join(folder, 'download.mp4')
     if not os.path.exists(video_path):
@@ -97,21 +170,78 @@ def extract_audio_from_video(folder: str) -> bool:
     time.sleep(1)
     logger.info(f'Audio extracted from {folder}')
     return True
+
+def separate_audio_batch(folders: list, model_name: str = "htdemucs_ft", device: str = 'auto', progress: bool = True, shifts: int = 5, batch_size: int = 8) -> None:
+    """Separate several folders at once, packing chunks of all their tracks into batches of `batch_size`."""
+    global separator
+    load_model(model_name, device, progress, shifts)
+    separator.update_parameter(shifts=shifts, batch_size=batch_size)
+    logger.info(f'Separating audio from {len(folders)} folders with batch size {batch_size}')
+    t_start = time.time()
+    try:
+        wavs = [torch.from_numpy(load_audio(os.path.join(folder, 'audio.wav'), sr=separator.samplerate, mono=False)[0])
+                for folder in folders]
+        results = separator.separate_tensors(wavs, separator.samplerate)
+    except:
+        time.sleep(5)
+        logger.error(f'Error separating audio from {folders}')
+        raise Exception(f'Error separating audio from {folders}')
+    t_end = time.time()
+    logger.info(f'Audio separated in {t_end - t_start:.2f} seconds')
+    return [save_separated(folder, separated) for folder, (origin, separated) in zip(folders, results)]
     
-def separate_all_audio_under_folder(root_folder: str, model_name: str = "htdemucs_ft", device: str = 'auto', progress: bool = True, shifts: int = 5) -> None:
+def separate_all_audio_under_folder(root_folder: str, model_name: str = "htdemucs_ft", device: str = 'auto', progress: bool = True, shifts: int = 5, batch_size: int = None, max_group_seconds: float = 600, streaming: bool = None) -> None:
+    """
+    Separate every video under root_folder. Tracks are packed into groups of at most max_group_seconds
+    whose chunks share forward passes of batch_size. With streaming=None, tracks longer than
+    max_group_seconds are separated block by block instead so memory does not grow with their length;
+    streaming=True does this for every track and streaming=False never.
+    """
     global separator
+    if batch_size is None:
+        batch_size = auto_batch_size
     vocal_output_path, instruments_output_path = None, None
-    for subdir, dirs, files in os.walk(root_folder):
-        if 'download.mp4' not in files:
-            continue
-        if 'audio.wav' not in files:
+    params = {'model_name': model_name, 'shifts': shifts}
+    outputs = ['audio_vocals.wav', 'audio_instruments.wav']
+    pending = []
+    for subdir in list_video_folders(root_folder):
+        manifest = Manifest(subdir)
+        if os.path.exists(os.path.join(subdir, 'download.mp4')) and \
+                manifest.needs_run('extract', ['download.mp4'], {}, ['audio.wav']):
             extract_audio_from_video(subdir)
-        if 'audio_vocals.wav' not in files:
-            vocal_output_path, instruments_output_path = separate_audio(subdir, model_name, device, progress, shifts)
-        elif 'audio_vocals.wav' in files and 'audio_instruments.wav' in files:
+            manifest.record('extract', ['download.mp4'], {}, ['audio.wav'])
+        if not os.path.exists(os.path.join(subdir, 'audio.wav')):
+            continue
+        if manifest.needs_run('demucs', ['audio.wav'], params, outputs):
+            pending.append(subdir)
+        else:
             vocal_output_path = os.path.join(subdir, 'audio_vocals.wav')
             instruments_output_path = os.path.join(subdir, 'audio_instruments.wav')
             logger.info(f'Audio already separated in {subdir}')
+
+    # Short tracks are packed together so their chunks can share forward passes,
+    # the total length of a group bounds how much audio is held in memory at once.
+    groups, group, group_seconds = [], [], 0
+    for subdir in pending:
+        seconds = librosa.get_duration(path=os.path.join(subdir, 'audio.wav'))
+        if streaming or (streaming is None and seconds > max_group_seconds):
+            vocal_output_path, instruments_output_path = separate_audio_streaming(subdir, model_name, device, progress, shifts, batch_size)
+            Manifest(subdir).record('demucs', ['audio.wav'], params, outputs)
+            continue
+        if group and (batch_size == 1 or group_seconds + seconds > max_group_seconds):
+            groups.append(group)
+            group, group_seconds = [], 0
+        group.append(subdir)
+        group_seconds += seconds
+    if group:
+        groups.append(group)
+    for group in groups:
+        if batch_size > 1:
+            vocal_output_path, instruments_output_path = separate_audio_batch(group, model_name, device, progress, shifts, batch_size)[-1]
+        else:
+            vocal_output_path, instruments_output_path = separate_audio(group[0], model_name, device, progress, shifts)
+        for subdir in group:
+            Manifest(subdir).record('demucs', ['audio.wav'], params, outputs)
     logger.info(f'All audio separated under {root_folder}')
     return f'All audio separated under {root_folder}', vocal_output_path, instruments_output_path
     
@@ -6,8 +6,9 @@ from dotenv import load_dotenv
 from .step021_asr_whisperx import whisperx_transcribe_audio
 from .step022_asr_funasr import funasr_transcribe_audio
 from .utils import save_wav
+from .manifest import Manifest, list_video_folders
+from .audio_cache import load_audio
 import json
-import librosa
 from loguru import logger
 load_dotenv()
 
@@ -37,7 +38,7 @@ def merge_segments(transcript, ending='!"\').:;?]}~！“”’）。：；？
 
 def generate_speaker_audio(folder, transcript):
     wav_path = os.path.join(folder, 'audio_vocals.wav')
-    audio_data, samplerate = librosa.load(wav_path, sr=24000)
+    audio_data, samplerate = load_audio(wav_path, sr=24000)
     speaker_dict = dict()
     length = len(audio_data)
     delay = 0.05
@@ -88,10 +89,17 @@ def transcribe_audio(method, folder, model_name: str = 'large', download_root='m
 
 def transcribe_all_audio_under_folder(folder, asr_method, whisper_model_name: str = 'large', device='auto', batch_size=32, diarization=False, min_speakers=None, max_speakers=None):
     transcribe_json = None
-    for root, dirs, files in os.walk(folder):
-        if 'audio_vocals.wav' in files and 'transcript.json' not in files:
+    for root in list_video_folders(folder):
+        if not os.path.exists(os.path.join(root, 'audio_vocals.wav')):
+            continue
+        manifest = Manifest(root)
+        params = {'asr_method': asr_method, 'model_name': whisper_model_name, 'diarization': diarization,
+                  'min_speakers': min_speakers, 'max_speakers': max_speakers}
+        if manifest.needs_run('asr', ['audio_vocals.wav'], params, ['transcript.json'], artifacts=['SPEAKER']):
             transcribe_json = transcribe_audio(asr_method, root, whisper_model_name, 'models/ASR/whisper', device, batch_size, diarization, min_speakers, max_speakers)
-        elif 'transcript.json' in files:
+            if transcribe_json:
+                manifest.record('asr', ['audio_vocals.wav'], params, ['transcript.json'])
+        else:
             transcribe_json = json.load(open(os.path.join(root, 'transcript.json'), 'r', encoding='utf-8'))
 
             # logger.info(f'Transcript already exists in {root}')
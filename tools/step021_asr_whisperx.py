@@ -7,9 +7,13 @@ import os
 from loguru import logger
 import torch
 from dotenv import load_dotenv
+from whisperx.audio import SAMPLE_RATE
+from .audio_cache import load_audio
 load_dotenv()
 
 whisper_model = None
+# (model_name, device) of the loaded whisper_model
+loaded_whisper_model = None
 diarize_model = None
 
 align_model = None
@@ -28,17 +32,20 @@ def load_whisper_model(model_name: str = 'large', download_root = 'models/ASR/wh
         pretrain_model = os.path.join(download_root,"faster-whisper-large-v3")
         model_name = 'large-v3' if not os.path.isdir(pretrain_model) else pretrain_model
         
-    global whisper_model
-    if whisper_model is not None:
-        return
+    global whisper_model, loaded_whisper_model
     if device == 'auto':
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    if whisper_model is not None and loaded_whisper_model == (model_name, device):
+        return
+    # Free the previous model before loading one with other parameters
+    whisper_model = None
     logger.info(f'Loading WhisperX model: {model_name}')
     t_start = time.time()
     if device=='cpu':
         whisper_model = whisperx.load_model(model_name, download_root=download_root, device=device, compute_type='int8')
     else:
         whisper_model = whisperx.load_model(model_name, download_root=download_root, device=device)
+    loaded_whisper_model = (model_name, device)
     t_end = time.time()
     logger.info(f'Loaded WhisperX model: {model_name} in {t_end - t_start:.2f}s')
 
@@ -76,7 +83,9 @@ def whisperx_transcribe_audio(wav_path, model_name: str = 'large', download_root
     if device == 'auto':
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
     load_whisper_model(model_name, download_root, device)
-    rec_result = whisper_model.transcribe(wav_path, batch_size=batch_size)
+    # Decoded once and shared by transcription, alignment and diarization
+    audio, _ = load_audio(wav_path, sr=SAMPLE_RATE)
+    rec_result = whisper_model.transcribe(audio, batch_size=batch_size)
     
     if rec_result['language'] == 'nn':
         logger.warning(f'No language detected in {wav_path}')
@@ -84,12 +93,13 @@ def whisperx_transcribe_audio(wav_path, model_name: str = 'large', download_root
     
     load_align_model(rec_result['language'])
     rec_result = whisperx.align(rec_result['segments'], align_model, align_metadata,
-                                wav_path, device, return_char_alignments=False)
+                                audio, device, return_char_alignments=False,
+                                batch_alignment=True, batch_size=8)
     
     if diarization:
         load_diarize_model(device)
         if diarize_model:
-            diarize_segments = diarize_model(wav_path,min_speakers=min_speakers, max_speakers=max_speakers)
+            diarize_segments = diarize_model(audio,min_speakers=min_speakers, max_speakers=max_speakers)
             rec_result = whisperx.assign_word_speakers(diarize_segments, rec_result)
         else:
             logger.warning("Diarization model is not loaded, skipping speaker diarization")
@@ -5,6 +5,7 @@ import os
 from loguru import logger
 import torch
 from dotenv import load_dotenv
+from .audio_cache import load_audio
 load_dotenv()
 
 funasr_model = None
@@ -48,8 +49,10 @@ def funasr_transcribe_audio(wav_path, device='auto', batch_size=1, diarization=T
     if device == 'auto':
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
     load_funasr_model(device)
+    # FunASR models take 16 kHz input
+    audio, _ = load_audio(wav_path, sr=16000)
     rec_result = funasr_model.generate(
-        wav_path,
+        audio,
         device=device, 
         # batch_size=batch_size,
         return_spk_res=True if diarization else False,
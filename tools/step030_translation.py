@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import json
 import os
 import re
@@ -6,10 +7,14 @@ import re
 from dotenv import load_dotenv
 import time
 from loguru import logger
+from . import step031_translation_openai, step032_translation_llm, step034_translation_ernie
 from .step031_translation_openai import openai_response
-from .step032_translation_llm import llm_response
+from .step032_translation_llm import llm_batch_response, llm_response
 from .step033_translation_translator import translator_response
 from .step034_translation_ernie import ernie_response
+from .manifest import Manifest, list_video_folders
+from .translation_client import AsyncTranslationClient, BatchingChat
+from .translation_memory import get_translation_memory
 load_dotenv()
 
 def get_necessary_info(info: dict):
@@ -124,11 +129,34 @@ def split_sentences(translation, use_char_based_end=True):
 
     return output_data
 
+def _model_name(method):
+    if method == 'LLM':
+        return step032_translation_llm.model_name
+    elif method == 'OpenAI':
+        return step031_translation_openai.model_name
+    elif method == 'Ernie':
+        return step034_translation_ernie.model_name
+    return ''
+
 def summarize(info, transcript, target_language='简体中文', method = 'LLM'):
     transcript = ' '.join(line['text'] for line in transcript)
     transcript = ensure_transcript_length(transcript, max_length=2000)
     info_message = f'Title: "{info["title"]}" Author: "{info["uploader"]}". ' 
     
+    memory = get_translation_memory()
+    source = f'{info_message}Tags: {info["tags"]}\n{transcript}'
+    if memory is not None:
+        cached = memory.get(source, target_language, method, _model_name(method), kind='summary')
+        if cached is not None:
+            logger.info('Summary found in translation memory')
+            return json.loads(cached)
+    summary = _summarize(info, transcript, info_message, target_language, method)
+    if memory is not None:
+        memory.put(source, json.dumps(summary, ensure_ascii=False), target_language, method, _model_name(method),
+                   kind='summary')
+    return summary
+
+def _summarize(info, transcript, info_message, target_language, method):
     if method in ['Google Translate', 'Bing Translate']:
         full_description = f'{info_message}\n{transcript}\n{info_message}\n'
         translation = translator_response(full_description, target_language)
@@ -215,10 +243,213 @@ def summarize(info, transcript, target_language='简体中文', method = 'LLM'):
             logger.warning(f'总结翻译失败\n{e}')
             time.sleep(1)
 
-def _translate(summary, transcript, target_language='简体中文', method='LLM'):
+def _chat(messages, method):
+    if method == 'LLM':
+        return llm_response(messages)
+    elif method == 'OpenAI':
+        return openai_response(messages)
+    elif method == 'Ernie':
+        system_content = messages[0]['content']
+        user_messages = messages[1:]
+        return ernie_response(user_messages, system=system_content)
+    raise Exception('Invalid method')
+
+async def _translate_line(chat, fixed_message, history, text):
+    translation = ''
+    retry_message = 'Only translate the quoted sentence and give me the final translation.'
+    for retry in range(10):
+        messages = fixed_message + \
+            history[-30:] + [{'role': 'user',
+                            'content': f'Translate:"{text}"'}]
+        # print(messages)
+        try:
+            response = await chat(messages)
+            translation = response.replace('\n', '')
+            logger.info(f'原文：{text}')
+            logger.info(f'译文：{translation}')
+            success, translation = valid_translation(text, translation)
+            if not success:
+                retry_message += translation
+                raise Exception('Invalid translation')
+            break
+        except Exception as e:
+            logger.error(e)
+            logger.warning('翻译失败')
+            await asyncio.sleep(1)
+    return translation
+
+def _numbered(lines):
+    return json.dumps({str(i + 1): line for i, line in enumerate(lines)}, ensure_ascii=False)
+
+def _parse_numbered(response, count):
+    """Read the {"1": "...", ...} object of a batched reply, keyed by 0-based line index."""
+    match = re.search(r'\{.*\}', response, re.S)
+    if match is None:
+        return {}
+    try:
+        numbered = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(numbered, dict):
+        return {}
+    return {int(key) - 1: value for key, value in numbered.items()
+            if str(key).isdigit() and 0 < int(key) <= count and isinstance(value, str)}
+
+async def _translate_chunk(chat, system, example, fixed_message, texts, translations, chunk, context,
+                           max_retries):
+    """
+    Translate the lines `chunk` of texts in one numbered request, writing into translations. The lines in
+    `context` go along as an already translated exchange when their translations are known, and as plain
+    preceding lines otherwise. Returns the number of requests sent.
+    """
+    if all(translations[i] is not None for i in context):
+        context_message = [
+            {'role': 'user', 'content': _numbered([texts[i] for i in context])},
+            {'role': 'assistant', 'content': _numbered([translations[i] for i in context])},
+        ] if context else []
+        preceding = ''
+    else:
+        context_message = []
+        preceding = f'Preceding lines, for context only: {_numbered([texts[i] for i in context])}\n'
+    pending = list(chunk)
+    retry_message = ''
+    num_requests = 0
+    for retry in range(max_retries):
+        messages = [system] + example + context_message + \
+            [{'role': 'user', 'content': preceding + retry_message + _numbered([texts[i] for i in pending])}]
+        try:
+            num_requests += 1
+            response = await chat(messages)
+        except Exception as e:
+            logger.error(e)
+            logger.warning('翻译失败')
+            await asyncio.sleep(1)
+            continue
+        results = _parse_numbered(response, len(pending))
+        failed = []
+        for k, i in enumerate(pending):
+            success = k in results
+            if success:
+                success, translation = valid_translation(texts[i], results[k].replace('\n', ''))
+            if success:
+                logger.info(f'原文：{texts[i]}')
+                logger.info(f'译文：{translation}')
+                translations[i] = translation
+            else:
+                failed.append(i)
+        pending = failed
+        if not pending:
+            break
+        logger.warning(f'{len(pending)} lines to translate again')
+        retry_message = 'Only translate each of the following lines on its own and reply with a JSON object of all of them.\n'
+
+    for i in pending:
+        history = []
+        for j in context:
+            if translations[j] is not None:
+                history.append({'role': 'user', 'content': f'Translate:"{texts[j]}"'})
+                history.append({'role': 'assistant', 'content': f'翻译：“{translations[j]}”'})
+        num_requests += 1
+        translations[i] = await _translate_line(chat, fixed_message, history, texts[i])
+    return num_requests
+
+async def _translate_batch(chat, fixed_message, examples, texts, target_language, batch_size, concurrency=1,
+                           translations=None, context_size=10, max_retries=3):
+    """
+    Translate texts batch_size lines per request, as a numbered JSON object, and check every returned
+    line with valid_translation. Only the lines that fail are requested again; lines still failing
+    after max_retries fall back to one request per line.
+
+    Chunks run one after the other with the last context_size translated lines as context, or with
+    concurrency > 1 all at once with the preceding source lines as context. Lines that already have
+    a translation are not requested, chunks are the runs of the others.
+    """
+    system = {'role': 'system', 'content': fixed_message[0]['content'] + \
+        f'\nYou will be given numbered lines of the transcript as a JSON object. Translate every line into {target_language} on its own, ' \
+        f'keep the numbers and reply with only a JSON object with the same keys:\n```json\n{{"1": "", "2": ""}}\n```'}
+    example = [
+        {'role': 'user', 'content': _numbered([text for text, _ in examples])},
+        {'role': 'assistant', 'content': _numbered([translation for _, translation in examples])},
+    ]
+    translations = list(translations) if translations is not None else [None] * len(texts)
+    runs = []
+    for i, translation in enumerate(translations):
+        if translation is not None:
+            continue
+        if runs and runs[-1][-1] == i - 1 and len(runs[-1]) < batch_size:
+            runs[-1].append(i)
+        else:
+            runs.append([i])
+    chunks = [(run, range(max(0, run[0] - context_size), run[0])) for run in runs]
+    if concurrency > 1:
+        num_requests = sum(await asyncio.gather(*[
+            _translate_chunk(chat, system, example, fixed_message, texts, translations, chunk, context, max_retries)
+            for chunk, context in chunks]))
+    else:
+        num_requests = 0
+        for chunk, context in chunks:
+            num_requests += await _translate_chunk(chat, system, example, fixed_message, texts, translations, chunk,
+                                                   context, max_retries)
+    logger.info(f'Translated {sum(len(run) for run in runs)} lines in {num_requests} requests')
+    return translations
+
+async def _translate_lines(chat, fixed_message, texts, concurrency=1, translations=None):
+    translations = list(translations) if translations is not None else [None] * len(texts)
+    missing = [i for i, translation in enumerate(translations) if translation is None]
+    if concurrency > 1:
+        # Lines are independent requests here, without the history of the previous ones
+        results = await asyncio.gather(*[_translate_line(chat, fixed_message, [], texts[i]) for i in missing])
+        for i, translation in zip(missing, results):
+            translations[i] = translation
+        return translations
+    history = []
+    for i, text in enumerate(texts):
+        # Known translations are not requested again but still go into the history
+        if translations[i] is None:
+            translations[i] = await _translate_line(chat, fixed_message, history, text)
+            await asyncio.sleep(0.1)
+        history.append({'role': 'user', 'content': f'Translate:"{text}"'})
+        history.append({'role': 'assistant', 'content': f'翻译：“{translations[i]}”'})
+    return translations
+
+async def _translate_texts(client, texts, target_language, translations):
+    async def translate_text(text):
+        try:
+            return await client.translate_text(text, target_language)
+        except Exception as e:
+            logger.info(f'translate failed! {e}')
+            return ''
+    missing = [i for i, translation in enumerate(translations) if translation is None]
+    for i, translation in zip(missing, await asyncio.gather(*[translate_text(texts[i]) for i in missing])):
+        translations[i] = translation
+    return translations
+
+async def _translate_async(fixed_message, examples, texts, target_language, method, batch_size, concurrency,
+                           translations):
+    # Remote backends go through the async client, the local LLM answers concurrent requests in batches
+    client = AsyncTranslationClient(method, concurrency) if concurrency > 1 and method != 'LLM' else None
+    if client is not None:
+        chat = client.chat
+    elif concurrency > 1 and method == 'LLM':
+        chat = BatchingChat(llm_batch_response, concurrency).chat
+    else:
+        concurrency = 1
+        async def chat(messages):
+            return _chat(messages, method)
+    try:
+        if method in ['Google Translate', 'Bing Translate']:
+            return await _translate_texts(client, texts, target_language, translations)
+        if batch_size > 1:
+            return await _translate_batch(chat, fixed_message, examples, texts, target_language, batch_size,
+                                          concurrency, translations)
+        return await _translate_lines(chat, fixed_message, texts, concurrency, translations)
+    finally:
+        if client is not None:
+            client.close()
+
+def _translate(summary, transcript, target_language='简体中文', method='LLM', batch_size=1, concurrency=1):
 
     info = f'This is a video called "{summary["title"]}". {summary["summary"]}.'
-    full_translation = []
     if target_language == '简体中文':
         fixed_message = [
             {'role': 'system', 'content': f'You are an expert in the field of this video.\n{info}\nTranslate the sentence into {target_language}. 下面我让你来充当翻译家，你的目标是把任何语言翻译成{target_language}，请翻译时不要带翻译腔，而是要翻译得自然、流畅和地道，使用优美和高雅的表达方式。请将人工智能的“agent”翻译为“智能体”，强化学习中是`Q-Learning`而不是`Queue Learning`。数学公式写成plain text，不要使用latex。确保翻译正确和简洁。注意信达雅。'},
@@ -227,6 +458,8 @@ def _translate(summary, transcript, target_language='简体中文', method='LLM'
             {'role': 'user', 'content': f'使用地道的{target_language}Translate:"To be or not to be, that is the question."'},
             {'role': 'assistant', 'content': '翻译：“生存还是毁灭，这是一个值得考虑的问题。”'},
         ]
+        examples = [('Knowledge is power.', '知识就是力量。'),
+                    ('To be or not to be, that is the question.', '生存还是毁灭，这是一个值得考虑的问题。')]
     else:
         # For other languages, we keep the template general
         fixed_message = [
@@ -236,54 +469,46 @@ def _translate(summary, transcript, target_language='简体中文', method='LLM'
             {'role': 'user', 'content': 'Translate the following text: "Another Original Text"'},
             {'role': 'assistant', 'content': 'Translated text: "Another Translated Text"'},
         ]
+        examples = [('Original Text', 'Translated Text'), ('Another Original Text', 'Another Translated Text')]
 
-    history = []
-    
-    for line in transcript:
-        text = line['text']
-
-        retry_message = 'Only translate the quoted sentence and give me the final translation.'
-        if method == 'Google Translate':
-            translation = translator_response(text, to_language = target_language, translator_server='google')
-        elif method == 'Bing Translate':
-            translation = translator_response(text, to_language = target_language, translator_server='bing')
-        else:
-            for retry in range(10):
-                messages = fixed_message + \
-                    history[-30:] + [{'role': 'user',
-                                    'content': f'Translate:"{text}"'}]
-                # print(messages)
-                try:
-                    if method == 'LLM':
-                        response = llm_response(messages)
-                    elif method == 'OpenAI':
-                        response = openai_response(messages)
-                    elif method == 'Ernie':
-                        system_content = messages[0]['content']
-                        user_messages = messages[1:]
-                        response = ernie_response(user_messages, system=system_content)
-                    else:
-                        raise Exception('Invalid method')
-                    translation = response.replace('\n', '')
-                    logger.info(f'原文：{text}')
-                    logger.info(f'译文：{translation}')
-                    success, translation = valid_translation(text, translation)
-                    if not success:
-                        retry_message += translation
-                        raise Exception('Invalid translation')
-                    break
-                except Exception as e:
-                    logger.error(e)
-                    logger.warning('翻译失败')
-                    time.sleep(1)
-        full_translation.append(translation)
-        history.append({'role': 'user', 'content': f'Translate:"{text}"'})
-        history.append({'role': 'assistant', 'content': f'翻译：“{translation}”'})
-        time.sleep(0.1)
-        
-    return full_translation
+    texts = [line['text'] for line in transcript]
+    memory = get_translation_memory()
+    if memory is None:
+        return _translate_uncached(fixed_message, examples, texts, target_language, method, batch_size, concurrency)
+
+    # Only lines the memory has not seen go to the backend, with their cached neighbours as context
+    model = _model_name(method)
+    translations = memory.get_many(texts, target_language, method, model)
+    missing = [i for i, translation in enumerate(translations) if translation is None]
+    if missing:
+        translations = _translate_uncached(fixed_message, examples, texts, target_language, method, batch_size,
+                                           concurrency, translations)
+        memory.put_many([texts[i] for i in missing], [translations[i] for i in missing], target_language, method,
+                        model)
+    stats = memory.stats()
+    logger.info(f'Translation memory: {len(texts) - len(missing)}/{len(texts)} lines reused, '
+                f'hit rate {stats["hit_rate"]:.1%} this session, {stats["entries"]} entries')
+    return translations
 
-def translate(method, folder, target_language='简体中文'):
+def _translate_uncached(fixed_message, examples, texts, target_language, method, batch_size, concurrency,
+                        translations=None):
+    """
+    Translate the lines of texts whose entry in translations is None, all of them by default. The
+    known translations stay as they are and serve as context for the others.
+    """
+    translations = list(translations) if translations is not None else [None] * len(texts)
+    if method in ['Google Translate', 'Bing Translate'] and concurrency <= 1:
+        for i, text in enumerate(texts):
+            if translations[i] is not None:
+                continue
+            server = 'google' if method == 'Google Translate' else 'bing'
+            translations[i] = translator_response(text, to_language = target_language, translator_server=server)
+            time.sleep(0.1)
+        return translations
+    return asyncio.run(_translate_async(fixed_message, examples, texts, target_language, method, batch_size, concurrency,
+                                        translations))
+
+def translate(method, folder, target_language='简体中文', batch_size=1, concurrency=1):
     if os.path.exists(os.path.join(folder, 'translation.json')):
         logger.info(f'Translation already exists in {folder}')
         return True
@@ -318,7 +543,7 @@ def translate(method, folder, target_language='简体中文'):
             json.dump(summary, f, indent=2, ensure_ascii=False)
 
     translation_path = os.path.join(folder, 'translation.json')
-    translation = _translate(summary, transcript, target_language, method)
+    translation = _translate(summary, transcript, target_language, method, batch_size, concurrency)
     for i, line in enumerate(transcript):
         line['translation'] = translation[i]
     transcript = split_sentences(transcript)
@@ -326,12 +551,22 @@ def translate(method, folder, target_language='简体中文'):
         json.dump(transcript, f, indent=2, ensure_ascii=False)
     return summary, transcript
 
-def translate_all_transcript_under_folder(folder, method, target_language):
+def translate_all_transcript_under_folder(folder, method, target_language, batch_size=1, concurrency=1):
     summary_json , translate_json = None, None
-    for root, dirs, files in os.walk(folder):
-        if 'transcript.json' in files and 'translation.json' not in files:
-            summary_json , translate_json = translate(method, root, target_language)
-        elif 'translation.json' in files:
+    for root in list_video_folders(folder):
+        if not os.path.exists(os.path.join(root, 'transcript.json')):
+            continue
+        manifest = Manifest(root)
+        params = {'method': method, 'target_language': target_language, 'model_name': os.getenv('MODEL_NAME')}
+        if batch_size > 1:
+            params['batch_size'] = batch_size
+        if concurrency > 1:
+            params['concurrency'] = concurrency
+        outputs = ['translation.json', 'summary.json']
+        if manifest.needs_run('translation', ['transcript.json'], params, outputs):
+            summary_json , translate_json = translate(method, root, target_language, batch_size, concurrency)
+            manifest.record('translation', ['transcript.json'], params, outputs)
+        else:
             summary_json = json.load(open(os.path.join(root, 'summary.json'), 'r', encoding='utf-8'))
             translate_json = json.load(open(os.path.join(root, 'translation.json'), 'r', encoding='utf-8'))
     print(summary_json, translate_json)
@@ -8,14 +8,20 @@ extra_body = {
     'repetition_penalty': 1.1,
 }
 model_name = os.getenv('MODEL_NAME', 'gpt-3.5-turbo')
+if 'gpt' not in model_name:
+    model_name = 'gpt-3.5-turbo'
+base_url = os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
+client = None
+
 def openai_response(messages):
-    client = OpenAI(
-        # This is the default and can be omitted
-        base_url=os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1'),
-        api_key=os.getenv('OPENAI_API_KEY')
-    )
-    if 'gpt' not in model_name:
-        model_name = 'gpt-3.5-turbo'
+    global client
+    # One client for the whole run so its connection pool is reused
+    if client is None:
+        client = OpenAI(
+            # This is the default and can be omitted
+            base_url=base_url,
+            api_key=os.getenv('OPENAI_API_KEY')
+        )
     response = client.chat.completions.create(
         model=model_name,
         messages=messages,
@@ -24,6 +30,17 @@ def openai_response(messages):
     )
     return response.choices[0].message.content
 
+def openai_request(session, messages, timeout=240):
+    """Same request as openai_response, sent with a requests.Session so callers control the pooling."""
+    response = session.post(
+        f'{base_url.rstrip("/")}/chat/completions',
+        headers={'Authorization': f'Bearer {os.getenv("OPENAI_API_KEY")}'},
+        json={'model': model_name, 'messages': messages, **extra_body},
+        timeout=timeout,
+    )
+    response.raise_for_status()
+    return response.json()['choices'][0]['message']['content']
+
 if __name__ == '__main__':
     test_message = [{"role": "user", "content": "你好，介绍一下你自己"}]
     response = openai_response(test_message)
@@ -11,51 +11,190 @@ load_dotenv()
 
 model = None
 tokenizer = None
+session = None
 model_name = os.getenv('MODEL_NAME', 'qwen/Qwen1.5-4B-Chat')
 if 'Qwen' not in model_name:
     model_name = 'qwen/Qwen1.5-4B-Chat'
 
 def init_llm_model(model_name):
-    global model, tokenizer
+    global model, tokenizer, session
     if 'Qwen' in model_name:
         from transformers import AutoModelForCausalLM, AutoTokenizer
         model_path = os.path.join('models/LLM', os.path.basename(model_name))
         pretrained_path = model_name if not os.path.isdir(model_path) else model_path
-        
+
         model = AutoModelForCausalLM.from_pretrained(
             pretrained_path,
             torch_dtype="auto",
             device_map="auto"
         )
         tokenizer = AutoTokenizer.from_pretrained(pretrained_path)
+        session = LLMSession(model, tokenizer)
         print('Finish Load model', pretrained_path)
 
-def llm_response(messages, device='auto'):
-    if model is None:
-        init_llm_model(model_name)
-    if 'Qwen' in model_name:
-        text = tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True
+def _common_prefix(a, b):
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
+
+def _crop_cache(cache, length):
+    if hasattr(cache, 'crop'):
+        # A negative argument drops that many tokens from the end
+        if cache.get_seq_length() > length:
+            cache.crop(length - cache.get_seq_length())
+        return
+    # Older DynamicCache without crop()
+    for i in range(len(cache.key_cache)):
+        cache.key_cache[i] = cache.key_cache[i][..., :length, :]
+        cache.value_cache[i] = cache.value_cache[i][..., :length, :]
+    cache._seen_tokens = length
+
+def _repeat_cache(cache, repeats):
+    if hasattr(cache, 'batch_repeat_interleave'):
+        cache.batch_repeat_interleave(repeats)
+        return
+    for i in range(len(cache.key_cache)):
+        cache.key_cache[i] = cache.key_cache[i].repeat_interleave(repeats, dim=0)
+        cache.value_cache[i] = cache.value_cache[i].repeat_interleave(repeats, dim=0)
+
+def _count_numbered(content):
+    """Number of lines in the trailing {"1": ..., "2": ...} object of a batched request, 1 for a plain line."""
+    start = content.rfind('{"1": ')
+    while start >= 0:
+        try:
+            numbered, _ = json.JSONDecoder().raw_decode(content, start)
+            return max(1, len(numbered))
+        except json.JSONDecodeError:
+            # An opening inside one of the lines, the object starts further left
+            start = content.rfind('{"1": ', 0, start)
+    return 1
+
+class LLMSession:
+    """
+    Chat with the local model that keeps the KV cache of the previous prompt and response. A call
+    only prefills the tokens after the longest prefix it shares with the previous one, which for
+    translation is the system prompt, the few-shot examples and most of the history.
+
+    max_new_tokens defaults to a bound derived from the length of the last message, capped at 512
+    per line to translate, so a runaway answer to a short line stops early while a numbered batch of
+    lines still has room for all of them. Token counts and throughput are logged per
+    call and accumulated in `stats`.
+    """
+    def __init__(self, model, tokenizer, device=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device or model.device
+        self.cache = None
+        self.ids = []
+        self.stats = {'calls': 0, 'reused_tokens': 0, 'prefill_tokens': 0, 'generated_tokens': 0, 'seconds': 0.0}
+
+    def reset(self):
+        self.cache = None
+        self.ids = []
+
+    def _encode(self, messages):
+        text = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        return self.tokenizer(text).input_ids
+
+    def _max_new_tokens(self, messages, max_new_tokens):
+        if max_new_tokens is not None:
+            return max_new_tokens
+        content = messages[-1]['content']
+        return min(512 * _count_numbered(content), 64 + 3 * len(self.tokenizer(content).input_ids))
+
+    def _record(self, reused, prefilled, generated, seconds, batch_size=1):
+        for key, value in [('calls', 1), ('reused_tokens', reused), ('prefill_tokens', prefilled),
+                           ('generated_tokens', generated), ('seconds', seconds)]:
+            self.stats[key] += value
+        logger.info(f'LLM: batch of {batch_size}, {reused} prompt tokens reused, {prefilled} prefilled, '
+                    f'{generated} generated in {seconds:.2f}s ({generated / max(seconds, 1e-6):.1f} tokens/s)')
+
+    @torch.no_grad()
+    def response(self, messages, max_new_tokens=None):
+        from transformers import DynamicCache
+        ids = self._encode(messages)
+        # At least the last prompt token has to go through the model to get the first logits
+        reused = min(_common_prefix(self.ids, ids), len(ids) - 1) if self.cache is not None else 0
+        if reused == 0:
+            self.cache = DynamicCache()
+        else:
+            _crop_cache(self.cache, reused)
+        begin = time.time()
+        input_ids = torch.tensor([ids], device=self.device)
+        output_ids = self.model.generate(
+            input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            past_key_values=self.cache,
+            max_new_tokens=self._max_new_tokens(messages, max_new_tokens),
         )
-        if device == 'auto':
-            device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        model_inputs = tokenizer([text], return_tensors="pt").to(device)
+        seconds = time.time() - begin
+        # The cache holds every token fed to the model, which is all but the last generated one
+        self.ids = output_ids[0, :self.cache.get_seq_length()].tolist()
+        generated_ids = output_ids[0, len(ids):]
+        self._record(reused, len(ids) - reused, len(generated_ids), seconds)
+        return self.tokenizer.decode(generated_ids, skip_special_tokens=True)
 
-        generated_ids = model.generate(
-            model_inputs.input_ids,
-            max_new_tokens=512
+    @torch.no_grad()
+    def batch_response(self, messages_list, max_new_tokens=None):
+        """
+        Answer independent chats in one batch. The prefix all prompts share is prefilled once and
+        its cache repeated over the batch; the rest of each prompt is padded on its left, between
+        the shared prefix and itself, so generation starts at the same position for every row.
+        """
+        from transformers import DynamicCache
+        encoded = [self._encode(messages) for messages in messages_list]
+        prefix = min(len(ids) for ids in encoded) - 1
+        for ids in encoded[1:]:
+            prefix = min(prefix, _common_prefix(encoded[0], ids))
+        begin = time.time()
+        cache = DynamicCache()
+        if prefix > 0:
+            self.model(input_ids=torch.tensor([encoded[0][:prefix]], device=self.device), past_key_values=cache,
+                       use_cache=True)
+            _repeat_cache(cache, len(encoded))
+
+        pad_token_id = self.tokenizer.pad_token_id
+        if pad_token_id is None:
+            pad_token_id = self.tokenizer.eos_token_id
+        suffix_length = max(len(ids) for ids in encoded) - prefix
+        input_ids = torch.full((len(encoded), prefix + suffix_length), pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros_like(input_ids)
+        for i, ids in enumerate(encoded):
+            input_ids[i, :prefix] = torch.tensor(ids[:prefix])
+            input_ids[i, -(len(ids) - prefix):] = torch.tensor(ids[prefix:])
+            attention_mask[i, :prefix] = 1
+            attention_mask[i, -(len(ids) - prefix):] = 1
+        output_ids = self.model.generate(
+            input_ids.to(self.device),
+            attention_mask=attention_mask.to(self.device),
+            past_key_values=cache,
+            max_new_tokens=max(self._max_new_tokens(messages, max_new_tokens) for messages in messages_list),
+            pad_token_id=pad_token_id,
         )
-        generated_ids = [
-            output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
-        ]
+        seconds = time.time() - begin
+        generated_ids = output_ids[:, input_ids.shape[1]:]
+        responses = self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)
+        generated = int((generated_ids != pad_token_id).sum())
+        self._record(prefix, sum(len(ids) - prefix for ids in encoded), generated, seconds, len(encoded))
+        return responses
 
-        response = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
-        return response
+def llm_response(messages, device='auto', max_new_tokens=None):
+    if model is None:
+        init_llm_model(model_name)
+    if 'Qwen' in model_name:
+        return session.response(messages, max_new_tokens)
     return ''
 
+def llm_batch_response(messages_list, device='auto', max_new_tokens=None):
+    if model is None:
+        init_llm_model(model_name)
+    if 'Qwen' in model_name:
+        return session.batch_response(messages_list, max_new_tokens)
+    return [''] * len(messages_list)
+
 if __name__ == '__main__':
     test_message = [{"role": "user", "content": "你好，介绍一下你自己"}]
     response = llm_response(test_message)
-    print(response)
\ No newline at end of file
+    print(response)
@@ -6,15 +6,18 @@ from dotenv import load_dotenv
 from loguru import logger
 load_dotenv()
 
-def translator_response(messages, to_language = 'zh-CN', translator_server = 'bing'):
+def translate_text(text, to_language = 'zh-CN', translator_server = 'bing'):
     if '中文' in to_language:
         to_language = 'zh-CN'
     elif 'English' in to_language:
         to_language = 'en'
+    return ts.translate_text(query_text=text, translator=translator_server, from_language='auto', to_language=to_language)
+
+def translator_response(messages, to_language = 'zh-CN', translator_server = 'bing'):
     translation = ''
     for retry in range(3):
         try:
-            translation = ts.translate_text(query_text=messages, translator=translator_server, from_language='auto', to_language=to_language)
+            translation = translate_text(messages, to_language, translator_server)
             break
         except Exception as e:
             logger.info(f'translate failed! {e}')
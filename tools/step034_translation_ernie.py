@@ -6,17 +6,21 @@ from loguru import logger
 load_dotenv()
 
 access_token = None
+base_url = os.getenv('BAIDU_API_BASE', 'https://aip.baidubce.com')
+# model_name = 'yi_34b_chat'
+model_name = 'ernie-speed-128k'
+session = requests.Session()
 
-def get_access_token(api_key, secret_key):
+def get_access_token(api_key, secret_key, session=session):
     """
     使用 API Key 和 Secret Key 获取access_token。
     :param api_key: 应用的API Key
     :param secret_key: 应用的Secret Key
     :return: access_token
     """
-    url = f"https://aip.baidubce.com/oauth/2.0/token?grant_type=client_credentials&client_id={api_key}&client_secret={secret_key}"
+    url = f"{base_url}/oauth/2.0/token?grant_type=client_credentials&client_id={api_key}&client_secret={secret_key}"
     
-    response = requests.post(url, headers={'Content-Type': 'application/json'})
+    response = session.post(url, headers={'Content-Type': 'application/json'})
     if response.status_code == 200:
         logger.info("成功获取 access_token")
         return response.json().get("access_token")
@@ -24,15 +28,13 @@ def get_access_token(api_key, secret_key):
         logger.error("获取 access_token 失败")
         raise Exception("获取 access_token 失败")
 
-def ernie_response(messages, system=''):
+def ernie_response(messages, system='', session=session, timeout=240):
     global access_token
     api_key = os.getenv('BAIDU_API_KEY')
     secret_key = os.getenv('BAIDU_SECRET_KEY')
     if access_token is None:
-        access_token = get_access_token(api_key, secret_key)
-    model_name = 'yi_34b_chat'
-    model_name = 'ernie-speed-128k'
-    url = f"https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/{model_name}?access_token=" + access_token
+        access_token = get_access_token(api_key, secret_key, session)
+    url = f"{base_url}/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/{model_name}?access_token=" + access_token
     payload = json.dumps({
         "messages": messages,
         "system": system
@@ -40,13 +42,14 @@ def ernie_response(messages, system=''):
     headers = {
         'Content-Type': 'application/json'
     }
-    response = requests.post(url, headers=headers, data=payload)
+    response = session.post(url, headers=headers, data=payload, timeout=timeout)
         
     if response.status_code == 200:
         response_json = response.json()
         return response_json.get('result')
     else:
         logger.error(f"请求百度API失败，状态码：{response.status_code}")
+        response.raise_for_status()
         raise Exception("请求百度API失败")
 
 if __name__ == '__main__':
@@ -1,18 +1,25 @@
+import collections
+import contextlib
 import json
 import os
+import queue
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import librosa
 
 from loguru import logger
 import numpy as np
 
-from .utils import save_wav, save_wav_norm
+from .utils import save_wav, WavWriter
+from .manifest import Manifest, list_video_folders
+from .audio_cache import clear_cache, load_audio
 # from .step041_tts_bytedance import tts as bytedance_tts
-from .step042_tts_xtts import tts as xtts_tts
+from .step042_tts_xtts import tts as xtts_tts, tts_batch as xtts_tts_batch
 from .step043_tts_cosyvoice import tts as cosyvoice_tts
-from .step044_tts_edge_tts import tts as edge_tts
+from .step044_tts_edge_tts import tts as edge_tts, tts_batch as edge_tts_batch
 from .cn_tx import TextNorm
-from audiostretchy.stretch import stretch_audio
+from .time_stretch import stretch_batch
 normalizer = TextNorm()
 def preprocess_text(text):
     text = text.replace('AI', '人工智能')
@@ -23,25 +30,53 @@ def preprocess_text(text):
     return text
     
     
-def adjust_audio_length(wav_path, desired_length, sample_rate = 24000, min_speed_factor = 0.6, max_speed_factor = 1.1):
+def load_tts_wav(wav_path, sample_rate = 24000):
     try:
         wav, sample_rate = librosa.load(wav_path, sr=sample_rate)
     except Exception as e:
         if wav_path.endswith('.wav'):
             wav_path = wav_path.replace('.wav', '.mp3')
         wav, sample_rate = librosa.load(wav_path, sr=sample_rate)
-    current_length = len(wav)/sample_rate
+    return wav
+
+
+def fit_speed_factor(current_length, desired_length, min_speed_factor = 0.6, max_speed_factor = 1.1):
     speed_factor = max(
         min(desired_length / current_length, max_speed_factor), min_speed_factor)
-    logger.info(f"Speed Factor {speed_factor}")
-    desired_length = current_length * speed_factor
-    if wav_path.endswith('.wav'):
-        target_path = wav_path.replace('.wav', f'_adjusted.wav')
-    elif wav_path.endswith('.mp3'):
-        target_path = wav_path.replace('.mp3', f'_adjusted.wav')
-    stretch_audio(wav_path, target_path, ratio=speed_factor, sample_rate=sample_rate)
-    wav, sample_rate = librosa.load(target_path, sr=sample_rate)
-    return wav[:int(desired_length*sample_rate)], desired_length
+    return speed_factor
+
+
+def adjust_audio_lengths(wavs, desired_lengths, sample_rate = 24000, min_speed_factor = 0.6, max_speed_factor = 1.1):
+    """
+    Time-stretch each synthesized wav towards its desired length in seconds, with the speed factor
+    clamped to [min_speed_factor, max_speed_factor]. All wavs are stretched in memory in one batch.
+    Returns the fitted wavs and their lengths in seconds.
+    """
+    speed_factors = [fit_speed_factor(len(wav) / sample_rate, desired_length, min_speed_factor, max_speed_factor)
+                     for wav, desired_length in zip(wavs, desired_lengths)]
+    lengths = [len(wav) / sample_rate * speed_factor for wav, speed_factor in zip(wavs, speed_factors)]
+    stretched = stretch_batch(wavs, speed_factors, sample_rate)
+    return [wav[:int(length * sample_rate)] for wav, length in zip(stretched, lengths)], lengths
+
+
+def adjust_audio_length(wav, desired_length, sample_rate = 24000, min_speed_factor = 0.6, max_speed_factor = 1.1):
+    wavs, lengths = adjust_audio_lengths([wav], [desired_length], sample_rate, min_speed_factor, max_speed_factor)
+    return wavs[0], lengths[0]
+
+def peak(wav, chunk_size = 1 << 20):
+    # Chunked so memory-mapped tracks are not read into one temporary
+    return max((float(np.max(np.abs(wav[i:i + chunk_size]))) for i in range(0, len(wav), chunk_size)), default=0)
+
+
+def mix_chunks(*wavs, chunk_size = 1 << 20):
+    # Sum of the wavs chunk by chunk, the shorter ones padded with silence
+    length = max(len(wav) for wav in wavs)
+    for i in range(0, length, chunk_size):
+        chunk = np.zeros(min(chunk_size, length - i), dtype=np.float32)
+        for wav in wavs:
+            part = wav[i:i + chunk_size]
+            chunk[:len(part)] += part
+        yield chunk
 
 tts_support_languages = {
     # XTTS-v2 supports 17 languages: English (en), Spanish (es), French (fr), German (de), Italian (it), Portuguese (pt), Polish (pl), Turkish (tr), Russian (ru), Dutch (nl), Czech (cs), Arabic (ar), Chinese (zh-cn), Japanese (ja), Hungarian (hu), Korean (ko) Hindi (hi).
@@ -53,7 +88,93 @@ tts_support_languages = {
     'cosyvoice': ['中文', '粤语', 'English', 'Japanese', 'Korean', 'French'], 
 }
 
-def generate_wavs(method, folder, target_language='中文', voice = 'zh-CN-XiaoxiaoNeural'):
+def synthesize_lines(method, folder, transcript, target_language='中文', voice = 'zh-CN-XiaoxiaoNeural', window = 32):
+    """
+    Synthesize the lines of transcript in order, `window` lines at a time, and yield the indices of
+    every window once its wavs are on disk. xtts batches the lines of a window per speaker, EdgeTTS
+    sends them concurrently, the other methods go line by line and yield each line on its own.
+    """
+    output_folder = os.path.join(folder, 'wavs')
+    step = window if method in ['xtts', 'EdgeTTS'] else 1
+    for begin in range(0, len(transcript), step):
+        indices = list(range(begin, min(begin + step, len(transcript))))
+        texts = {i: preprocess_text(transcript[i]['translation']) for i in indices}
+        output_paths = {i: os.path.join(output_folder, f'{str(i).zfill(4)}.wav') for i in indices}
+        if method == 'xtts':
+            lines_by_speaker = {}
+            for i in indices:
+                lines_by_speaker.setdefault(transcript[i]['speaker'], []).append(i)
+            for speaker, speaker_indices in lines_by_speaker.items():
+                xtts_tts_batch([texts[i] for i in speaker_indices], [output_paths[i] for i in speaker_indices],
+                               os.path.join(folder, 'SPEAKER', f'{speaker}.wav'), target_language = target_language)
+        elif method == 'EdgeTTS':
+            try:
+                edge_tts_batch([texts[i] for i in indices], [output_paths[i] for i in indices],
+                               target_language = target_language, voice = voice)
+            except Exception as e:
+                # the lines that still failed are retried one by one below
+                logger.warning(e)
+        for i in indices:
+            # Lines a batch could not synthesize get another try on their own, existing files are skipped
+            speaker_wav = os.path.join(folder, 'SPEAKER', f'{transcript[i]["speaker"]}.wav')
+            if method == 'bytedance':
+                bytedance_tts(texts[i], output_paths[i], speaker_wav, target_language = target_language)
+            elif method == 'xtts':
+                xtts_tts(texts[i], output_paths[i], speaker_wav, target_language = target_language)
+            elif method == 'cosyvoice':
+                cosyvoice_tts(texts[i], output_paths[i], speaker_wav, target_language = target_language)
+            elif method == 'EdgeTTS':
+                edge_tts(texts[i], output_paths[i], target_language = target_language, voice = voice)
+        yield indices
+
+
+def in_background(iterable, queue_size = 2):
+    # Runs the iterable on its own thread, at most queue_size items ahead of the consumer. Closing the
+    # returned generator, or the consumer failing, stops the thread and closes the iterable there.
+    items = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put(item):
+                    break
+            else:
+                put(done)
+        except Exception as e:
+            put(e)
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # waits for the window being synthesized, so a retry never shares the model with this thread
+        thread.join()
+
+
+def generate_wavs(method, folder, target_language='中文', voice = 'zh-CN-XiaoxiaoNeural', fit_workers = 2):
     assert method in ['xtts', 'bytedance', 'cosyvoice', 'EdgeTTS']
     transcript_path = os.path.join(folder, 'translation.json')
     output_folder = os.path.join(folder, 'wavs')
@@ -71,73 +192,97 @@ def generate_wavs(method, folder, target_language='中文', voice = 'zh-CN-Xiaox
     if target_language not in tts_support_languages[method]:
         logger.error(f'{method} does not support {target_language}')
         return f'{method} does not support {target_language}'
-        
-    full_wav = np.zeros((0, ))
-    for i, line in enumerate(transcript):
-        speaker = line['speaker']
-        text = preprocess_text(line['translation'])
-        output_path = os.path.join(output_folder, f'{str(i).zfill(4)}.wav')
-        speaker_wav = os.path.join(folder, 'SPEAKER', f'{speaker}.wav')
-        # if num_speakers == 1:
-            # bytedance_tts(text, output_path, speaker_wav, voice_type='BV701_streaming')
-        
-        if method == 'bytedance':
-            bytedance_tts(text, output_path, speaker_wav, target_language = target_language)
-        elif method == 'xtts':
-            xtts_tts(text, output_path, speaker_wav, target_language = target_language)
-        elif method == 'cosyvoice':
-            cosyvoice_tts(text, output_path, speaker_wav, target_language = target_language)
-        elif method == 'EdgeTTS':
-            edge_tts(text, output_path, target_language = target_language, voice = voice)
-        start = line['start']
-        end = line['end']
-        length = end-start
-        last_end = len(full_wav)/24000
-        if start > last_end:
-            full_wav = np.concatenate((full_wav, np.zeros((int((start - last_end) * 24000), ))))
-        start = len(full_wav)/24000
-        line['start'] = start
-        if i < len(transcript) - 1:
-            next_line = transcript[i+1]
-            next_end = next_line['end']
-            end = min(start + length, next_end)
-        wav, length = adjust_audio_length(output_path, end-start)
-
-        full_wav = np.concatenate((full_wav, wav))
-        line['end'] = start + length
-        
-    vocal_wav, sr = librosa.load(os.path.join(folder, 'audio_vocals.wav'), sr=24000)
-    full_wav = full_wav / np.max(np.abs(full_wav)) * np.max(np.abs(vocal_wav))
+
+    # Three stages overlap: TTS runs on its own thread window by window, every window is laid out
+    # here as soon as it arrives and stretched on the fitting pool, and the fitted sentences are
+    # placed on the timeline in order as their stretches finish. Laying out a line only needs the
+    # lengths the speed factors give the lines before it, not their stretched audio.
+    # The timeline buffer starts at the length of the transcript and grows when the layout outruns it.
+    timeline = np.zeros(int(transcript[-1]['end'] * 24000) if transcript else 0, dtype=np.float32)
+    pending = collections.deque()
+    timeline_end = 0
+
+    def place(block):
+        while pending and (block or pending[0][1].done()):
+            layout, future = pending.popleft()
+            for (offset, size), wav in zip(layout, future.result()[0]):
+                wav = wav[:size]
+                timeline[offset:offset + len(wav)] = wav
+
+    windows = in_background(synthesize_lines(method, folder, transcript, target_language, voice))
+    with ThreadPoolExecutor(max_workers=fit_workers) as fit_pool, contextlib.closing(windows):
+        for indices in windows:
+            wavs, desired_lengths, layout = [], [], []
+            for i in indices:
+                line = transcript[i]
+                output_path = os.path.join(output_folder, f'{str(i).zfill(4)}.wav')
+                start = line['start']
+                end = line['end']
+                length = end-start
+                last_end = timeline_end/24000
+                gap = int((start - last_end) * 24000) if start > last_end else 0
+                timeline_end += gap
+                offset = timeline_end
+                start = timeline_end/24000
+                line['start'] = start
+                if i < len(transcript) - 1:
+                    next_line = transcript[i+1]
+                    next_end = next_line['end']
+                    end = min(start + length, next_end)
+                wav = load_tts_wav(output_path)
+                speed_factor = fit_speed_factor(len(wav)/24000, end-start)
+                logger.info(f"Speed Factor {speed_factor}")
+                length = len(wav)/24000 * speed_factor
+                timeline_end += int(length*24000)
+                wavs.append(wav)
+                desired_lengths.append(end-start)
+                layout.append((offset, timeline_end - offset))
+                line['end'] = start + length
+            if timeline_end > len(timeline):
+                grown = np.zeros(max(timeline_end, len(timeline) * 5 // 4), dtype=np.float32)
+                grown[:len(timeline)] = timeline
+                timeline = grown
+            pending.append((layout, fit_pool.submit(adjust_audio_lengths, wavs, desired_lengths)))
+            place(block=False)
+        place(block=True)
+    full_wav = timeline[:timeline_end]
+
+    vocal_wav, sr = load_audio(os.path.join(folder, 'audio_vocals.wav'), sr=24000)
+    full_wav *= peak(vocal_wav) / peak(full_wav)
     save_wav(full_wav, os.path.join(folder, 'audio_tts.wav'))
     with open(transcript_path, 'w', encoding='utf-8') as f:
         json.dump(transcript, f, indent=2, ensure_ascii=False)
     
-    instruments_wav, sr = librosa.load(os.path.join(folder, 'audio_instruments.wav'), sr=24000)
-    len_full_wav = len(full_wav)
-    len_instruments_wav = len(instruments_wav)
-    
-    if len_full_wav > len_instruments_wav:
-        # 如果 full_wav 更长，将 instruments_wav 延伸到相同长度
-        instruments_wav = np.pad(
-            instruments_wav, (0, len_full_wav - len_instruments_wav), mode='constant')
-    elif len_instruments_wav > len_full_wav:
-        # 如果 instruments_wav 更长，将 full_wav 延伸到相同长度
-        full_wav = np.pad(
-            full_wav, (0, len_instruments_wav - len_full_wav), mode='constant')
-    combined_wav = full_wav + instruments_wav
-    # combined_wav /= np.max(np.abs(combined_wav))
-    save_wav_norm(combined_wav, os.path.join(folder, 'audio_combined.wav'))
+    # The shorter of the two tracks is padded with silence, and the mix is normalized like save_wav_norm
+    instruments_wav, sr = load_audio(os.path.join(folder, 'audio_instruments.wav'), sr=24000)
+    combined_peak = max((peak(chunk) for chunk in mix_chunks(full_wav, instruments_wav)), default=0)
+    with WavWriter(os.path.join(folder, 'audio_combined.wav')) as writer:
+        for chunk in mix_chunks(full_wav, instruments_wav):
+            writer.write(chunk / max(0.01, combined_peak))
     logger.info(f'Generated {os.path.join(folder, "audio_combined.wav")}')
     return os.path.join(folder, 'audio_combined.wav'), os.path.join(folder, 'audio.wav')
 
 def generate_all_wavs_under_folder(root_folder, method, target_language='中文', voice = 'zh-CN-XiaoxiaoNeural'):
     wav_combined, wav_ori = None, None
-    for root, dirs, files in os.walk(root_folder):
-        if 'translation.json' in files and 'audio_combined.wav' not in files:
+    for root in list_video_folders(root_folder):
+        if not os.path.exists(os.path.join(root, 'translation.json')):
+            continue
+        manifest = Manifest(root)
+        inputs = ['translation.json', 'audio_instruments.wav']
+        params = {'method': method, 'target_language': target_language}
+        if method == 'EdgeTTS':
+            params['voice'] = voice
+        outputs = ['audio_combined.wav', 'audio_tts.wav']
+        if manifest.needs_run('tts', inputs, params, outputs, artifacts=['wavs']):
             wav_combined, wav_ori = generate_wavs(method, root, target_language, voice)
-        elif 'audio_combined.wav' in files:
+            if os.path.exists(os.path.join(root, 'audio_combined.wav')):
+                # translation.json gets rewritten with the fitted timings, record it afterwards
+                manifest.record('tts', inputs, params, outputs)
+        else:
             wav_combined, wav_ori = os.path.join(root, 'audio_combined.wav'), os.path.join(root, 'audio.wav')
             logger.info(f'Wavs already generated in {root}')
+        # TTS is the last step that reads the decoded audio of the video
+        clear_cache(root)
     return f'Generated all wavs under {root_folder}', wav_combined, wav_ori
 
 if __name__ == '__main__':
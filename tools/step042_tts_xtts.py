@@ -1,11 +1,17 @@
 import os
+from collections import OrderedDict
 from TTS.api import TTS
 from loguru import logger
 import numpy as np
 import torch
 import time
+from .manifest import hash_file
 from .utils import save_wav
 model = None
+LATENT_CACHE_DIR = '.latent_cache'
+# Latents of the most recently used speaker wavs, so a long run over many videos does not keep them all
+MAX_SPEAKER_LATENTS = 32
+_speaker_latents = OrderedDict()
 
 '''
 Supported languages: Arabic: ar, Brazilian Portuguese: pt , Mandarin Chinese: zh-cn, Czech: cs, Dutch: nl, English: en, French: fr, German: de, Italian: it, Polish: pl, Russian: ru, Spanish: es, Turkish: tr, Japanese: ja, Korean: ko, Hungarian: hu, Hindi: hi
@@ -55,6 +61,58 @@ language_map = {
     'Hindi': 'hi',
     'Korean': 'ko',
 }
+def _inference_settings(config):
+    return {
+        'temperature': config.temperature,
+        'length_penalty': config.length_penalty,
+        'repetition_penalty': config.repetition_penalty,
+        'top_k': config.top_k,
+        'top_p': config.top_p,
+    }
+
+def get_speaker_latents(speaker_wav):
+    """
+    Return the (gpt_cond_latent, speaker_embedding) of speaker_wav, cached on disk in a .latent_cache
+    folder next to it. The cache file is keyed on the hash of the audio and the cloning settings of
+    the model config, so it is rebuilt when either changes.
+    """
+    config = model.synthesizer.tts_config
+    cond_settings = (config.gpt_cond_len, config.gpt_cond_chunk_len, config.max_ref_len, config.sound_norm_refs)
+    stat = os.stat(speaker_wav)
+    memo_key = (os.path.abspath(speaker_wav), stat.st_size, stat.st_mtime_ns, cond_settings)
+    if memo_key in _speaker_latents:
+        _speaker_latents.move_to_end(memo_key)
+        return _speaker_latents[memo_key]
+
+    name = os.path.basename(speaker_wav)
+    key = hash_file(speaker_wav)[:16] + '-' + '-'.join(str(value) for value in cond_settings)
+    cache_folder = os.path.join(os.path.dirname(speaker_wav), LATENT_CACHE_DIR)
+    cache_path = os.path.join(cache_folder, f'{name}.{key}.pt')
+    if os.path.exists(cache_path):
+        latents = torch.load(cache_path, map_location='cpu')
+        gpt_cond_latent, speaker_embedding = latents['gpt_cond_latent'], latents['speaker_embedding']
+    else:
+        logger.info(f'Computing speaker latents of {speaker_wav}')
+        gpt_cond_latent, speaker_embedding = model.synthesizer.tts_model.get_conditioning_latents(
+            audio_path=speaker_wav,
+            gpt_cond_len=config.gpt_cond_len,
+            gpt_cond_chunk_len=config.gpt_cond_chunk_len,
+            max_ref_length=config.max_ref_len,
+            sound_norm_refs=config.sound_norm_refs,
+        )
+        gpt_cond_latent, speaker_embedding = gpt_cond_latent.cpu(), speaker_embedding.cpu()
+        os.makedirs(cache_folder, exist_ok=True)
+        for stale in os.listdir(cache_folder):
+            if stale.startswith(f'{name}.'):
+                os.remove(os.path.join(cache_folder, stale))
+        tmp_path = f'{cache_path}.tmp'
+        torch.save({'gpt_cond_latent': gpt_cond_latent, 'speaker_embedding': speaker_embedding}, tmp_path)
+        os.replace(tmp_path, cache_path)
+    _speaker_latents[memo_key] = gpt_cond_latent, speaker_embedding
+    while len(_speaker_latents) > MAX_SPEAKER_LATENTS:
+        _speaker_latents.popitem(last=False)
+    return gpt_cond_latent, speaker_embedding
+
 def tts(text, output_path, speaker_wav, model_name="models/TTS/XTTS-v2", device='auto', target_language='中文'):
     global model
     language = language_map[target_language]
@@ -66,17 +124,77 @@ def tts(text, output_path, speaker_wav, model_name="models/TTS/XTTS-v2", device=
     if model is None:
         load_model(model_name, device)
     
+    synthesizer = model.synthesizer
+    xtts = synthesizer.tts_model
+    settings = _inference_settings(synthesizer.tts_config)
     for retry in range(3):
         try:
-            wav = model.tts(text, speaker_wav=speaker_wav, language=language)
-            wav = np.array(wav)
-            save_wav(wav, output_path)
+            gpt_cond_latent, speaker_embedding = get_speaker_latents(speaker_wav)
+            wav = []
+            for sentence in synthesizer.split_into_sentences(text):
+                # Same 10000 samples of silence after each sentence as TTS.tts
+                wav += [xtts.inference(sentence, language, gpt_cond_latent, speaker_embedding, **settings)['wav'],
+                        np.zeros(10000)]
+            save_wav(np.concatenate(wav), output_path)
             logger.info(f'TTS {text}')
             break
         except Exception as e:
             logger.warning(f'TTS {text} 失败')
             logger.warning(e)
 
+def tts_batch(texts, output_paths, speaker_wav, model_name="models/TTS/XTTS-v2", device='auto', target_language='中文', batch_size=8):
+    """
+    Synthesize several lines of one speaker, writing the same files as calling tts() on each of them.
+    The sentences of all lines are sorted by length and generated batch_size at a time.
+    """
+    global model
+    language = language_map[target_language]
+    assert language in ['ar', 'pt', 'zh-cn', 'cs', 'nl', 'en', 'fr', 'de', 'it', 'pl', 'ru', 'es', 'tr', 'ja', 'ko', 'hu', 'hi']
+    todo = [(text, output_path) for text, output_path in zip(texts, output_paths) if not os.path.exists(output_path)]
+    if not todo:
+        return
+
+    if model is None:
+        load_model(model_name, device)
+    synthesizer = model.synthesizer
+    xtts = synthesizer.tts_model
+    settings = _inference_settings(synthesizer.tts_config)
+
+    t_start = time.time()
+    gpt_cond_latent, speaker_embedding = get_speaker_latents(speaker_wav)
+    splits = [synthesizer.split_into_sentences(text) for text, _ in todo]
+    sentences = [(i, j, sentence) for i, split in enumerate(splits) for j, sentence in enumerate(split)]
+    # Batching sentences of similar length keeps the padding in generate and the decoder small
+    sentences.sort(key=lambda item: len(item[2]))
+    outputs = {}
+    for start in range(0, len(sentences), batch_size):
+        batch = sentences[start:start + batch_size]
+        for retry in range(3):
+            try:
+                results = xtts.inference_batch(
+                    [sentence for _, _, sentence in batch], language, gpt_cond_latent, speaker_embedding, **settings)
+                break
+            except Exception as e:
+                logger.warning(f'TTS batch of {len(batch)} sentences 失败')
+                logger.warning(e)
+        else:
+            continue
+        for (i, j, _), result in zip(batch, results):
+            outputs[i, j] = result['wav']
+
+    for i, (text, output_path) in enumerate(todo):
+        if not splits[i] or any((i, j) not in outputs for j in range(len(splits[i]))):
+            logger.warning(f'TTS {text} 失败')
+            continue
+        wav = []
+        for j in range(len(splits[i])):
+            # Same 10000 samples of silence after each sentence as TTS.tts
+            wav += [outputs[i, j], np.zeros(10000)]
+        save_wav(np.concatenate(wav), output_path)
+        logger.info(f'TTS {text}')
+    elapsed = time.time() - t_start
+    logger.info(f'TTS {len(sentences)} sentences in {elapsed:.2f}s, {len(sentences) / elapsed:.2f} sentences/s')
+
 
 if __name__ == '__main__':
     speaker_wav = r'videos/村长台钓加拿大/20240805 英文无字幕 阿里这小子在水城威尼斯发来问候/audio_vocals.wav'
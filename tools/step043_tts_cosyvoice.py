@@ -4,11 +4,11 @@ import numpy as np
 import torch
 import time
 from .utils import save_wav
+from .audio_cache import load_audio
 import sys
 sys.path.append('CosyVoice/third_party/Matcha-TTS')
 sys.path.append('CosyVoice/')
 from cosyvoice.cli.cosyvoice import CosyVoice
-from cosyvoice.utils.file_utils import load_wav
 import torchaudio
 from modelscope import snapshot_download
 model = None
@@ -55,7 +55,7 @@ def tts(text, output_path, speaker_wav, model_name="models/TTS/CosyVoice-300M",
     
     for retry in range(3):
         try:
-            prompt_speech_16k = load_wav(speaker_wav, 16000)
+            prompt_speech_16k = torch.from_numpy(load_audio(speaker_wav, sr=16000)[0])[None]
             output = model.inference_cross_lingual(f'<|{language_map[target_language]}|>{text}', prompt_speech_16k)
             torchaudio.save(output_path, output['tts_speech'], 22050)
 
@@ -1,14 +1,8 @@
+import asyncio
 import os
+import random
 from loguru import logger
-import numpy as np
-import torch
-import time
-from .utils import save_wav
-import sys
-
-import torchaudio
-model = None
-
+import edge_tts
 
 
 #  <|zh|><|en|><|jp|><|yue|><|ko|> for Chinese/English/Japanese/Cantonese/Korean
@@ -20,18 +14,58 @@ language_map = {
     'Korean': 'ko-KR-SunHiNeural'
 }
 
+def _exists(output_path):
+    # Edge-TTS writes mp3, saved next to the .wav path the pipeline expects
+    return os.path.exists(output_path) or os.path.exists(output_path.replace('.wav', '.mp3'))
+
+async def _synthesize(text, output_path, voice, semaphore, max_retries):
+    mp3_path = output_path.replace('.wav', '.mp3')
+    for retry in range(max_retries):
+        async with semaphore:
+            try:
+                audio = bytearray()
+                async for chunk in edge_tts.Communicate(text, voice).stream():
+                    if chunk['type'] == 'audio':
+                        audio += chunk['data']
+                if not audio:
+                    raise Exception('No audio received')
+                # Written under a temporary name so an interrupted run never leaves a partial mp3 behind
+                with open(f'{mp3_path}.tmp', 'wb') as f:
+                    f.write(audio)
+                os.replace(f'{mp3_path}.tmp', mp3_path)
+                logger.info(f'TTS {text}')
+                return True
+            except Exception as e:
+                logger.warning(f'TTS {text} 失败')
+                logger.warning(e)
+        await asyncio.sleep(min(10, 2 ** retry) * random.uniform(0.5, 1))
+    return False
+
+async def tts_batch_async(texts, output_paths, voice='zh-CN-XiaoxiaoNeural', concurrency=8, max_retries=3):
+    """Synthesize texts concurrently, at most `concurrency` streams at a time. Returns the failed output paths."""
+    semaphore = asyncio.Semaphore(concurrency)
+    results = await asyncio.gather(*[_synthesize(text, output_path, voice, semaphore, max_retries)
+                                     for text, output_path in zip(texts, output_paths)])
+    return [output_path for output_path, success in zip(output_paths, results) if not success]
+
+def tts_batch(texts, output_paths, target_language='中文', voice='zh-CN-XiaoxiaoNeural', concurrency=8, max_retries=3):
+    """
+    Synthesize every text to its output path (as .mp3) in one event loop, skipping the ones already
+    on disk. Raises if any sentence still fails after max_retries.
+    """
+    todo = [(text, output_path) for text, output_path in zip(texts, output_paths) if not _exists(output_path)]
+    if not todo:
+        return
+    failed = asyncio.run(tts_batch_async([text for text, _ in todo], [output_path for _, output_path in todo],
+                                         voice, concurrency, max_retries))
+    if failed:
+        raise Exception(f'EdgeTTS 失败: {", ".join(failed)}')
+
 def tts(text, output_path, target_language='中文', voice = 'zh-CN-XiaoxiaoNeural'):
-    if os.path.exists(output_path):
+    if _exists(output_path):
         logger.info(f'TTS {text} 已存在')
         return
-    for retry in range(3):
-        try:
-            os.system(f'edge-tts --text "{text}" --write-media "{output_path.replace(".wav", ".mp3")}" --voice {voice}')
-            logger.info(f'TTS {text}')
-            break
-        except Exception as e:
-            logger.warning(f'TTS {text} 失败')
-            logger.warning(e)
+    tts_batch([text], [output_path], target_language, voice)
 
 
 if __name__ == '__main__':
@@ -39,4 +73,4 @@ if __name__ == '__main__':
     while True:
         text = input('请输入：')
         tts(text, f'playground/{text}.wav', target_language='中文')
-        
+
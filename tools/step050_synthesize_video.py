@@ -2,9 +2,12 @@
 import json
 import os
 import subprocess
+import tempfile
 import time
 
 from loguru import logger
+from .audio_cache import clear_cache
+from .manifest import Manifest, list_video_folders
 
 
 def split_text(input_data,
@@ -97,7 +100,66 @@ def convert_resolution(aspect_ratio, resolution='1080p'):
     # return f'{width}x{height}'
     return width, height
     
-def synthesize_video(folder, subtitles=True, speed_up=1.00, fps=30, resolution='1080p', background_music=None, watermark_path=None, bgm_volume=0.5, video_volume=1.0):
+def get_duration(video_path):
+    command = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'json', video_path]
+    result = subprocess.run(command, capture_output=True, text=True)
+    try:
+        return float(json.loads(result.stdout)['format']['duration'])
+    except (KeyError, ValueError):
+        return None
+
+
+def build_filter_graph(width, height, speed_up=1.00, watermark=False, subtitle_filter=None, background_music=False,
+                       bgm_volume=0.5, video_volume=1.0):
+    """
+    Filter graph of the whole render for the inputs [video, dubbed audio, (watermark), (background music)]:
+    speed change, watermark overlay, scaling and subtitle burn-in on the video, speed change and the
+    background music mix on the audio. Outputs [v] and [a].
+    """
+    video = [f"[0:v]setpts=PTS/{speed_up}[v0]"]
+    if watermark:
+        video.append("[2:v]scale=iw*0.15:ih*0.15[wm];[v0][wm]overlay=W-w-10:H-h-10[v0]")
+    scaled = f"[v0]scale={width}:{height}"
+    video.append(f"{scaled},{subtitle_filter}[v]" if subtitle_filter else f"{scaled}[v]")
+
+    if background_music:
+        bgm_input = 3 if watermark else 2
+        audio = [f"[1:a]atempo={speed_up},volume={video_volume}[a0]", f"[{bgm_input}:a]volume={bgm_volume}[a1]",
+                 "[a0][a1]amix=inputs=2:duration=first[a]"]
+    else:
+        audio = [f"[1:a]atempo={speed_up}[a]"]
+    return ';'.join(video + audio)
+
+
+def run_ffmpeg(command, duration=None, desc='ffmpeg'):
+    """
+    Run an ffmpeg command with -progress on stdout and log its progress every 10% of `duration`
+    seconds of output. Raises with the end of ffmpeg's error output if it fails.
+    """
+    command = command[:1] + ['-hide_banner', '-loglevel', 'error', '-nostats', '-progress', 'pipe:1'] + command[1:]
+    begin = time.time()
+    next_report = 0.1
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr, text=True)
+        for line in process.stdout:
+            key, _, value = line.strip().partition('=')
+            if key != 'out_time_us' or not duration or not value.isdigit():
+                continue
+            done = int(value) / 1e6 / duration
+            if done >= next_report:
+                elapsed = time.time() - begin
+                logger.info(f'{desc}: {min(done, 1):.0%}, {elapsed:.0f}s elapsed, {int(value) / 1e6 / elapsed:.2f}x realtime')
+                next_report = int(done * 10 + 1) / 10
+        process.wait()
+        if process.returncode != 0:
+            stderr.seek(0)
+            error = stderr.read().decode('utf-8', errors='replace')[-2000:]
+            raise subprocess.CalledProcessError(process.returncode, command, stderr=error)
+    logger.info(f'{desc}: done in {time.time() - begin:.1f}s')
+
+
+def synthesize_video(folder, subtitles=True, speed_up=1.00, fps=30, resolution='1080p', background_music=None, watermark_path=None, bgm_volume=0.5, video_volume=1.0,
+                     preset='medium', threads=0):
     # if os.path.exists(os.path.join(folder, 'video.mp4')):
     #     logger.info(f'Video already synthesized in {folder}')
     #     return
@@ -118,155 +180,71 @@ def synthesize_video(folder, subtitles=True, speed_up=1.00, fps=30, resolution='
     srt_path = srt_path.replace('\\', '/')
     aspect_ratio = get_aspect_ratio(input_video)
     width, height = convert_resolution(aspect_ratio, resolution)
-    resolution = f'{width}x{height}'
     font_size = int(width/128)
     outline = int(round(font_size/8))
-    video_speed_filter = f"setpts=PTS/{speed_up}"
-    audio_speed_filter = f"atempo={speed_up}"
     font_path = "./font/SimHei.ttf"
     subtitle_filter = f"subtitles={srt_path}:fontsdir={os.path.dirname(font_path)}:force_style='FontName=SimHei,FontSize={font_size},PrimaryColour=&HFFFFFF,OutlineColour=&H000000,Outline={outline},WrapStyle=2'"
     # subtitle_filter = f"subtitles={srt_path}:force_style='FontName=Arial,FontSize={font_size},PrimaryColour=&HFFFFFF,OutlineColour=&H000000,Outline={outline},WrapStyle=2'"
 
-    filter_complex = f"[0:v]{video_speed_filter}[v];[1:a]{audio_speed_filter}[a]"
-        
-    # Add watermark if specified
+    # One encode for everything: speed, watermark, scaling, subtitles and background music
+    inputs = ['-i', input_video, '-i', input_audio]
     if watermark_path:
-        watermark_filter = f";[2:v]scale=iw*0.15:ih*0.15[wm];[v][wm]overlay=W-w-10:H-h-10[v]"
-        ffmpeg_command = [
-            'ffmpeg',
-            '-i', input_video,
-            '-i', input_audio,
-            '-i', watermark_path,
-            '-filter_complex', filter_complex + watermark_filter,
-            '-map', '[v]',
-            '-map', '[a]',
-            '-r', str(fps),
-            '-s', resolution,
-            '-c:v', 'libx264',
-            '-c:a', 'aac',
-            final_video,
-            '-y',
-            '-threads', '2',
-        ]
-    else:
-        ffmpeg_command = [
-            'ffmpeg',
-            '-i', input_video,
-            '-i', input_audio,
-            '-filter_complex', filter_complex,
-            '-map', '[v]',
-            '-map', '[a]',
-            '-r', str(fps),
-            '-s', resolution,
-            '-c:v', 'libx264',
-            '-c:a', 'aac',
-            final_video,
-            '-y',
-            '-threads', '2',
-        ]
-    subprocess.run(ffmpeg_command)
-    time.sleep(1)
-
-    # Apply background music if specified
+        inputs += ['-i', watermark_path]
     if background_music:
-        final_video_with_bgm = final_video.replace('.mp4', '_bgm.mp4')
-        ffmpeg_command_bgm = [
-            'ffmpeg',
-            '-i', final_video,                # Original video with audio
-            '-i', background_music,           # Background music
-            '-filter_complex', f'[0:a]volume={video_volume}[v0];[1:a]volume={bgm_volume}[v1];[v0][v1]amix=inputs=2:duration=first[a]',
-            '-map', '0:v',                    # Use video from the original input
-            '-map', '[a]',                    # Use the mixed audio
-            '-c:v', 'copy',                       # Copy the original video codec
-            '-c:a', 'aac',                    # Encode the audio as AAC
-            final_video_with_bgm,
-            '-y',
-            '-threads', '2'
-        ]
-        subprocess.run(ffmpeg_command_bgm)
-        os.remove(final_video)
-        os.rename(final_video_with_bgm, final_video)
-        time.sleep(1)
-
-    if subtitles:
-        final_video_with_subtitles = final_video.replace('.mp4', '_subtitles.mp4')
-        add_subtitles(final_video, srt_path, final_video_with_subtitles, subtitle_filter, 'ffmpeg')
-        # os.remove(final_video)
-        os.rename(final_video_with_subtitles, final_video)
-        time.sleep(1)
-
+        inputs += ['-i', background_music]
+    filter_complex = build_filter_graph(width, height, speed_up, watermark=bool(watermark_path),
+                                        subtitle_filter=subtitle_filter if subtitles else None,
+                                        background_music=bool(background_music),
+                                        bgm_volume=bgm_volume, video_volume=video_volume)
+    # Rendered under a temporary name so a failed encode never leaves a video.mp4 behind
+    tmp_video = final_video.replace('.mp4', '.tmp.mp4')
+    ffmpeg_command = [
+        'ffmpeg',
+        *inputs,
+        '-filter_complex', filter_complex,
+        '-map', '[v]',
+        '-map', '[a]',
+        '-r', str(fps),
+        '-c:v', 'libx264',
+        '-preset', preset,
+        '-threads', str(threads),
+        '-c:a', 'aac',
+        '-y',
+        tmp_video,
+    ]
+    duration = get_duration(input_video)
+    run_ffmpeg(ffmpeg_command, duration / speed_up if duration else None, desc=f'Rendering {final_video}')
+    os.replace(tmp_video, final_video)
     return final_video
 
-def add_subtitles(video_path, srt_path, output_path, subtitle_filter = None, method='moviepy'):
-    """
-    给视频文件添加字幕。
-    
-    参数：
-        video_path (str): 输入视频文件的路径。
-        srt_path (str): .srt 字幕文件的路径。
-        output_path (str): 输出视频文件的路径。
-        method (str): 使用的方法 ('moviepy' 或 'ffmpeg')，默认为 'moviepy'。
-    
-    返回：
-        bool: 成功返回 True，失败返回 False。
-    """
-    # try:
-    if method == 'moviepy':
-        from moviepy.editor import VideoFileClip, TextClip, CompositeVideoClip
-        from moviepy.video.tools.subtitles import SubtitlesClip
-
-        # 使用 moviepy 添加字幕
-        video = VideoFileClip(video_path)
-        generator = lambda txt: TextClip(txt, font='font/SimHei.ttf', fontsize=24, color='white')
-        subtitles = SubtitlesClip(srt_path, generator)
-
-        final_video = final_video.set_subtitles(subtitles)
-        # 合成字幕和视频
-        # final_video = CompositeVideoClip([video, subtitles.set_pos(('center', 'bottom'))])
-
-        # 保存视频
-        final_video.write_videofile(output_path, fps=video.fps)
-        return True
-
-    elif method == 'ffmpeg':
-        # 使用 ffmpeg 添加字幕
-        command = [
-            'ffmpeg',
-            '-i', video_path,
-            '-vf', f"subtitles={srt_path}" if subtitle_filter is None else subtitle_filter,
-            output_path,
-            '-y',
-            '-threads', '2',
-        ]
-
-        subprocess.run(command, check=True)
-        return True
-
-    else:
-        print("Unsupported method. Please use 'moviepy' or 'ffmpeg'.")
-        return False
-    
-    # except Exception as e:
-    #     print(f"An error occurred: {e}")
-    #     return False
-
-def synthesize_all_video_under_folder(folder, subtitles=True, speed_up=1.00, fps=30, background_music=None, bgm_volume=0.5, video_volume=1.0, resolution='1080p', watermark_path='docs/linly_watermark.png'):
+def synthesize_all_video_under_folder(folder, subtitles=True, speed_up=1.00, fps=30, background_music=None, bgm_volume=0.5, video_volume=1.0, resolution='1080p', watermark_path='docs/linly_watermark.png',
+                                      preset='medium', threads=0):
     watermark_path = None if not os.path.exists(watermark_path) else watermark_path
     output_video = None
-    for root, dirs, files in os.walk(folder):
-        if 'download.mp4' in files:
+    for root in list_video_folders(folder):
+        if not os.path.exists(os.path.join(root, 'download.mp4')):
+            continue
+        manifest = Manifest(root)
+        inputs = ['download.mp4', 'audio_combined.wav', 'translation.json']
+        inputs += [os.path.abspath(path) for path in (background_music, watermark_path) if path]
+        params = {'subtitles': subtitles, 'speed_up': speed_up, 'fps': fps, 'resolution': resolution,
+                  'bgm_volume': bgm_volume, 'video_volume': video_volume}
+        if preset != 'medium':
+            params['preset'] = preset
+        # video.mp4 files made before the manifest existed carry unknown settings, never adopt them
+        if manifest.needs_run('synthesis', inputs, params, ['video.mp4'], adopt=False):
             output_video = synthesize_video(root, subtitles=subtitles,
                             speed_up=speed_up, fps=fps, resolution=resolution,
                             background_music=background_music,
-                            watermark_path=watermark_path, bgm_volume=bgm_volume, video_volume=video_volume)
-        # if 'download.mp4' in files and 'video.mp4' not in files:
-        #     output_video = synthesize_video(root, subtitles=subtitles,
-        #                      speed_up=speed_up, fps=fps, resolution=resolution,
-        #                      background_music=background_music,
-        #                      watermark_path=watermark_path, bgm_volume=bgm_volume, video_volume=video_volume)
-        # elif 'video.mp4' in files:
-        #     output_video = os.path.join(root, 'video.mp4')
-        #     logger.info(f'Video already synthesized in {folder}')
+                            watermark_path=watermark_path, bgm_volume=bgm_volume, video_volume=video_volume,
+                            preset=preset, threads=threads)
+            if output_video:
+                manifest.record('synthesis', inputs, params, ['video.mp4'])
+        else:
+            output_video = os.path.join(root, 'video.mp4')
+            logger.info(f'Video already synthesized in {root}')
+        # The video is done, drop what is left of its decoded audio buffers
+        clear_cache(root)
     return f'Synthesized all videos under {folder}', output_video
 
 if __name__ == '__main__':
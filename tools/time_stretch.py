@@ -0,0 +1,81 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def _next_pow2(n):
+    return 1 << (int(n) - 1).bit_length()
+
+
+def _wsola(wavs, ratios, frame_length, tolerance):
+    """
+    WSOLA of a batch of signals in lockstep: the loop runs over output frames and every step picks,
+    for all signals at once, the analysis frame within +-tolerance of its nominal position that best
+    continues the previously copied frame, with the cross-correlations of the whole batch done by rfft.
+    """
+    hop = frame_length // 2
+    window = np.hanning(frame_length + 1)[:-1].astype(np.float32)  # periodic Hann sums to 1 at 50% overlap
+    lengths = np.array([len(wav) for wav in wavs])
+    ratios = np.asarray(ratios, dtype=np.float64)
+    analysis_hops = hop / ratios
+    output_lengths = np.round(lengths * ratios).astype(int)
+    num_frames = int(np.max(np.ceil(output_lengths / hop))) + 2
+
+    # Input sample t sits at padded index t + offset, so the frame read at `k * analysis_hop + tolerance`
+    # is centered on input sample k * analysis_hop, and every search region stays inside the buffer
+    offset = frame_length // 2 + tolerance
+    padded_length = int(np.ceil((num_frames + 1) * analysis_hops.max())) + 2 * tolerance + 2 * frame_length + offset
+    padded = np.zeros((len(wavs), padded_length), dtype=np.float32)
+    for i, wav in enumerate(wavs):
+        padded[i, offset:offset + len(wav)] = wav
+    output = np.zeros((len(wavs), (num_frames - 1) * hop + frame_length), dtype=np.float32)
+
+    # Read-only views of every frame, overlap and search region start, indexed [signal, start]
+    frames = sliding_window_view(padded, frame_length, axis=1)
+    overlaps = sliding_window_view(padded, hop, axis=1)
+    regions = sliding_window_view(padded, hop + 2 * tolerance, axis=1)
+    rows = np.arange(len(wavs))
+    n_fft = _next_pow2(hop + 2 * tolerance)
+    positions = np.full(len(wavs), tolerance)
+    output[:, :frame_length] = frames[rows, positions] * window
+    for k in range(1, num_frames):
+        # Match what followed the previous frame in the input over the half the two frames overlap
+        natural = overlaps[rows, positions + hop]
+        search_start = np.round(k * analysis_hops).astype(int)
+        correlation = np.fft.irfft(
+            np.fft.rfft(regions[rows, search_start], n_fft) * np.conj(np.fft.rfft(natural, n_fft)), n_fft)
+        positions = search_start + np.argmax(correlation[:, :2 * tolerance + 1], axis=1)
+        output[:, k * hop:k * hop + frame_length] += frames[rows, positions] * window
+
+    return [output[i, frame_length // 2:frame_length // 2 + n] for i, n in enumerate(output_lengths)]
+
+
+def stretch_batch(wavs, ratios, sample_rate=24000, frame_ms=40, tolerance_ms=10, batch_size=64):
+    """
+    Time-stretch every wav in wavs by its ratio (output length / input length) without changing the
+    pitch, returning float32 arrays of round(len(wav) * ratio) samples.
+
+    Signals are sorted by output length and processed batch_size at a time so the lockstep WSOLA pads
+    them little. A ratio of 1 returns the signal unchanged.
+    """
+    frame_length = 2 * round(frame_ms / 1000 * sample_rate / 2)
+    tolerance = round(tolerance_ms / 1000 * sample_rate)
+    outputs = [None] * len(wavs)
+    todo = []
+    for i, (wav, ratio) in enumerate(zip(wavs, ratios)):
+        if ratio == 1 or len(wav) == 0:
+            outputs[i] = np.asarray(wav, dtype=np.float32)
+        else:
+            todo.append(i)
+    todo.sort(key=lambda i: len(wavs[i]) * ratios[i])
+    for start in range(0, len(todo), batch_size):
+        batch = todo[start:start + batch_size]
+        stretched = _wsola([np.asarray(wavs[i], dtype=np.float32) for i in batch], [ratios[i] for i in batch],
+                           frame_length, tolerance)
+        for i, wav in zip(batch, stretched):
+            outputs[i] = wav
+    return outputs
+
+
+def stretch(wav, ratio, sample_rate=24000, **kwargs):
+    """Time-stretch a single wav, see stretch_batch."""
+    return stretch_batch([wav], [ratio], sample_rate, **kwargs)[0]
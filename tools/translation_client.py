@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from loguru import logger
+
+from .step031_translation_openai import openai_request
+from .step033_translation_translator import translate_text
+from .step034_translation_ernie import ernie_response
+
+
+class TokenBucket:
+    """
+    Token bucket for asyncio code: acquire() returns at most `rate` times per second on average,
+    with bursts of up to `capacity` calls.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _retryable(error):
+    # Client errors other than rate limiting will fail the same way again
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return True
+
+
+class AsyncTranslationClient:
+    """
+    Async front end of the remote translation backends ('OpenAI', 'Ernie', 'Google Translate' and
+    'Bing Translate'). Requests run on worker threads over one pooled requests.Session, at most
+    `concurrency` at a time and, if `rate` is given, at most `rate` per second. Failed requests are
+    retried with exponential backoff and jitter.
+
+    Use it inside a running event loop and close() it afterwards:
+
+        client = AsyncTranslationClient('OpenAI', concurrency=8)
+        try:
+            responses = await asyncio.gather(*[client.chat(messages) for messages in requests])
+        finally:
+            client.close()
+    """
+
+    def __init__(self, method, concurrency=8, rate=None, max_retries=5, backoff=1.0, max_backoff=30.0, timeout=240):
+        assert method in ['OpenAI', 'Ernie', 'Google Translate', 'Bing Translate'], f'{method} has no async client'
+        self.method = method
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(rate) if rate else None
+
+    async def _call(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            async with self.semaphore:
+                if self.bucket is not None:
+                    await self.bucket.acquire()
+                try:
+                    return await loop.run_in_executor(self.executor, fn, *args)
+                except Exception as e:
+                    if attempt == self.max_retries or not _retryable(e):
+                        raise
+                    delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1)
+                    logger.warning(f'{self.method} request failed, retrying in {delay:.1f}s: {e}')
+            # Back off without holding a concurrency slot
+            await asyncio.sleep(delay)
+
+    def _chat(self, messages):
+        if self.method == 'OpenAI':
+            response = openai_request(self.session, messages, timeout=self.timeout)
+        else:
+            response = ernie_response(messages[1:], system=messages[0]['content'], session=self.session,
+                                      timeout=self.timeout)
+        if response is None:
+            raise Exception(f'Empty {self.method} response')
+        return response
+
+    async def chat(self, messages):
+        """Chat completion of messages, a system message followed by the conversation."""
+        return await self._call(self._chat, messages)
+
+    async def translate_text(self, text, to_language):
+        server = 'google' if self.method == 'Google Translate' else 'bing'
+        return await self._call(translate_text, text, to_language, server)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+class BatchingChat:
+    """
+    Collects the chat requests that concurrent tasks make in the same turn of the event loop and
+    answers them with one `batch_fn(list of messages) -> list of responses` call on a worker thread,
+    at most max_batch at a time. Lets the local LLM serve the concurrent translation paths.
+    """
+
+    def __init__(self, batch_fn, max_batch=8):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.pending = []
+        self.task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        # Let every task that is ready queue its request first
+        await asyncio.sleep(0)
+        while self.pending:
+            batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+            try:
+                responses = await loop.run_in_executor(None, self.batch_fn, [messages for messages, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), response in zip(batch, responses):
+                    future.set_result(response)
+            await asyncio.sleep(0)
+
+    async def chat(self, messages):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((messages, future))
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._run())
+        return await future
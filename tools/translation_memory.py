@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import difflib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from loguru import logger
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS memory (
+    kind TEXT NOT NULL,
+    source TEXT NOT NULL,
+    target_language TEXT NOT NULL,
+    method TEXT NOT NULL,
+    model TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    translation TEXT NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (kind, source, target_language, method, model)
+);
+CREATE INDEX IF NOT EXISTS memory_last_used ON memory (last_used);
+CREATE INDEX IF NOT EXISTS memory_length ON memory (kind, target_language, method, model, length);
+'''
+
+
+def normalize(text):
+    """Key of a source text: NFKC, with runs of whitespace collapsed and the ends stripped."""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFKC', text)).strip()
+
+
+class TranslationMemory:
+    """
+    Translations shared across videos and runs, in an SQLite file keyed on the normalized source
+    text, the target language, the method and the model. `kind` keeps transcript lines apart from
+    other cached results such as summaries.
+
+    With fuzzy_threshold set, a lookup that has no exact match returns the translation of the most
+    similar stored line if its difflib ratio reaches the threshold. Past max_entries, the least
+    recently used entries are evicted.
+    """
+
+    def __init__(self, path, max_entries=200000, fuzzy_threshold=None, fuzzy_candidates=200):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.fuzzy_threshold = fuzzy_threshold
+        self.fuzzy_candidates = fuzzy_candidates
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self.lock, self.connection:
+            # WAL lets several processes read while one writes
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.executescript(SCHEMA)
+        self.hits = self.fuzzy_hits = self.misses = self.evictions = 0
+
+    def _fuzzy(self, kind, source, key):
+        low, high = int(len(source) * self.fuzzy_threshold), int(len(source) / self.fuzzy_threshold) + 1
+        rows = self.connection.execute(
+            'SELECT source, translation FROM memory WHERE kind=? AND target_language=? AND method=? AND model=? '
+            'AND length BETWEEN ? AND ? ORDER BY last_used DESC LIMIT ?',
+            (kind, *key, low, high, self.fuzzy_candidates)).fetchall()
+        best, best_ratio = None, self.fuzzy_threshold
+        matcher = difflib.SequenceMatcher(None, b=source, autojunk=False)
+        for candidate, translation in rows:
+            matcher.set_seq1(candidate)
+            if matcher.real_quick_ratio() < best_ratio or matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = (candidate, translation), ratio
+        return best
+
+    def get_many(self, texts, target_language, method, model='', kind='line'):
+        """Translations of texts, None where the memory has none."""
+        key = (target_language, method, model or '')
+        now = time.time()
+        results = []
+        with self.lock, self.connection:
+            for text in texts:
+                source = normalize(text)
+                row = self.connection.execute(
+                    'SELECT source, translation FROM memory WHERE kind=? AND source=? AND target_language=? '
+                    'AND method=? AND model=?', (kind, source, *key)).fetchone()
+                if row is not None:
+                    self.hits += 1
+                elif self.fuzzy_threshold and source:
+                    row = self._fuzzy(kind, source, key)
+                    if row is not None:
+                        self.fuzzy_hits += 1
+                if row is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self.connection.execute(
+                    'UPDATE memory SET hits=hits+1, last_used=? WHERE kind=? AND source=? AND target_language=? '
+                    'AND method=? AND model=?', (now, kind, row[0], *key))
+                results.append(row[1])
+        return results
+
+    def get(self, text, target_language, method, model='', kind='line'):
+        return self.get_many([text], target_language, method, model, kind)[0]
+
+    def put_many(self, texts, translations, target_language, method, model='', kind='line'):
+        """Store translations of texts; empty translations, which mark failures, are skipped."""
+        key = (target_language, method, model or '')
+        now = time.time()
+        rows = [(kind, normalize(text), *key, len(normalize(text)), translation, now)
+                for text, translation in zip(texts, translations) if translation]
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT INTO memory (kind, source, target_language, method, model, length, translation, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (kind, source, target_language, method, model) '
+                'DO UPDATE SET translation=excluded.translation, last_used=excluded.last_used', rows)
+            self._evict()
+
+    def put(self, text, translation, target_language, method, model='', kind='line'):
+        self.put_many([text], [translation], target_language, method, model, kind)
+
+    def _evict(self):
+        count = self.connection.execute('SELECT COUNT(*) FROM memory').fetchone()[0]
+        if count <= self.max_entries:
+            return
+        self.connection.execute(
+            'DELETE FROM memory WHERE rowid IN (SELECT rowid FROM memory ORDER BY last_used LIMIT ?)',
+            (count - self.max_entries,))
+        self.evictions += count - self.max_entries
+
+    def stats(self):
+        with self.lock:
+            entries, hits = self.connection.execute('SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM memory').fetchone()
+        lookups = self.hits + self.fuzzy_hits + self.misses
+        return {
+            'entries': entries,
+            'lifetime_hits': hits,
+            'hits': self.hits,
+            'fuzzy_hits': self.fuzzy_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': (self.hits + self.fuzzy_hits) / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+translation_memory = None
+_init_lock = threading.Lock()
+
+
+def get_translation_memory():
+    """
+    The process-wide memory configured by TRANSLATION_MEMORY_PATH (unset or empty to disable, such
+    as models/translation_memory.sqlite), TRANSLATION_MEMORY_MAX_ENTRIES and
+    TRANSLATION_MEMORY_FUZZY (a similarity threshold such as 0.95, unset for exact matches only).
+    """
+    global translation_memory
+    path = os.getenv('TRANSLATION_MEMORY_PATH', '')
+    if not path:
+        return None
+    with _init_lock:
+        if translation_memory is None:
+            fuzzy = os.getenv('TRANSLATION_MEMORY_FUZZY')
+            translation_memory = TranslationMemory(
+                path, max_entries=int(os.getenv('TRANSLATION_MEMORY_MAX_ENTRIES', 200000)),
+                fuzzy_threshold=float(fuzzy) if fuzzy else None)
+            logger.info(f'Translation memory: {path}')
+    return translation_memory
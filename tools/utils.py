@@ -1,5 +1,6 @@
 import re
 import string
+import wave
 import numpy as np
 from scipy.io import wavfile
 
@@ -30,6 +31,26 @@ def normalize_wav(wav_path: str) -> None:
     wav_norm = wav * (32767 / max(0.01, np.max(np.abs(wav))))
     wavfile.write(wav_path, sample_rate, wav_norm.astype(np.int16))
 
+class WavWriter:
+    # Appends samples to a 16-bit wav, scaled the same way as save_wav
+    def __init__(self, output_path: str, sample_rate=24000, channels=1):
+        self.file = wave.open(output_path, 'wb')
+        self.file.setnchannels(channels)
+        self.file.setsampwidth(2)
+        self.file.setframerate(sample_rate)
+
+    def write(self, wav: np.ndarray):
+        self.file.writeframes((wav * 32767).astype(np.int16).tobytes())
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 SUPPORT_VOICE = ['zu-ZA-ThembaNeural', 'zu-ZA-ThandoNeural',  'zh-TW-YunJheNeural', 'zh-TW-HsiaoYuNeural', 'zh-TW-HsiaoChenNeural', 'zh-HK-WanLungNeural', 
     'zh-HK-HiuMaanNeural', 'zh-HK-HiuGaaiNeural', 'zh-CN-shaanxi-XiaoniNeural', 'zh-CN-liaoning-XiaobeiNeural', 
     'zh-CN-YunyangNeural', 'zh-CN-YunxiaNeural', 'zh-CN-YunxiNeural', 'zh-CN-YunjianNeural', 
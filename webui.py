@@ -45,6 +45,8 @@ full_auto_interface = gr.Interface(
         gr.Radio([None, 1, 2, 3, 4, 5], label='Max Speakers', value=None),
         gr.Dropdown(['OpenAI', 'LLM', 'Google Translate'], label='Translation Method', value='LLM'),
         gr.Dropdown(['Chinese', 'English', 'Japanese', 'Korean'], label='Target Language', value='Chinese'),
+        gr.Slider(minimum=1, maximum=50, step=1, label='Translation Lines per Request', value=20),
+        gr.Slider(minimum=1, maximum=32, step=1, label='Concurrent Translation Requests (1 keeps the translated context)', value=1),
         gr.Dropdown(['xtts', 'cosyvoice', 'EdgeTTS'], label='TTS Method', value='xtts'),
         gr.Dropdown(SUPPORT_VOICE, value='zh-CN-XiaoxiaoNeural', label='EdgeTTS Voice'),
         gr.Checkbox(label='Add Subtitles', value=True),